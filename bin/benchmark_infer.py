@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017 Natural Language Processing Group, Nanjing University, zhaocq.nlp@gmail.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Entrance for benchmarking the decoding speed of a trained NMT model.
+
+Example:
+  python -m bin.benchmark_infer --model_dir test_models \
+    --infer "
+      source_words_vocabulary: testdata/vocab.zh
+      target_words_vocabulary: testdata/vocab.en" \
+    --benchmark "
+      batch_sizes: [1, 16]
+      beam_sizes: [1, 4]
+      lengths: [10, 30]
+      output_file: benchmark.json"
+"""
+import copy
+import json
+import resource
+import subprocess
+import time
+
+import numpy
+import tensorflow as tf
+
+from njunmt.data.data_reader import LineReader
+from njunmt.data.text_inputter import TextLineInputter
+from njunmt.data.vocab import Vocab
+from njunmt.inference.decode import infer
+from njunmt.inference.shortlist import create_shortlist
+from njunmt.models.model_builder import model_fn
+from njunmt.nmt_experiment import InferExperiment
+from njunmt.utils.configurable import ModelConfigs
+from njunmt.utils.configurable import deep_merge_dict
+from njunmt.utils.configurable import define_tf_flags
+from njunmt.utils.configurable import load_from_config_path
+from njunmt.utils.configurable import parse_params
+from njunmt.utils.configurable import print_params
+from njunmt.utils.configurable import update_configs_from_flags
+from njunmt.utils.configurable import update_infer_params
+from njunmt.utils.constants import ModeKeys
+
+# define arguments for benchmark_infer.py
+# format: {arg_name: [type, default_val, helper]}
+BENCHMARK_ARGS = {
+    "config_paths": ["string", "", """Path to a yaml configuration files defining FLAG values.
+                                   Multiple files can be separated by commas. Files are merged recursively.
+                                   Setting a key in these files is equivalent to
+                                   setting the FLAG value with the same name."""],
+    "infer": ["string", "", """A yaml-style string defining the inference options."""],
+    "benchmark": ["string", "", """A yaml-style string defining the benchmark options."""],
+    "model_dir": ["string", "models", """The path to load the model. """],
+}
+
+FLAGS = define_tf_flags(BENCHMARK_ARGS)
+
+
+def default_benchmark_options():
+    """ Returns a dictionary of default benchmark options. """
+    return {
+        # a file of real sentences, if provided, `lengths` is ignored
+        "input_file": None,
+        # the number of sentences decoded for each setting
+        "num_sentences": 256,
+        "batch_sizes": [1, 8, 32],
+        "beam_sizes": [1, 4],
+        # the number of words of synthetic sentences
+        "lengths": [10, 30, 50],
+        # the number of batches decoded before timing each setting
+        "warmup_batches": 2,
+        "seed": 1234,
+        "output_file": "benchmark.json"}
+
+
+def _current_commit():
+    """ Returns the git commit of the working directory, or None. """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            stderr=subprocess.STDOUT).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _peak_rss_mb():
+    """ Returns the peak resident set size of this process in MB. """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def _make_synthetic_sentences(vocab, num_sentences, length, rng):
+    """ Samples sentences of `length` words from the vocabulary.
+
+    Args:
+        vocab: A `Vocab` instance.
+        num_sentences: The number of sentences.
+        length: The number of words of each sentence.
+        rng: A `numpy.random.RandomState` instance.
+
+    Returns: A list of strings.
+    """
+    # the special symbols are at the end of the vocabulary
+    num_words = vocab.vocab_size - 3
+    words = [vocab.vocab_r_dict[i].replace("@@", "") for i in range(num_words)]
+    return [" ".join([words[i] for i in rng.randint(0, num_words, size=length)])
+            for _ in range(num_sentences)]
+
+
+def _decode(sess, predict_op, input_fields, sentences, vocab_source,
+            vocab_target, batch_size, infer_options, shortlist=None, profile=None):
+    """ Decodes `sentences` like bin.infer does, without output file.
+
+    Returns: The elapsed seconds.
+    """
+    text_inputter = TextLineInputter(
+        line_readers=LineReader(
+            data=sentences,
+            preprocessing_fn=lambda x: vocab_source.convert_to_idlist(x)),
+        padding_id=vocab_source.pad_id,
+        batch_size=batch_size,
+        bucketing=infer_options["bucketing"])
+    start_time = time.time()
+    infer(sess=sess,
+          prediction_op=predict_op,
+          infer_data=text_inputter.make_feeding_data(
+              input_fields=input_fields, in_memory=False),
+          output=None,
+          vocab_source=vocab_source,
+          vocab_target=vocab_target,
+          delimiter=infer_options["delimiter"],
+          output_attention=False,
+          tokenize_output=infer_options["char_level"],
+          verbose=False,
+          return_results=False,
+          profile=profile,
+          shortlist=shortlist,
+          input_fields=input_fields)
+    return time.time() - start_time
+
+
+def benchmark(model_configs, benchmark_options):
+    """ Decodes each setting of the sweep and collects the measurements.
+
+    Args:
+        model_configs: A dictionary of all configurations.
+        benchmark_options: A dictionary of benchmark options.
+
+    Returns: A list of dicts, one for each setting.
+    """
+    infer_options = model_configs["infer"]
+    vocab_source = Vocab(
+        filename=infer_options["source_words_vocabulary"],
+        bpe_codes=infer_options["source_bpecodes"],
+        reverse_seq=model_configs["train"]["features_r2l"])
+    vocab_target = Vocab(
+        filename=infer_options["target_words_vocabulary"],
+        bpe_codes=infer_options["target_bpecodes"],
+        reverse_seq=model_configs["train"]["labels_r2l"])
+    shortlist = create_shortlist(infer_options, vocab_source, vocab_target)
+    rng = numpy.random.RandomState(benchmark_options["seed"])
+    if benchmark_options["input_file"]:
+        with open(benchmark_options["input_file"]) as fp:
+            lines = [line.strip() for line in fp][:benchmark_options["num_sentences"]]
+        datasets = [("input", lines)]
+    else:
+        datasets = [(length, _make_synthetic_sentences(
+            vocab_source, benchmark_options["num_sentences"], length, rng))
+                    for length in benchmark_options["lengths"]]
+
+    results = []
+    for beam_size in benchmark_options["beam_sizes"]:
+        # the beam size is fixed in the graph
+        tf.reset_default_graph()
+        configs = update_infer_params(
+            copy.deepcopy(model_configs),
+            beam_size=beam_size,
+            maximum_labels_length=infer_options["maximum_labels_length"],
+            max_length_ratio=infer_options["max_length_ratio"],
+            max_length_offset=infer_options["max_length_offset"],
+            length_penalty=infer_options["length_penalty"],
+            early_exit=infer_options["early_exit"],
+            preallocate_cache=infer_options["preallocate_cache"],
+            use_shortlist=shortlist is not None)
+        estimator_spec = model_fn(model_configs=configs, mode=ModeKeys.INFER,
+                                  vocab_source=vocab_source, vocab_target=vocab_target,
+                                  name=configs["problem_name"], verbose=False)
+        sess = InferExperiment._build_default_session()
+        checkpoint_path = tf.train.latest_checkpoint(model_configs["model_dir"])
+        if not checkpoint_path:
+            raise OSError("File NOT Found. Fail to find checkpoint file from: {}"
+                          .format(model_configs["model_dir"]))
+        tf.train.Saver().restore(sess, checkpoint_path)
+
+        for length, sentences in datasets:
+            for batch_size in benchmark_options["batch_sizes"]:
+                _decode(sess, estimator_spec.predictions, estimator_spec.input_fields,
+                        sentences[:batch_size * benchmark_options["warmup_batches"]],
+                        vocab_source, vocab_target, batch_size, infer_options,
+                        shortlist=shortlist)
+                profile = dict()
+                elapsed = _decode(sess, estimator_spec.predictions, estimator_spec.input_fields,
+                                  sentences, vocab_source, vocab_target, batch_size,
+                                  infer_options, shortlist=shortlist, profile=profile)
+                latency = numpy.array(profile["batch_latency"])
+                result = {
+                    "beam_size": beam_size,
+                    "batch_size": batch_size,
+                    "length": length,
+                    "num_sentences": len(sentences),
+                    "elapsed": elapsed,
+                    "sentences_per_sec": len(sentences) / elapsed,
+                    "source_tokens_per_sec": profile["num_source_tokens"] / elapsed,
+                    "target_tokens_per_sec": profile["num_target_tokens"] / elapsed,
+                    "batch_latency_p50": float(numpy.percentile(latency, 50)),
+                    "batch_latency_p95": float(numpy.percentile(latency, 95)),
+                    "batch_latency_p99": float(numpy.percentile(latency, 99)),
+                    "peak_rss_mb": _peak_rss_mb(),
+                    "stages": {key: profile[key] for key in
+                               ["preprocess", "session", "postprocess", "detokenize"]}}
+                tf.logging.info("beam_size={beam_size} batch_size={batch_size} length={length}: "
+                                "{sentences_per_sec:.2f} sents/s, {target_tokens_per_sec:.2f} tokens/s, "
+                                "p50 {batch_latency_p50:.4f}s, p99 {batch_latency_p99:.4f}s"
+                                .format(**result))
+                results.append(result)
+        sess.close()
+    return results
+
+
+def main(_argv):
+    # load flags from config file
+    model_configs = load_from_config_path(FLAGS.config_paths)
+    # replace parameters in configs_file with tf FLAGS
+    model_configs = update_configs_from_flags(model_configs, FLAGS, BENCHMARK_ARGS.keys())
+    model_configs = deep_merge_dict(model_configs, ModelConfigs.load(FLAGS.model_dir))
+    model_configs = update_configs_from_flags(model_configs, FLAGS, BENCHMARK_ARGS.keys())
+    model_configs["infer"] = parse_params(
+        params=model_configs["infer"],
+        default_params=InferExperiment.default_inference_options())
+    benchmark_options = parse_params(
+        params=model_configs.get("benchmark", None),
+        default_params=default_benchmark_options())
+    print_params("Inference parameters: ", model_configs["infer"])
+    print_params("Benchmark parameters: ", benchmark_options)
+
+    results = benchmark(model_configs, benchmark_options)
+    with open(benchmark_options["output_file"], "w") as fw:
+        json.dump({"commit": _current_commit(),
+                   "model_dir": FLAGS.model_dir,
+                   "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                   "results": results}, fw, indent=2)
+    tf.logging.info("Saving benchmark results into {}.".format(benchmark_options["output_file"]))
+
+
+if __name__ == "__main__":
+    tf.logging.set_verbosity(tf.logging.INFO)
+    tf.app.run()
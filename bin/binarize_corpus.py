@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017 Natural Language Processing Group, Nanjing University, zhaocq.nlp@gmail.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Entrance for binarizing a training corpus, so that training reads the
+token ids through numpy.memmap instead of tokenizing text in every epoch.
+
+Example:
+  python -m bin.binarize_corpus --input testdata/toy.zh \
+    --output_prefix toy.zh.bin --vocabulary testdata/vocab.zh
+
+  and then train with:
+    data:
+      train_features_file: toy.zh.bin
+      train_labels_file: toy.en0.bin
+      binarized_train_data: true
+
+Note that BPE (`bpecodes`) and the sequence direction (`reverse_seq`,
+i.e. `features_r2l` or `labels_r2l` of the training options) are applied
+when binarizing, so they must be the same as those used for training.
+"""
+import tensorflow as tf
+
+from njunmt.data.data_reader import LineReader
+from njunmt.data.data_reader import binarize_lines
+from njunmt.data.vocab import Vocab
+from njunmt.utils.configurable import define_tf_flags
+
+# define arguments for binarize_corpus.py
+# format: {arg_name: [type, default_val, helper]}
+BINARIZE_ARGS = {
+    "input": ["string", "", """The tokenized text file to be binarized."""],
+    "output_prefix": ["string", "", """The prefix of the output files."""],
+    "vocabulary": ["string", "", """The vocabulary file."""],
+    "bpecodes": ["string", "", """The BPE codes file, if BPE is applied."""],
+    "reverse_seq": ["boolean", False, """Whether to reverse the sequences."""],
+}
+
+FLAGS = define_tf_flags(BINARIZE_ARGS)
+
+
+def main(_argv):
+    bpe_codes = {"codes": FLAGS.bpecodes} if FLAGS.bpecodes else None
+    vocab = Vocab(filename=FLAGS.vocabulary,
+                  bpe_codes=bpe_codes,
+                  reverse_seq=FLAGS.reverse_seq)
+    line_reader = LineReader(
+        data=FLAGS.input,
+        preprocessing_fn=lambda x: vocab.convert_to_idlist(x))
+    meta = binarize_lines(line_reader, vocab, FLAGS.output_prefix)
+    line_reader.close()
+    tf.logging.info("Binarized {} lines ({} tokens) of {} into {}.*"
+                    .format(meta["num_lines"], meta["num_tokens"],
+                            FLAGS.input, FLAGS.output_prefix))
+
+
+if __name__ == "__main__":
+    tf.logging.set_verbosity(tf.logging.INFO)
+    tf.app.run()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017 Natural Language Processing Group, Nanjing University, zhaocq.nlp@gmail.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Wire protocol shared by the translate server and its clients.
+
+Each message is a frame: a 4-byte big-endian unsigned length header
+followed by that many bytes of UTF-8 encoded JSON. This module does not
+depend on tensorflow so that clients can import it alone.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import struct
+
+HEADER = struct.Struct(">I")
+
+# refuse frames larger than this (bytes), a guard against garbage headers
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+class FrameError(IOError):
+    """ Raised when a frame is truncated or malformed. """
+    pass
+
+
+def wrap_message(**args):
+    """ Encodes keyword arguments as a JSON frame body. """
+    return json.dumps(args).encode("utf-8")
+
+
+def unwrap_message(json_str):
+    """ Decodes a JSON frame body, falling back to an error command. """
+    try:
+        return json.loads(json_str.decode("utf-8"))
+    except (ValueError, UnicodeDecodeError):
+        return {"command": "control", "content": "error"}
+
+
+def _recv_exactly(sock, size):
+    """ Reads exactly `size` bytes from `sock`.
+
+    Args:
+        sock: A connected socket.
+        size: The number of bytes to read.
+
+    Returns: The bytes read, or None if the peer closed the connection
+      before sending any byte.
+
+    Raises:
+        FrameError: if the connection is closed in the middle.
+    """
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = sock.recv(min(remaining, 1024 * 1024))
+        if not chunk:
+            if remaining == size:
+                return None
+            raise FrameError("Connection closed with {} of {} bytes unread."
+                             .format(remaining, size))
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def write_frame(sock, **args):
+    """ Sends keyword arguments as one frame.
+
+    Args:
+        sock: A connected socket.
+        **args: The JSON-serializable fields of the message.
+    """
+    body = wrap_message(**args)
+    sock.sendall(HEADER.pack(len(body)) + body)
+
+
+def read_frame(sock, max_frame_size=MAX_FRAME_SIZE):
+    """ Receives one frame.
+
+    Args:
+        sock: A connected socket.
+        max_frame_size: The maximum allowed body size in bytes.
+
+    Returns: A dict, the decoded message, or None if the peer closed
+      the connection.
+
+    Raises:
+        FrameError: if the frame is truncated or too large.
+    """
+    header = _recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    size, = HEADER.unpack(header)
+    if size > max_frame_size:
+        raise FrameError("Frame of {} bytes exceeds the limit of {} bytes."
+                         .format(size, max_frame_size))
+    body = _recv_exactly(sock, size)
+    if body is None:
+        raise FrameError("Connection closed before the frame body.")
+    return unwrap_message(body)
@@ -18,10 +18,13 @@
 Generate vocabulary for a tokenized text file.
 """
 
+import io
 import sys
 import argparse
 import collections
+import heapq
 import logging
+import multiprocessing
 
 parser = argparse.ArgumentParser(
     description="Generate vocabulary for a tokenized text file.")
@@ -55,40 +58,196 @@ parser.add_argument(
     default=" ",
     help="Delimiter character for tokenizing. Use \" \" and \"\" for word and char level respectively."
 )
-args = parser.parse_args()
+parser.add_argument(
+    "--num_workers", "--num-workers",
+    dest="num_workers",
+    type=int,
+    default=1,
+    help="Number of processes counting the shards of the input file in parallel. "
+         "With --min_frequency or --max_vocab_size, the shards only send back the "
+         "tokens that can pass them, at the cost of extra passes over the file; "
+         "without them, all the counts are merged and only the counting is faster.")
+
+
+def count_tokens(lines, downcase, delimiter):
+  """Returns a Counter of the tokens of lines."""
+  cnt = collections.Counter()
+  for line in lines:
+    if downcase:
+      line = line.lower()
+    if delimiter == "":
+      tokens = list(line.strip())
+    else:
+      tokens = line.strip().split(delimiter)
+    tokens = [_ for _ in tokens if len(_) > 0]
+    cnt.update(tokens)
+  return cnt
+
+
+def read_shard(filename, start, end, encoding):
+  """Yields the lines between the byte offsets `start` and `end` of a file,
+  splitting them at "\\n", "\\r\\n" and "\\r" as text mode reading does."""
+  with io.open(filename, "rb") as fp:
+    fp.seek(start)
+    while fp.tell() < end:
+      line = fp.readline()
+      if not line:
+        break
+      if encoding:
+        line = line.decode(encoding)
+      for sub_line in line.replace(line[:0] + "\r\n", line[:0] + "\n").split(line[:0] + "\r"):
+        yield sub_line
+
+
+def count_shard(shard):
+  """Counts the tokens of a shard `(filename, start, end, encoding,
+  downcase, delimiter)` in a worker process."""
+  filename, start, end, encoding, downcase, delimiter = shard
+  return count_tokens(read_shard(filename, start, end, encoding),
+                      downcase, delimiter)
+
+
+def top_shard(args):
+  """Returns the `k` most frequent tokens of a shard with their counts."""
+  shard, k = args
+  return heapq.nlargest(k, count_shard(shard).items(), key=lambda x: (x[1], x[0]))
+
+
+def frequent_shard(args):
+  """Returns the tokens occurring at least `threshold` times in a shard."""
+  shard, threshold = args
+  return [w for w, c in count_shard(shard).items() if c >= threshold]
+
+
+_candidates = None
+
+
+def init_recount_worker(candidates):
+  """Shares the candidate tokens with a worker process."""
+  global _candidates
+  _candidates = candidates
 
-# Counter for all tokens in the vocabulary
-cnt = collections.Counter()
 
-for line in args.infile:
-  if args.downcase:
-    line = line.lower()
-  if args.delimiter == "":
-    tokens = list(line.strip())
+def recount_shard(shard):
+  """Counts the candidate tokens of a shard."""
+  return collections.Counter(
+      dict([(w, c) for w, c in count_shard(shard).items() if w in _candidates]))
+
+
+def split_shards(filename, encoding, downcase, delimiter, num_shards):
+  """Splits a file into at most `num_shards` shards at line boundaries."""
+  with io.open(filename, "rb") as fp:
+    fp.seek(0, 2)
+    size = fp.tell()
+    offsets = [0]
+    for k in range(1, num_shards):
+      fp.seek(max(size * k // num_shards, offsets[-1]))
+      if fp.tell() > 0:
+        # move to the start of the next line
+        fp.seek(fp.tell() - 1)
+        fp.readline()
+      offsets.append(fp.tell())
+    offsets.append(size)
+  return [(filename, start, end, encoding, downcase, delimiter)
+          for start, end in zip(offsets[:-1], offsets[1:]) if start < end]
+
+
+def map_shards(func, shards, num_workers, initializer=None, initargs=()):
+  """Applies `func` to the shards in a pool of worker processes, yielding
+  the results in the file order."""
+  pool = multiprocessing.Pool(num_workers, initializer, initargs)
+  try:
+    for result in pool.imap(func, shards):
+      yield result
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+
+
+def count_tokens_parallel(filename, encoding, downcase, delimiter, num_workers,
+                          min_frequency=0, max_vocab_size=None):
+  """Counts the tokens of a file in shards split at line boundaries.
+
+  Without `min_frequency` and `max_vocab_size`, the partial counters are
+  merged as they are. Otherwise only the tokens that can pass them are
+  merged, and their counts are exact:
+
+    1. with `max_vocab_size` N, each shard sends back its N most frequent
+       tokens. The N-th largest sum of these partial counts, `tau`, is a
+       lower bound of the count of the N-th token of the vocabulary;
+    2. a token occurring at least `T = max(min_frequency, tau)` times in
+       the file occurs at least `ceil(T / num_shards)` times in one of the
+       shards, so the shards send back their tokens above this threshold;
+    3. the shards recount these candidate tokens only.
+  """
+  shards = split_shards(filename, encoding, downcase, delimiter, num_workers * 4)
+  if min_frequency <= 0 and max_vocab_size is None:
+    cnt = collections.Counter()
+    for partial_cnt in map_shards(count_shard, shards, num_workers):
+      cnt.update(partial_cnt)
+    return cnt
+
+  threshold = max(min_frequency, 1)
+  if max_vocab_size is not None:
+    lower_bounds = collections.Counter()
+    for top_counts in map_shards(
+        top_shard, [(shard, max_vocab_size) for shard in shards], num_workers):
+      lower_bounds.update(dict(top_counts))
+    if len(lower_bounds) >= max_vocab_size:
+      tau = heapq.nlargest(max_vocab_size, lower_bounds.values())[-1]
+      threshold = max(threshold, tau)
+    del lower_bounds
+  shard_threshold = (threshold + len(shards) - 1) // len(shards)
+
+  candidates = set()
+  for tokens in map_shards(
+      frequent_shard, [(shard, shard_threshold) for shard in shards], num_workers):
+    candidates.update(tokens)
+  logging.info("Recounting %d candidate tokens with frequency >= %d in a shard.",
+               len(candidates), shard_threshold)
+
+  cnt = collections.Counter()
+  for partial_cnt in map_shards(recount_shard, shards, num_workers,
+                                init_recount_worker, (candidates,)):
+    cnt.update(partial_cnt)
+  return cnt
+
+
+def main():
+  args = parser.parse_args()
+
+  # Counter for all tokens in the vocabulary
+  if args.num_workers > 1 and args.infile is not sys.stdin:
+    cnt = count_tokens_parallel(args.infile.name, getattr(args.infile, "encoding", None),
+                                args.downcase, args.delimiter, args.num_workers,
+                                args.min_frequency, args.max_vocab_size)
   else:
-    tokens = line.strip().split(args.delimiter)
-  tokens = [_ for _ in tokens if len(_) > 0]
-  cnt.update(tokens)
+    cnt = count_tokens(args.infile, args.downcase, args.delimiter)
 
-logging.info("Found %d unique tokens in the vocabulary.", len(cnt))
+  logging.info("Found %d unique tokens in the vocabulary.", len(cnt))
 
-# Filter tokens below the frequency threshold
-if args.min_frequency > 0:
-  filtered_tokens = [(w, c) for w, c in cnt.most_common()
-                     if c >= args.min_frequency]
-  cnt = collections.Counter(dict(filtered_tokens))
+  # Filter tokens below the frequency threshold
+  if args.min_frequency > 0:
+    cnt = dict([(w, c) for w, c in cnt.items() if c >= args.min_frequency])
 
-logging.info("Found %d unique tokens with frequency > %d.",
-             len(cnt), args.min_frequency)
+  logging.info("Found %d unique tokens with frequency > %d.",
+               len(cnt), args.min_frequency)
+
+  # Sort tokens by 1. frequency 2. lexically to break ties
+  #   and take only max-vocab
+  if args.max_vocab_size is not None:
+    word_with_counts = heapq.nlargest(
+        args.max_vocab_size, cnt.items(), key=lambda x: (x[1], x[0]))
+  else:
+    word_with_counts = sorted(
+        cnt.items(), key=lambda x: (x[1], x[0]), reverse=True)
 
-# Sort tokens by 1. frequency 2. lexically to break ties
-word_with_counts = cnt.most_common()
-word_with_counts = sorted(
-    word_with_counts, key=lambda x: (x[1], x[0]), reverse=True)
+  for word, count in word_with_counts:
+    print("{}\t{}".format(word, count))
 
-# Take only max-vocab
-if args.max_vocab_size is not None:
-  word_with_counts = word_with_counts[:args.max_vocab_size]
 
-for word, count in word_with_counts:
-  print("{}\t{}".format(word, count))
+if __name__ == "__main__":
+  main()
@@ -35,7 +35,23 @@ INFER_ARGS = {
     "server_address": ["string", "", """IP and port, such as 123.456.789.0:1234"""],
 }
 
-FLAGS = define_tf_flags(INFER_ARGS)
+# options of the server itself, not merged into model configs
+SERVER_ARGS = {
+    "num_replicas": ["integer", 1, """The number of model replicas, each with its own session pinned to
+                                   an equal share of the CPU cores."""],
+    "intra_op_threads": ["integer", 0, """The intra-op threads of each replica session,
+                                       0 for the number of cores of the replica."""],
+    "inter_op_threads": ["integer", 0, """The inter-op threads of each replica session,
+                                       0 for the tensorflow default."""],
+    "max_wait_ms": ["integer", 10, """The maximum milliseconds to wait for a batch of sentences
+                                   from concurrent requests to fill before decoding."""],
+    "cache_size": ["integer", 10000, """The maximum number of cached translations, 0 for no caching."""],
+    "max_connections": ["integer", 64, """The maximum number of concurrent client connections, 0 for unlimited."""],
+    "connection_timeout": ["float", 300., """Seconds a client connection may stay idle before it is closed,
+                                          0 for never."""],
+}
+
+FLAGS = define_tf_flags(dict(INFER_ARGS, **SERVER_ARGS))
 
 
 def main(_argv):
@@ -52,7 +68,14 @@ def main(_argv):
     server = TranslateServer(addr, TranslateRequestHandler)
     server.init_experiment(model_configs=model_configs,
                            model_dirs=model_dirs,
-                           weight_scheme=FLAGS.weight_scheme)
+                           weight_scheme=FLAGS.weight_scheme,
+                           num_replicas=FLAGS.num_replicas,
+                           intra_op_threads=FLAGS.intra_op_threads,
+                           inter_op_threads=FLAGS.inter_op_threads)
+    server.init_scheduler(max_wait_ms=FLAGS.max_wait_ms,
+                          cache_size=FLAGS.cache_size)
+    server.init_connections(max_connections=FLAGS.max_connections,
+                            connection_timeout=FLAGS.connection_timeout)
     server.serve_forever()
 
 
@@ -12,10 +12,18 @@ from __future__ import division
 from __future__ import print_function
 
 from njunmt.ensemble_experiment import *
-import json
+from njunmt.data.text_inputter import pack_feed_dict
+from njunmt.inference.shortlist import create_shortlist
+from njunmt.utils.constants import Constants
+from njunmt.utils.lru_cache import LRUCache
+from .framing import FrameError, read_frame, write_frame
+import os
 import sys
 import errno
 import socket
+import threading
+import time
+from six.moves import queue
 
 if sys.version_info[0] < 3:
     import SocketServer as socketserver
@@ -23,18 +31,6 @@ else:
     import socketserver
 
 
-def wrap_message(**args):
-    # return bytes(json.dumps(args), encoding="UTF-8")
-    return json.dumps(args).encode()
-
-
-def unwrap_message(json_str):
-    try:
-        return json.loads(json_str.decode())
-    except:
-        return {"command": "control", "content": "error"}
-
-
 class SimpleEnsembleExperiment(EnsembleExperiment):
     def __init__(self,
                  model_configs,
@@ -59,14 +55,19 @@ class SimpleEnsembleExperiment(EnsembleExperiment):
         self._model_configs["infer"] = infer_options
         
         print_params("Model parameters: ", self._model_configs)
-        
-        self.experiment_spec = {
-            'model_configs': model_configs
-        }
 
-        self.init_experiment()
-        print("Start listening...")
-    
+    @property
+    def model_configs(self):
+        return self._model_configs
+
+    @property
+    def model_dirs(self):
+        return self._model_dirs
+
+    @model_dirs.setter
+    def model_dirs(self, model_dirs):
+        self._model_dirs = model_dirs
+
     def init_vocab(self):
         vocab_source = Vocab(
             filename=self._model_configs["infer"]["source_words_vocabulary"],
@@ -77,10 +78,10 @@ class SimpleEnsembleExperiment(EnsembleExperiment):
         
         return vocab_source, vocab_target
     
-    def init_model(self, sess, vocab_source, vocab_target):
+    def init_model(self, sess, vocab_source, vocab_target, model_dirs):
         print("Building model...")
         estimator_spec = model_fn_ensemble(
-            self._model_dirs, vocab_source, vocab_target,
+            model_dirs, vocab_source, vocab_target,
             weight_scheme=self._weight_scheme,
             inference_options=self._model_configs["infer"])
 
@@ -90,44 +91,570 @@ class SimpleEnsembleExperiment(EnsembleExperiment):
         print("Done.")
 
         return sess, predict_op, estimator_spec
-    
-    def init_experiment(self):
-        """ Runs ensemble model. """
-        print("Initialize experiment...")
-        sess = self._build_default_session()
-        vocab_source, vocab_target = self.init_vocab()
-        sess, predict_op, estimator_spec = self.init_model(sess, vocab_source, vocab_target)
-        
-        self.experiment_spec.update(**{
+
+    def build_experiment_spec(self, model_dirs, session_config=None):
+        """ Builds the model of `model_dirs` in a new `tf.Graph`, without
+        touching the one being served.
+
+        Args:
+            model_dirs: A list of model directories (checkpoints).
+            session_config: A `tf.ConfigProto` for the new session, or None
+              for the default one.
+
+        Returns: A dict of the new session, graph, ops and vocabularies.
+        """
+        graph = tf.Graph()
+        with graph.as_default():
+            if session_config is None:
+                sess = self._build_default_session()
+            else:
+                sess = tf.Session(config=session_config)
+            try:
+                vocab_source, vocab_target = self.init_vocab()
+                sess, predict_op, estimator_spec = self.init_model(
+                    sess, vocab_source, vocab_target, model_dirs)
+                shortlist = create_shortlist(
+                    self._model_configs["infer"], vocab_source, vocab_target)
+            except:
+                sess.close()
+                raise
+        return {
+            "model_configs": self._model_configs,
+            "graph": graph,
             "session": sess,
             "predict_op": predict_op,
             "vocab_source": vocab_source,
             "vocab_target": vocab_target,
             "estimator_spec": estimator_spec,
-            "model_info": {"model_dir": ", ".join(self._model_dirs)}
-        })
-        print("Done.")
-    
-    def reload_model(self, model_dirs):
-        print("Reloading model...")
+            "shortlist": shortlist,
+            "model_info": {"model_dir": ", ".join(model_dirs)}}
 
-        self._model_dirs = model_dirs.split(",")
 
-        self.experiment_spec['session'].close()
-        tf.reset_default_graph()
-        self.init_experiment()
+def split_cores(num_replicas):
+    """ Splits the CPU cores available to this process into `num_replicas`
+    sets of consecutive core ids. If the cores do not divide evenly, the
+    first replicas get one more core each.
 
-        print("Done.")
+    Args:
+        num_replicas: The number of sets.
 
+    Returns: A list of `num_replicas` core id lists, or a list of Nones if
+      there is only one replica, too few cores, or the platform does not
+      support CPU affinity.
+    """
+    if num_replicas <= 1 or not hasattr(os, "sched_getaffinity"):
+        return [None] * num_replicas
+    cores = sorted(os.sched_getaffinity(0))
+    if len(cores) < num_replicas:
+        print("WARNING: {} replicas on {} CPU cores, the replicas are not pinned to cores."
+              .format(num_replicas, len(cores)))
+        return [None] * num_replicas
+    size, remainder = divmod(len(cores), num_replicas)
+    core_sets = []
+    start = 0
+    for i in range(num_replicas):
+        end = start + size + (1 if i < remainder else 0)
+        core_sets.append(cores[start:end])
+        start = end
+    return core_sets
+
+
+class InferenceReplica(object):
+    """ One copy of the served model, with its own graph and session
+    whose threads are pinned to a set of CPU cores. """
+
+    def __init__(self, index, cores=None, intra_op_threads=0, inter_op_threads=0):
+        """ Initializes the replica, the model is loaded later.
+
+        Args:
+            index: The index of the replica.
+            cores: A list of CPU core ids to pin the replica to, or None.
+            intra_op_threads: The size of the intra-op thread pool of the
+              session, 0 for the number of `cores`.
+            inter_op_threads: The size of the inter-op thread pool of the
+              session, 0 for the tensorflow default.
+        """
+        self.index = index
+        self.cores = cores
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        # guards the session of `experiment_spec`
+        self.lock = threading.Lock()
+        self.experiment_spec = {}
+        # the number of sentences dispatched but not decoded yet
+        self.pending = 0
+        self.queue = queue.Queue()
+
+    def session_config(self):
+        """ Returns the `tf.ConfigProto` of the replica session, or None
+        for the default session. """
+        intra_op_threads = self.intra_op_threads
+        if intra_op_threads <= 0 and self.cores is not None:
+            intra_op_threads = len(self.cores)
+        if intra_op_threads <= 0 and self.inter_op_threads <= 0:
+            return None
+        config = tf.ConfigProto()
+        config.gpu_options.allow_growth = True
+        config.log_device_placement = False
+        config.allow_soft_placement = True
+        config.intra_op_parallelism_threads = max(intra_op_threads, 0)
+        config.inter_op_parallelism_threads = max(self.inter_op_threads, 0)
+        # create thread pools owned by the session, which inherit the
+        #   CPU affinity of the thread creating the session
+        config.use_per_session_threads = True
+        return config
+
+    def pin_current_thread(self):
+        """ Pins the calling thread to the cores of the replica and returns
+        the previous core set, or None if nothing is pinned. """
+        if self.cores is None:
+            return None
+        previous = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, self.cores)
+        return previous
+
+    def build(self, experiment, model_dirs):
+        """ Builds the model of `model_dirs` for this replica, with the
+        session threads pinned to the replica cores.
+
+        Args:
+            experiment: A `SimpleEnsembleExperiment` instance.
+            model_dirs: A list of model directories (checkpoints).
+
+        Returns: A dict, see `SimpleEnsembleExperiment.build_experiment_spec()`.
+        """
+        previous = self.pin_current_thread()
+        try:
+            return experiment.build_experiment_spec(
+                model_dirs, session_config=self.session_config())
+        finally:
+            if previous is not None:
+                os.sched_setaffinity(0, previous)
+
+
+# decoded by a newly loaded model before it replaces the served one
+WARMUP_SENTENCE = "hello world ."
+
+# the decoding limits a translate request may override
+LENGTH_LIMIT_KEYS = ("maximum_labels_length", "max_length_ratio", "max_length_offset")
+
+
+def request_length_limits(msg, id_lists, infer_options):
+    """ Computes the maximum translation length of each sentence of a
+    translate request, min(maximum_labels_length, max_length_ratio *
+    source_length + max_length_offset), where the options missing from
+    the request are taken from `infer_options`.
+
+    Args:
+        msg: A dict decoded from a frame.
+        id_lists: A list of source token id lists.
+        infer_options: A dict of inference options of the served model.
+
+    Returns: A list of integers, or None if the request overrides no limit.
+    """
+    if all([msg.get(key, None) is None for key in LENGTH_LIMIT_KEYS]):
+        return None
+    options = dict([(key, infer_options[key] if msg.get(key, None) is None else msg[key])
+                    for key in LENGTH_LIMIT_KEYS])
+    maximum_labels_length = int(options["maximum_labels_length"])
+    if options["max_length_ratio"] is None:
+        return [max(maximum_labels_length, 1)] * len(id_lists)
+    return [max(min(maximum_labels_length,
+                    int(float(options["max_length_ratio"]) * len(ids))
+                    + int(options["max_length_offset"])), 1)
+            for ids in id_lists]
+
+
+class _TranslationJob(object):
+    """ The sentences of one translate request, waiting in the queue
+    of `BatchScheduler` until all of them are translated. """
+
+    def __init__(self, num_sentences, n_best=1):
+        """ Initializes the job.
+
+        Args:
+            num_sentences: The number of sentences of the request.
+            n_best: The number of translations of each sentence.
+        """
+        self.n_best = n_best
+        self.sources = [None] * num_sentences
+        self.translations = [None] * num_sentences
+        self.n_best_lists = [None] * num_sentences
+        self.error = None
+        self._remaining = num_sentences
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        if num_sentences == 0:
+            self._done.set()
+
+    def fill(self, index, source, translation, n_best_list):
+        """ Stores the translation and the n-best list, a list of
+        `(translation, score)` tuples, of the `index`-th sentence. """
+        self.sources[index] = source
+        self.translations[index] = translation
+        self.n_best_lists[index] = n_best_list[:self.n_best]
+        with self._lock:
+            self._remaining -= 1
+            if self._remaining == 0:
+                self._done.set()
+
+    def fail(self, error):
+        """ Marks the job as failed and wakes up the waiting connection. """
+        self.error = error
+        self._done.set()
+
+    def wait(self):
+        """ Blocks until all sentences are translated.
+
+        Returns: A tuple `(sources, translations, n_best_lists)`, two lists
+          of strings and a list of lists of `(translation, score)` tuples.
+
+        Raises:
+            The exception raised by the inference, if any.
+        """
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.sources, self.translations, self.n_best_lists
+
+
+class BatchScheduler(object):
+    """ Gathers the sentences from all connections into one queue and
+    translates them with one beam search call per batch.
+
+    A batch is dispatched once it holds `batch_size` sentences or
+    `max_wait_ms` milliseconds after its first sentence arrived, to the
+    replica with the fewest pending sentences. Translations are kept in
+    an LRU cache, so repeated sentences never reach a session.
+    """
 
-class TranslateServer(socketserver.TCPServer):
-    def init_experiment(self, **args):
+    def __init__(self, server, replicas, batch_size, max_wait_ms=10, cache_size=10000):
+        """ Initializes the scheduler and starts the batching thread and
+        one worker thread per replica.
+
+        Args:
+            server: A `TranslateServer` instance providing `experiment_spec`.
+            replicas: A list of `InferenceReplica` instances.
+            batch_size: The maximum number of sentences of one batch.
+            max_wait_ms: The maximum milliseconds to wait for a batch to fill.
+            cache_size: The maximum number of cached translations, 0 for
+              no caching.
+        """
+        self._server = server
+        self._replicas = replicas
+        self._batch_size = batch_size
+        self._max_wait = max_wait_ms / 1000.
+        self.cache = LRUCache(cache_size)
+        self._queue = queue.Queue()
+        self._pending_lock = threading.Lock()
+        threads = [threading.Thread(target=self._loop, name="BatchScheduler")]
+        for replica in replicas:
+            threads.append(threading.Thread(
+                target=self._work, args=(replica,),
+                name="InferenceReplica{}".format(replica.index)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        self._threads = threads
+
+    def translate(self, id_lists, length_limits=None, n_best=1):
+        """ Translates sentences, blocking until all of them are done.
+
+        Args:
+            id_lists: A list of source token id lists.
+            length_limits: A list of the maximum translation length of each
+              sentence, or None for the limits of the model.
+            n_best: The number of translations of each sentence, no more
+              than the beam size.
+
+        Returns: A tuple `(sources, translations, n_best_lists)` in the
+          order of `id_lists`, see `_TranslationJob.wait()`.
+        """
+        beam_size = self._server.experiment_spec["model_configs"]["infer"]["beam_size"]
+        job = _TranslationJob(len(id_lists), n_best=max(min(n_best, beam_size), 1))
+        if length_limits is None:
+            # 0 leaves the limit to the model
+            length_limits = [0] * len(id_lists)
+        key_prefix = self._cache_key_prefix(self._server.experiment_spec)
+        for index, (ids, limit) in enumerate(zip(id_lists, length_limits)):
+            cached = self.cache.get(key_prefix + (limit,) + tuple(ids))
+            # the cached n-best list may be shorter than requested
+            if cached is None or len(cached[2]) < job.n_best:
+                self._queue.put((job, index, ids, limit))
+            else:
+                job.fill(index, *cached)
+        return job.wait()
+
+    @staticmethod
+    def _cache_key_prefix(experiment_spec):
+        """ Returns the part of the cache key identifying the model and
+        the decoding options, which the length limit and the source token
+        ids are appended to. """
+        infer_options = experiment_spec["model_configs"]["infer"]
+        return (experiment_spec["model_info"]["model_dir"],
+                infer_options["beam_size"],
+                infer_options["length_penalty"])
+
+    def _next_batch(self):
+        """ Blocks for the first sentence, then collects more sentences
+        until the batch is full or the deadline passes. """
+        batch = [self._queue.get()]
+        deadline = time.time() + self._max_wait
+        while len(batch) < self._batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def decode(experiment_spec, id_lists, length_limits=None, n_best=1):
+        """ Runs beam search on one batch with the model of `experiment_spec`.
+
+        Args:
+            experiment_spec: A dict of the session, ops and vocabularies.
+            id_lists: A list of source token id lists.
+            length_limits: A list of the maximum translation length of each
+              sentence, 0 for the limit of the model, or None for all
+              sentences.
+            n_best: The number of translations of each sentence.
+
+        Returns: A tuple `(sources, translations, n_best_lists)`, two lists
+          of strings and a list of lists of `(translation, score)` tuples.
+        """
+        infer_options = experiment_spec["model_configs"]["infer"]
+        sample_fields = None
+        if length_limits is not None and any(length_limits):
+            sample_fields = {Constants.LABEL_LENGTH_LIMIT_NAME: length_limits}
+        feeding_data = pack_feed_dict(
+            name_prefixs=Constants.FEATURE_NAME_PREFIX,
+            origin_datas=id_lists,
+            paddings=experiment_spec["vocab_source"].pad_id,
+            input_fields=experiment_spec["estimator_spec"].input_fields,
+            sample_fields=sample_fields)
+        n_best_lists = []
+        sources, translations, scores = infer(
+            sess=experiment_spec["session"],
+            prediction_op=experiment_spec["predict_op"],
+            infer_data=[feeding_data],
+            output=None,
+            vocab_source=experiment_spec["vocab_source"],
+            vocab_target=experiment_spec["vocab_target"],
+            delimiter=infer_options["delimiter"],
+            output_attention=False,
+            tokenize_output=infer_options["char_level"],
+            verbose=False,
+            prefetch_size=0,
+            shortlist=experiment_spec["shortlist"],
+            input_fields=experiment_spec["estimator_spec"].input_fields,
+            n_best=n_best,
+            n_best_results=n_best_lists)
+        if n_best <= 1:
+            n_best_lists = [[(translation, score)]
+                            for translation, score in zip(translations, scores)]
+        n_best_lists = [[(translation, float(score)) for translation, score in n_best_list]
+                        for n_best_list in n_best_lists]
+        return sources, translations, n_best_lists
+
+    def warm_up(self, experiment_spec):
+        """ Decodes one full batch with a model that is not served yet,
+        raising if the model is broken. """
+        vocab_source = experiment_spec["vocab_source"]
+        ids = vocab_source.convert_to_idlist(WARMUP_SENTENCE.split())
+        self.decode(experiment_spec, [ids] * self._batch_size)
+
+    def _run(self, replica, batch):
+        """ Runs beam search on one batch.
+
+        Args:
+            replica: The `InferenceReplica` to decode with.
+            batch: A list of `(job, index, ids, limit)` tuples.
+
+        Returns: A tuple `(sources, translations, n_best_lists)`, see `decode()`.
+        """
+        with replica.lock:
+            experiment_spec = replica.experiment_spec
+            sources, translations, n_best_lists = self.decode(
+                experiment_spec, [ids for _, _, ids, _ in batch],
+                [limit for _, _, _, limit in batch],
+                n_best=max([job.n_best for job, _, _, _ in batch]))
+            # fill the cache before releasing the lock, so that a reload
+            #   can not interleave and leave stale entries behind
+            key_prefix = self._cache_key_prefix(experiment_spec)
+            for (_, _, ids, limit), source, translation, n_best_list in zip(
+                    batch, sources, translations, n_best_lists):
+                self.cache.put(key_prefix + (limit,) + tuple(ids),
+                               (source, translation, n_best_list))
+        return sources, translations, n_best_lists
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            with self._pending_lock:
+                replica = min(self._replicas, key=lambda r: r.pending)
+                replica.pending += len(batch)
+            replica.queue.put(batch)
+
+    def _work(self, replica):
+        replica.pin_current_thread()
+        while True:
+            batch = replica.queue.get()
+            try:
+                sources, translations, n_best_lists = self._run(replica, batch)
+            except Exception as e:
+                print("Fail to translate a batch of {} sentences: {}".format(len(batch), e))
+                for job in set([job for job, _, _, _ in batch]):
+                    job.fail(e)
+                continue
+            finally:
+                with self._pending_lock:
+                    replica.pending -= len(batch)
+            for (job, index, _, _), source, translation, n_best_list in zip(
+                    batch, sources, translations, n_best_lists):
+                job.fill(index, source, translation, n_best_list)
+
+
+class TranslateServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """ Serves each connection in its own thread, so that the sentences of
+    concurrent connections can be translated in the same batch.
+
+    Socket I/O and preprocessing run in the connection threads, while the
+    sessions are only accessed by the `BatchScheduler` worker threads.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    # the maximum number of concurrent connections, 0 for unlimited
+    max_connections = 0
+    # seconds a connection may stay idle before it is closed, 0 for never
+    connection_timeout = 0
+
+    def init_connections(self, max_connections=0, connection_timeout=0):
+        """ Sets the limits of client connections.
+
+        Args:
+            max_connections: The maximum number of concurrent connections,
+              0 for unlimited. Extra connections are answered with an
+              error frame and closed.
+            connection_timeout: The seconds a connection may stay idle
+              before it is closed, 0 for never.
+        """
+        self.max_connections = max_connections
+        self.connection_timeout = connection_timeout
+        self._connection_slots = None
+        if max_connections > 0:
+            self._connection_slots = threading.BoundedSemaphore(max_connections)
+
+    def process_request(self, request, client_address):
+        slots = getattr(self, "_connection_slots", None)
+        if slots is not None and not slots.acquire(False):
+            print("Reject connection from {}:{}, {} connections are in use."
+                  .format(client_address[0], client_address[1], self.max_connections))
+            try:
+                write_frame(request, status="error", info="Too many connections.")
+            except socket.error:
+                pass
+            self.shutdown_request(request)
+            return
+        socketserver.ThreadingMixIn.process_request(self, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            socketserver.ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            slots = getattr(self, "_connection_slots", None)
+            if slots is not None:
+                slots.release()
+
+    def init_experiment(self, num_replicas=1, intra_op_threads=0,
+                        inter_op_threads=0, **args):
+        """ Loads the model into each replica.
+
+        Args:
+            num_replicas: The number of model replicas, each with its own
+              session pinned to a share of the CPU cores.
+            intra_op_threads: The intra-op threads of each session, 0 for
+              the number of cores of the replica.
+            inter_op_threads: The inter-op threads of each session, 0 for
+              the tensorflow default.
+            **args: The arguments of `SimpleEnsembleExperiment`.
+        """
         experiment = SimpleEnsembleExperiment(**args)
         self._experiment = experiment
-        self.experiment_spec = experiment.experiment_spec
+        self.replicas = [InferenceReplica(index, cores,
+                                          intra_op_threads=intra_op_threads,
+                                          inter_op_threads=inter_op_threads)
+                         for index, cores in enumerate(split_cores(num_replicas))]
+        for replica in self.replicas:
+            print("Initialize replica {} on cores {}...".format(replica.index, replica.cores))
+            replica.experiment_spec.update(**replica.build(experiment, experiment.model_dirs))
+        # used by the connections to preprocess requests
+        self.experiment_spec = self.replicas[0].experiment_spec
+        self._reload_lock = threading.Lock()
+        print("Start listening...")
+
+    def init_scheduler(self, max_wait_ms=10, cache_size=10000):
+        """ Starts the `BatchScheduler` shared by all connections.
+
+        Args:
+            max_wait_ms: The maximum milliseconds to wait for a batch to fill.
+            cache_size: The maximum number of cached translations.
+        """
+        self.scheduler = BatchScheduler(
+            self, self.replicas,
+            batch_size=self.experiment_spec["model_configs"]["infer"]["batch_size"],
+            max_wait_ms=max_wait_ms,
+            cache_size=cache_size)
+        self.add_reload_hook(self.scheduler.cache.clear)
+
+    def add_reload_hook(self, hook):
+        """ Registers a function called with no arguments whenever a new
+        model is loaded, e.g. to invalidate cached translations. """
+        if not hasattr(self, "_reload_hooks"):
+            self._reload_hooks = []
+        self._reload_hooks.append(hook)
 
     def reload_model(self, model_dirs):
-        self._experiment.reload_model(model_dirs)
+        """ Loads the model of `model_dirs` and switches to it.
+
+        The new model is built in new graphs and warmed up while the old
+        one keeps serving. The switch itself only takes the replica locks
+        for a moment. If loading or warming up fails, the old model stays
+        in place and the error is raised.
+
+        Args:
+            model_dirs: A string, model directories separated by commas.
+        """
+        model_dirs = model_dirs.split(",")
+        with self._reload_lock:
+            print("Reloading model from {}...".format(model_dirs))
+            experiment_specs = []
+            try:
+                for replica in self.replicas:
+                    experiment_specs.append(replica.build(self._experiment, model_dirs))
+                    self.scheduler.warm_up(experiment_specs[-1])
+            except:
+                for experiment_spec in experiment_specs:
+                    experiment_spec["session"].close()
+                raise
+            old_sessions = []
+            for replica in self.replicas:
+                replica.lock.acquire()
+            try:
+                for replica, experiment_spec in zip(self.replicas, experiment_specs):
+                    old_sessions.append(replica.experiment_spec["session"])
+                    replica.experiment_spec.update(**experiment_spec)
+                self._experiment.model_dirs = model_dirs
+                for hook in getattr(self, "_reload_hooks", []):
+                    hook()
+            finally:
+                for replica in self.replicas:
+                    replica.lock.release()
+            for session in old_sessions:
+                session.close()
+            print("Done.")
 
 
 class TranslateRequestHandler(socketserver.BaseRequestHandler, object):
@@ -143,35 +670,42 @@ class TranslateRequestHandler(socketserver.BaseRequestHandler, object):
         self.experiment_spec = server.experiment_spec
         super(TranslateRequestHandler, self).__init__(request, client_address, server)
 
-    def preprocess_raw(self, raw_data):
+    def setup(self):
+        if self.server.connection_timeout > 0:
+            self.request.settimeout(self.server.connection_timeout)
+
+    def preprocess_raw(self, msg):
         """
-        :param raw_data: json string
+        :param msg: dict decoded from a frame
             {
-                "command": str (control, translate),
-                "data": str
+                "command": str (control, translate, reload),
+                "content": str,
+                (optional, for translate) "maximum_labels_length": int,
+                (optional, for translate) "max_length_ratio": float,
+                (optional, for translate) "max_length_offset": int,
+                (optional, for translate) "n_best": int
             }
 
         :return: processed dict
             {
-                "command": str (control, translate),
-                "data": tf feeding_data (if not translate then None)
+                "command": str (control, translate, reload),
+                "content": list of source token ids if translate,
+                "length_limits": list of maximum translation lengths or None if translate,
+                "n_best": int if translate
             }
         """
-        msg = unwrap_message(raw_data)
-
         if msg["command"] == "translate":
             lines = msg["content"].strip().split("\n")
-
-            text_inputter = TextLineInputter(
-                line_readers=[LineReader(
-                    data=lines,
-                    preprocessing_fn=lambda x: self.experiment_spec["vocab_source"].convert_to_idlist(x))],
-                padding_id=self.experiment_spec["vocab_source"].pad_id,
-                batch_size=self.experiment_spec["model_configs"]["infer"]["batch_size"])
-
-            feeding_data = text_inputter.make_feeding_data(self.experiment_spec["estimator_spec"].input_fields)
-
-            return {"command": "translate", "content": feeding_data}
+            vocab_source = self.experiment_spec["vocab_source"]
+            id_lists = [vocab_source.convert_to_idlist(line.strip().split())
+                        for line in lines]
+            length_limits = request_length_limits(
+                msg, id_lists, self.experiment_spec["model_configs"]["infer"])
+            n_best = msg.get("n_best", None)
+            if n_best is None:
+                n_best = self.experiment_spec["model_configs"]["infer"]["n_best"]
+            return {"command": "translate", "content": id_lists,
+                    "length_limits": length_limits, "n_best": int(n_best)}
         return msg
 
     def handle(self):
@@ -180,54 +714,65 @@ class TranslateRequestHandler(socketserver.BaseRequestHandler, object):
 
         while True:
             try:
-                raw_data = self.request.recv(1024).strip()  # json string
-                print(raw_data)
+                msg = read_frame(self.request)
+            except socket.timeout:
+                print("Connection from {}:{} idle for {}s.".format(
+                    self.client_address[0], self.client_address[1], self.server.connection_timeout))
+                break
+            except (FrameError, socket.error) as e:
+                print("Broken frame from {}:{}: {}".format(self.client_address[0], self.client_address[1], e))
+                break
+            if msg is None:
+                break
 
-                # preprocess raw_data to request (dict)
-                request = self.preprocess_raw(raw_data)
-                print(request)
+            try:
+                # preprocess msg to request (dict)
+                request = self.preprocess_raw(msg)
 
                 if request["command"] == "translate":
-                    trans_outputs = []
-                    sources = []
-                    for feeding_data in request["content"]:
-                        source, trans_output, trans_score = infer(
-                            sess=self.experiment_spec["session"],
-                            prediction_op=self.experiment_spec["predict_op"],
-                            infer_data=feeding_data,
-                            output=None,
-                            vocab_source=self.experiment_spec["vocab_source"],
-                            vocab_target=self.experiment_spec["vocab_target"],
-                            delimiter=self.experiment_spec["model_configs"]["infer"]["delimiter"],
-                            output_attention=False,
-                            tokenize_output=self.experiment_spec["model_configs"]["infer"]["char_level"],
-                            verbose=True)
-                        sources.extend(source)
-                        trans_outputs.extend(trans_output)
+                    sources, trans_outputs, n_best_lists = self.server.scheduler.translate(
+                        request["content"], request["length_limits"], request["n_best"])
 
                     sources = "\n".join(sources)
                     trans_outputs = "\n".join(trans_outputs)
-                    response = wrap_message(status="success", info="", source=sources, translation=trans_outputs,
-                                             model_info=self.experiment_spec["model_info"])
+                    response = dict(status="success", info="", source=sources, translation=trans_outputs,
+                                    model_info=self.experiment_spec["model_info"])
+                    if request["n_best"] > 1:
+                        response["n_best"] = [
+                            [{"translation": translation, "score": score}
+                             for translation, score in n_best_list]
+                            for n_best_list in n_best_lists]
 
                 elif request["command"] == "control":
                     if request["content"] == "close":
                         break
+                    elif request["content"] == "stats":
+                        response = dict(status="success", info="",
+                                        cache=self.server.scheduler.cache.stats(),
+                                        bpe_cache=self.experiment_spec["vocab_source"].bpe_cache_stats(),
+                                        model_info=self.experiment_spec["model_info"])
+                    else:
+                        response = dict(status="error",
+                                        info="Unknown control: {}".format(request["content"]))
 
                 elif request["command"] == "reload":
                     new_model_dirs = request["content"]
                     self.server.reload_model(new_model_dirs)
-                    response = wrap_message(status="success",
-                                             info="Reloaded model from {}".format(new_model_dirs),
-                                             model_info=self.experiment_spec["model_info"])
+                    response = dict(status="success",
+                                    info="Reloaded model from {}".format(new_model_dirs),
+                                    model_info=self.experiment_spec["model_info"])
 
-                self.request.sendall(response)
+                else:
+                    response = dict(status="error",
+                                    info="Unknown request: {}".format(request["command"]))
 
             except Exception as e:
-                response = wrap_message(status="error")
-                try:
-                    self.request.sendall(response)
-                except socket.error as e:
-                    print("Close connection from {}:{}.".format(*self.client_address))
-                    break
+                response = dict(status="error", info=str(e))
+
+            try:
+                write_frame(self.request, **response)
+            except socket.error:
+                break
+
+        print("Close connection from {}:{}.".format(*self.client_address))
 
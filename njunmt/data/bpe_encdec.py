@@ -12,11 +12,23 @@ Proceedings of the 54th Annual Meeting of the Association for Computational Ling
 """
 from __future__ import unicode_literals, division
 import codecs
+import hashlib
+import heapq
+import json
 import re
 
+from njunmt.utils.lru_cache import LRUCache
+
 
 class BPE(object):
-    def __init__(self, codes=None, separator='@@', vocab=None, vocabulary_threshold=None):
+    def __init__(self, codes=None, separator='@@', vocab=None, vocabulary_threshold=None,
+                 cache_size=100000, cache_file=None):
+        """
+        :param cache_size: the maximum number of words whose segmentations are cached
+        :param cache_file: a table of precomputed segmentations saved by `save_cache()`,
+            loaded into the cache so that it starts warm. It must be saved with the
+            same codes, separator and vocabulary
+        """
         assert codes, "codes should be provided."
         codes = codecs.open(codes, encoding='utf-8')
         # check version information
@@ -38,6 +50,9 @@ class BPE(object):
         else:
             self.vocab = None
         self.glossaries = []
+        self.cache = LRUCache(cache_size)
+        if cache_file:
+            self.preload_cache(cache_file)
 
     def encode(self, sentence):
         """segment single sentence (whitespace-tokenized string) with BPE encoding"""
@@ -53,7 +68,8 @@ class BPE(object):
                                               self.vocab,
                                               self.separator,
                                               self.version,
-                                              self.glossaries)]
+                                              self.glossaries,
+                                              self.cache)]
 
             for item in new_word[:-1]:
                 output.append(item + self.separator)
@@ -87,6 +103,52 @@ class BPE(object):
             return " ".join(new_pred_tokens)
         return new_pred_tokens
 
+    def signature(self):
+        """ returns the hash of the settings that decide the segmentations """
+        return cache_signature(self.bpe_codes, self.separator, self.vocab,
+                               self.version, self.glossaries)
+
+    def preload_cache(self, filename):
+        """ loads the segmentations saved by `save_cache()` into the cache,
+        the first line of which is "#signature: <hash>" and each of the others
+        is "word segment1 segment2 ..."
+
+        :return: the number of loaded words
+        :raise ValueError: if the table is saved with different codes, separator,
+            vocabulary or glossaries
+        """
+        num_words = 0
+        with codecs.open(filename, encoding='utf-8') as fp:
+            header = fp.readline().split()
+            if header != ['#signature:', self.signature()]:
+                raise ValueError("BPE cache file {} is not saved with the same codes, "
+                                 "separator, vocabulary and glossaries.".format(filename))
+            for line in fp:
+                fields = line.split()
+                if len(fields) < 2:
+                    continue
+                self.cache.put(fields[0], tuple(fields[1:]))
+                num_words += 1
+        return num_words
+
+    def save_cache(self, filename):
+        """ saves the cached segmentations, from the least to the most
+        recently used, so that `preload_cache()` keeps the recent ones if
+        the cache is smaller
+
+        :return: the number of saved words
+        """
+        items = self.cache.items()
+        with codecs.open(filename, 'w', encoding='utf-8') as fw:
+            fw.write('#signature: ' + self.signature() + '\n')
+            for word, segments in items:
+                fw.write(word + ' ' + ' '.join(segments) + '\n')
+        return len(items)
+
+    def cache_stats(self):
+        """ returns a dict of the cache size and the hit/miss counters """
+        return self.cache.stats()
+
     def _isolate_glossaries(self, word):
         word_segments = [word]
         for gloss in self.glossaries:
@@ -95,28 +157,82 @@ class BPE(object):
         return word_segments
 
 
-def get_pairs(word):
-    """Return set of symbol pairs in a word.
+def cache_signature(bpe_codes, separator, vocab, version, glossaries):
+    """Hash the settings that decide the segmentations, so that a saved cache table
+    is only loaded by a BPE that segments words the same way"""
+    config = [list(version),
+              sorted(bpe_codes, key=bpe_codes.get),
+              separator,
+              sorted(vocab) if vocab else None,
+              list(glossaries or [])]
+    return hashlib.sha1(json.dumps(config).encode('utf-8')).hexdigest()
 
-    word is represented as tuple of symbols (symbols being variable-length strings)
-    """
-    pairs = set()
-    prev_char = word[0]
-    for char in word[1:]:
-        pairs.add((prev_char, char))
-        prev_char = char
-    return pairs
 
+def merge_symbols(word, bpe_codes):
+    """Apply the merge operations to a tuple of symbols.
 
-def bpe_encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, glossaries=None, cache={}):
+    The same as merging every occurrence of the pair with the lowest rank until no
+    pair can be merged, but the candidate pairs are kept in a heap keyed by rank
+    and the symbols in a linked list, so that a merge only updates its neighbours.
+    """
+    symbols = list(word)
+    next_pos = list(range(1, len(symbols))) + [-1]
+    prev_pos = list(range(-1, len(symbols) - 1))
+    heap = []
+    for i in range(len(symbols) - 1):
+        rank = bpe_codes.get((symbols[i], symbols[i + 1]))
+        if rank is not None:
+            heap.append((rank, i))
+    heapq.heapify(heap)
+
+    def push_pair(i, j):
+        if i >= 0 and j >= 0:
+            rank = bpe_codes.get((symbols[i], symbols[j]))
+            if rank is not None:
+                heapq.heappush(heap, (rank, i))
+
+    while heap:
+        # all occurrences of the pair, from left to right, are merged before
+        # any new pair, as one pass over the word does
+        rank, i = heapq.heappop(heap)
+        positions = [i]
+        while heap and heap[0][0] == rank:
+            positions.append(heapq.heappop(heap)[1])
+        for i in positions:
+            j = next_pos[i]
+            # skip the stale entries of merged or changed symbols
+            if symbols[i] is None or j < 0 or bpe_codes.get((symbols[i], symbols[j])) != rank:
+                continue
+            symbols[i] += symbols[j]
+            symbols[j] = None
+            next_pos[i] = next_pos[j]
+            if next_pos[i] >= 0:
+                prev_pos[next_pos[i]] = i
+            push_pair(prev_pos[i], i)
+            push_pair(i, next_pos[i])
+
+    merged = []
+    i = 0
+    while i >= 0:
+        merged.append(symbols[i])
+        i = next_pos[i]
+    return tuple(merged)
+
+
+def bpe_encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, glossaries=None, cache=None):
     """Encode word based on list of BPE merge operations, which are applied consecutively
+
+    cache is an `LRUCache` of the segmentations, or None
     """
 
-    if orig in cache:
-        return cache[orig]
+    if cache is not None:
+        word = cache.get(orig)
+        if word is not None:
+            return word
 
     if orig in glossaries:
-        cache[orig] = (orig,)
+        if cache is not None:
+            cache.put(orig, (orig,))
         return (orig,)
 
     if version == (0, 1):
@@ -126,39 +242,10 @@ def bpe_encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, gl
     else:
         raise NotImplementedError
 
-    pairs = get_pairs(word)
-
-    if not pairs:
+    if len(word) < 2:
         return orig
 
-    while True:
-        bigram = min(pairs, key=lambda pair: bpe_codes.get(pair, float('inf')))
-        if bigram not in bpe_codes:
-            break
-        first, second = bigram
-        new_word = []
-        i = 0
-        while i < len(word):
-            try:
-                j = word.index(first, i)
-                new_word.extend(word[i:j])
-                i = j
-            except:
-                new_word.extend(word[i:])
-                break
-
-            if word[i] == first and i < len(word) - 1 and word[i + 1] == second:
-                new_word.append(first + second)
-                i += 2
-            else:
-                new_word.append(word[i])
-                i += 1
-        new_word = tuple(new_word)
-        word = new_word
-        if len(word) == 1:
-            break
-        else:
-            pairs = get_pairs(word)
+    word = merge_symbols(word, bpe_codes)
 
     # don't print end-of-word symbols
     if word[-1] == '</w>':
@@ -169,7 +256,8 @@ def bpe_encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, gl
     if vocab:
         word = check_vocab_and_split(word, bpe_codes_reverse, vocab, separator)
 
-    cache[orig] = word
+    if cache is not None:
+        cache.put(orig, word)
     return word
 
 
@@ -16,6 +16,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import json
+
 import six
 import numpy
 
@@ -120,3 +122,149 @@ class LineReader(object):
         if self._maximum_length and len(tokens) > self._maximum_length:
             return None
         return tokens
+
+
+# suffixes of the files of a binarized corpus, see `binarize_lines()`
+BINARY_IDS_SUFFIX = ".ids"
+BINARY_OFFSETS_SUFFIX = ".offsets"
+BINARY_META_SUFFIX = ".meta.json"
+
+
+def binarize_lines(line_reader, vocab, output_prefix, chunk_size=100000):
+    """ Writes the token ids of all lines of a reader into a binarized corpus:
+          `output_prefix`.ids: the token ids of all lines, concatenated,
+            in uint16 if the vocabulary fits, otherwise in int32.
+          `output_prefix`.offsets: int64 offsets of the lines in the ids
+            file, with an extra one at the end.
+          `output_prefix`.meta.json: the dtype, the numbers of lines and
+            tokens, and the vocabulary size and direction.
+
+    Args:
+        line_reader: A `LineReader` instance, with `vocab.convert_to_idlist`
+          as its `preprocessing_fn`.
+        vocab: A `Vocab` instance.
+        output_prefix: The prefix of the output files.
+        chunk_size: The number of lines written at a time.
+
+    Returns: The meta data dict.
+    """
+    dtype = "uint16" if vocab.vocab_size <= numpy.iinfo(numpy.uint16).max + 1 else "int32"
+    num_lines = 0
+    num_tokens = 0
+    with open(output_prefix + BINARY_IDS_SUFFIX, "wb") as fw_ids, \
+            open(output_prefix + BINARY_OFFSETS_SUFFIX, "wb") as fw_offsets:
+        numpy.zeros([1], dtype=numpy.int64).tofile(fw_offsets)
+        end_of_data = False
+        while not end_of_data:
+            buf = []
+            while len(buf) < chunk_size:
+                ids = line_reader.next()
+                if ids == "":
+                    end_of_data = True
+                    break
+                buf.append(ids)
+            if not buf:
+                break
+            lengths = numpy.array([len(ids) for ids in buf], dtype=numpy.int64)
+            numpy.concatenate(buf).astype(dtype).tofile(fw_ids)
+            (num_tokens + numpy.cumsum(lengths)).tofile(fw_offsets)
+            num_lines += len(buf)
+            num_tokens += int(lengths.sum())
+    meta = {"dtype": dtype,
+            "num_lines": num_lines,
+            "num_tokens": num_tokens,
+            "vocab_size": vocab.vocab_size,
+            "reverse_seq": vocab.reverse_seq}
+    with open(output_prefix + BINARY_META_SUFFIX, "w") as fw:
+        json.dump(meta, fw, indent=2)
+    return meta
+
+
+class BinaryLineReader(LineReader):
+    """ Class for reading in the token ids of a binarized corpus
+    through `numpy.memmap`, with the same contract as `LineReader`,
+    except that the lines are already preprocessed. """
+
+    def __init__(self,
+                 data,
+                 maximum_length=None,
+                 vocab=None):
+        """ Initializes the parameters for BinaryLineReader.
+
+        Args:
+            data: The prefix of the files written by `binarize_lines()`.
+            maximum_length: An integer, the maximum length of one line.
+            vocab: A `Vocab` instance. If provided, it must have the same
+              size and direction as the one used for binarizing.
+
+        Raises:
+            ValueError: if the files do not exist or `vocab` does not match.
+        """
+        if not tf.gfile.Exists(data + BINARY_META_SUFFIX):
+            raise ValueError("File does not exist: {}".format(data + BINARY_META_SUFFIX))
+        with open(data + BINARY_META_SUFFIX, "r") as fp:
+            meta = json.load(fp)
+        if vocab is not None and (vocab.vocab_size != meta["vocab_size"]
+                                  or vocab.reverse_seq != meta["reverse_seq"]):
+            raise ValueError("{} was binarized with a vocabulary of size {} (reverse_seq={}), "
+                             "but the given one has size {} (reverse_seq={})."
+                             .format(data, meta["vocab_size"], meta["reverse_seq"],
+                                     vocab.vocab_size, vocab.reverse_seq))
+        self._maximum_length = maximum_length
+        self._preprocessing_fn = None
+        self._filename = data
+        self._data_index = 0
+        self._num_lines = meta["num_lines"]
+        self._offsets = numpy.memmap(data + BINARY_OFFSETS_SUFFIX, dtype=numpy.int64,
+                                     mode="r", shape=(self._num_lines + 1,))
+        if meta["num_tokens"] > 0:
+            self._data = numpy.memmap(data + BINARY_IDS_SUFFIX, dtype=meta["dtype"],
+                                      mode="r", shape=(meta["num_tokens"],))
+        else:  # an empty file can not be mapped
+            self._data = numpy.zeros([0], dtype=meta["dtype"])
+        # the order of lines after shuffling
+        self._order = None
+
+    def close(self):
+        """ Closes this reader.  """
+        self._data_index = 0
+
+    def reset(self, do_shuffle=False, shuffle_to_file=None, argsort_index=None):
+        """ Resets this reader and shuffle (if needed). The lines are
+        shuffled by reordering the line indices, nothing is written.
+
+        Args:
+            do_shuffle: Whether to shuffle data.
+            shuffle_to_file: Not used.
+            argsort_index: A list of integers
+
+        Returns: The `argsort_index` if do shuffling.
+        """
+        _ = shuffle_to_file
+        self._data_index = 0
+        if do_shuffle:
+            if argsort_index is None:
+                argsort_index = numpy.arange(self._num_lines)
+                numpy.random.shuffle(argsort_index)
+            # composed with the previous order, the same as
+            #   `LineReader` re-shuffling its shuffled file
+            self._order = numpy.array(argsort_index) if self._order is None \
+                else self._order[argsort_index]
+        return argsort_index
+
+    def next(self):
+        """ Returns the next line.
+
+        Returns: "" if it hits the end of this data;
+                None if this sample does not meet the requirement of `maximum_length`;
+                A list of token ids, otherwise.
+        """
+        if self._data_index >= self._num_lines:
+            return ""
+        line_index = self._data_index if self._order is None \
+            else self._order[self._data_index]
+        self._data_index += 1
+        start, end = self._offsets[line_index], self._offsets[line_index + 1]
+        if self._maximum_length and end - start > self._maximum_length:
+            return None
+        return self._data[start:end].tolist()
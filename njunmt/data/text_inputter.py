@@ -47,7 +47,8 @@ def do_bucketing(pivot, *args):
     return _pivot, _args
 
 
-def pack_feed_dict(name_prefixs, origin_datas, paddings, input_fields):
+def pack_feed_dict(name_prefixs, origin_datas, paddings, input_fields,
+                   sample_fields=None):
     """
 
     Args:
@@ -55,6 +56,9 @@ def pack_feed_dict(name_prefixs, origin_datas, paddings, input_fields):
         origin_datas: Data list or a list of data lists.
         paddings: A padding id or a list of padding ids.
         input_fields: A list of input fields dict.
+        sample_fields: A dict mapping the names of input fields to lists
+          of one value per sample, which are split across the devices
+          like the data, without padding.
 
     Returns: A dict for while loop.
     """
@@ -91,6 +95,15 @@ def pack_feed_dict(name_prefixs, origin_datas, paddings, input_fields):
         map_fn(name_prefixs, origin_datas, paddings)
     else:
         [map_fn(n, d, p) for n, d, p in zip(name_prefixs, origin_datas, paddings)]
+    if sample_fields:
+        for name, values in sample_fields.items():
+            n_samples_per_gpu = len(values) // len(input_fields)
+            if len(values) % len(input_fields) > 0:
+                n_samples_per_gpu += 1
+            for idx, inpf in enumerate(input_fields):
+                if idx * n_samples_per_gpu < len(values):
+                    data["feed_dict"][inpf[name]] = values[idx * n_samples_per_gpu:
+                                                           (idx + 1) * n_samples_per_gpu]
     return data
 
 
@@ -113,7 +126,10 @@ class TextLineInputter(TextInputter):
     def __init__(self,
                  line_readers,
                  padding_id,
-                 batch_size):
+                 batch_size,
+                 batch_tokens_size=None,
+                 bucketing=False,
+                 cache_size=None):
         """ Initializes the parameters for this inputter.
 
         Args:
@@ -121,72 +137,149 @@ class TextLineInputter(TextInputter):
             padding_id: An integer for padding.
             batch_size: An integer value indicating the number of
               sentences passed into one step. Sentences will be padded by EOS.
+              If `batch_tokens_size` is provided, this is the maximum number of
+              sentences of one batch.
+            batch_tokens_size: An integer value indicating the number of
+              words of each batch, counting the paddings. If provided,
+              sentences will be batched by this budget.
+            bucketing: Whether to sort the sentences by length before batching.
+              Each batch carries the original indices of its sentences under
+              the key "indices", so that the original order can be restored.
+            cache_size: The number of sentences read, sorted and batched at a
+              time when the data is not loaded into memory. If not provided,
+              it is 128 times `batch_size` (32 if `batch_size` is None).
 
         Raises:
-            ValueError: if `batch_size` is None.
+            ValueError: if both `batch_size` and `batch_tokens_size` are
+              not provided.
         """
         super(TextLineInputter, self).__init__()
         self._readers = line_readers
         self._batch_size = batch_size
-        if self._batch_size is None:
-            raise ValueError("batch_size should be provided.")
+        self._batch_tokens_size = batch_tokens_size
+        self._bucketing = bucketing
+        if self._batch_size is None and self._batch_tokens_size is None:
+            raise ValueError("Either batch_size or batch_tokens_size should be provided.")
         self._padding_id = padding_id
+        self._cache_size = cache_size
+        if self._cache_size is None:
+            self._cache_size = (self._batch_size or 32) * 128
+
+    def _make_batch_indices(self, lengths):
+        """ Groups the sentences into batches.
+
+        Args:
+            lengths: A list of sentence lengths.
+
+        Returns: A list of batches, each of which is a list of sentence indices.
+        """
+        indices = numpy.arange(len(lengths))
+        if self._bucketing:
+            # stable sort keeps the file order among sentences of equal length
+            indices = numpy.argsort(lengths, kind="mergesort")
+        indices = indices.tolist()
+        if self._batch_tokens_size is None:
+            return [indices[start: start + self._batch_size]
+                    for start in range(0, len(indices), self._batch_size)]
+        batches = []
+        batch = []
+        batch_max_len = 0
+        for idx in indices:
+            max_len = max(batch_max_len, lengths[idx])
+            if len(batch) > 0 and (
+                            max_len * (len(batch) + 1) > self._batch_tokens_size
+                    or (self._batch_size is not None and len(batch) >= self._batch_size)):
+                batches.append(batch)
+                batch = []
+                max_len = lengths[idx]
+            batch.append(idx)
+            batch_max_len = max_len
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
 
     def _make_feeding_data_from(self,
                                 reader,
                                 input_fields,
-                                name_prefix):
-        """ Processes the data file and return an iterable instance for loop.
+                                name_prefix,
+                                cache_size=None,
+                                skip_lines=0):
+        """ Processes the data file and generates feeding data.
 
         Args:
             reader: A LineReader instance.
             input_fields: A dict of placeholders.
             name_prefix: A string, the key name prefix for feed_dict.
+            cache_size: The number of sentences read and batched at a time,
+              None for reading all.
+            skip_lines: The number of lines to skip at the beginning.
 
-        Returns: An iterable instance that packs feeding dictionary
+        Returns: A generator that packs feeding dictionary
                    for `tf.Session().run` according to the `filename`.
         """
         assert isinstance(reader, LineReader)
-        ss_buf = []
-        while True:
-            encoded_ss = reader.next()
-            if encoded_ss == "":
+        for _ in range(skip_lines):
+            if reader.next() == "":
                 break
-            if encoded_ss is None:
-                continue
-            ss_buf.append(encoded_ss)
+        base_index = 0
+        end_of_data = False
+        while not end_of_data:
+            ss_buf = []
+            while cache_size is None or len(ss_buf) < cache_size:
+                encoded_ss = reader.next()
+                if encoded_ss == "":
+                    end_of_data = True
+                    break
+                if encoded_ss is None:
+                    continue
+                ss_buf.append(encoded_ss)
+            for batch_indices in self._make_batch_indices([len(ss) for ss in ss_buf]):
+                batch_data = pack_feed_dict(
+                    name_prefixs=name_prefix,
+                    origin_datas=[ss_buf[idx] for idx in batch_indices],
+                    paddings=self._padding_id,
+                    input_fields=input_fields)
+                batch_data["indices"] = [base_index + idx for idx in batch_indices]
+                yield batch_data
+            base_index += len(ss_buf)
         reader.close()
-        data = []
-        batch_data_idx = 0
-
-        while batch_data_idx < len(ss_buf):
-            data.append(pack_feed_dict(
-                name_prefixs=name_prefix,
-                origin_datas=ss_buf[batch_data_idx: batch_data_idx + self._batch_size],
-                paddings=self._padding_id,
-                input_fields=input_fields))
-            batch_data_idx += self._batch_size
-        return data
 
     def make_feeding_data(self, input_fields,
-                          name_prefix=Constants.FEATURE_NAME_PREFIX):
+                          name_prefix=Constants.FEATURE_NAME_PREFIX,
+                          in_memory=True,
+                          skip_lines=0):
         """ Processes the data file(s) and return an iterable
         instance for loop.
 
         Args:
             input_fields: A dict of placeholders.
             name_prefix: A string, the key name prefix for feed_dict.
+            in_memory: Whether to load all data into a list, which can be
+              iterated over several times. If False, returns generators
+              that read and batch the data chunk by chunk, and sort
+              sentences by length within each chunk.
+            skip_lines: An integer or a list of integers (one for each
+              line reader), the number of lines to skip, e.g. the lines
+              already translated by an interrupted run.
 
         Returns: An iterable instance or a list of iterable
                    instances according to the `data_field_name`
                    in the constructor.
         """
+        cache_size = None if in_memory else self._cache_size
+
+        def _make(reader, skip):
+            data = self._make_feeding_data_from(
+                reader, input_fields, name_prefix,
+                cache_size=cache_size, skip_lines=skip)
+            return list(data) if in_memory else data
+
         if isinstance(self._readers, list):
-            return [self._make_feeding_data_from(
-                reader, input_fields, name_prefix)
-                    for reader in self._readers]
-        return self._make_feeding_data_from(
-            self._readers, input_fields, name_prefix)
+            if not isinstance(skip_lines, list):
+                skip_lines = [skip_lines] * len(self._readers)
+            return [_make(reader, skip)
+                    for reader, skip in zip(self._readers, skip_lines)]
+        return _make(self._readers, skip_lines)
 
 
 class ParallelTextInputter(TextInputter):
@@ -18,6 +18,7 @@ from __future__ import print_function
 
 import six
 import collections
+import numpy
 from tensorflow import gfile
 from njunmt.data.bpe_encdec import BPE
 from njunmt.utils.constants import Constants
@@ -92,7 +93,9 @@ class Vocab(object):
         Raises:
             ValueError: if `filename` or `bpe_codes_file` does not exist.
         """
-        self.vocab_dict, self.vocab_r_dict, _ = create_vocabulary_lookup_table_numpy(filename)
+        self.vocab_dict, vocab_r_dict, _ = create_vocabulary_lookup_table_numpy(filename)
+        # ids are consecutive, so the id->token mapping is kept as a list
+        self.vocab_r_dict = [vocab_r_dict[i] for i in range(len(vocab_r_dict))]
         self._sos_id = self.vocab_dict[Constants.SEQUENCE_START]
         self._eos_id = self.vocab_dict[Constants.SEQUENCE_END]
         self._unk_id = self.vocab_dict[Constants.UNKOWN]
@@ -103,6 +106,17 @@ class Vocab(object):
             if "vocab" not in bpe_codes:
                 bpe_codes["vocab"] = filename
             self._bpe = BPE(**bpe_codes)
+        # array-backed id->token table for `decode_batch()`
+        self._id_to_token = numpy.array(self.vocab_r_dict, dtype=object)
+        self._is_eos = self._id_to_token == Constants.SEQUENCE_END
+        self._is_bpe_piece = None
+        if self._bpe:
+            self._is_bpe_piece = numpy.array(
+                [w.endswith(self._bpe.separator) for w in self._id_to_token], dtype=bool)
+            # BPE pieces can be joined by string replacement only if they
+            #   are separated by exactly one space
+            self._fast_bpe_join = len(self._bpe.separator) == 2 and all(
+                [w and " " not in w for w in self._id_to_token])
 
     @property
     def sos_id(self):
@@ -129,6 +143,11 @@ class Vocab(object):
         """ Returns the size of vocabulary. """
         return self._vocab_size
 
+    @property
+    def reverse_seq(self):
+        """ Returns whether the token ids are reversed. """
+        return self._reverse_seq
+
     def __call__(self, words):
         """ A wrapper method of `convert_to_idlist()` for `map` function,
         because this method is serializable.
@@ -152,6 +171,13 @@ class Vocab(object):
             return self._bpe.encode(sentence)
         return sentence
 
+    def bpe_cache_stats(self):
+        """ Returns a dict of the statistics of the BPE segmentation
+        cache, or None if BPE is not applied. """
+        if self._bpe:
+            return self._bpe.cache_stats()
+        return None
+
     def convert_to_idlist(self, words, n_words=-1):
         """ Maps the sentence into sequence of ids.
               If BPE provided, apply BPE first.
@@ -167,8 +193,9 @@ class Vocab(object):
             words = self._bpe.encode(words)
         if not isinstance(words, list):
             words = words.split()
-        ss = [self.vocab_dict[w] if w in self.vocab_dict else self.unk_id
-              for w in words]
+        get_id = self.vocab_dict.get
+        unk_id = self.unk_id
+        ss = [get_id(w, unk_id) for w in words]
         if n_words > 0:
             ss = [w if w < n_words else self.unk_id for w in ss]
         if self._reverse_seq:
@@ -176,6 +203,49 @@ class Vocab(object):
         ss += [self.eos_id]
         return ss
 
+    def encode_batch(self, list_of_words, n_words=-1):
+        """ Maps a batch of sentences into a padded matrix of ids,
+        the same as calling `convert_to_idlist()` on each of them.
+
+        Args:
+            list_of_words: A list of sentences, each of which is a list
+              of word tokens.
+            n_words: An integer number. If provided and > 0, token id
+              that exceed this value will be mapped into UNK id.
+
+        Returns: A tuple `(ids, lengths)`, where `ids` is a 2-d int32
+          numpy.ndarray with shape [len(list_of_words), max_len] padded
+          with `pad_id` and `lengths` is a 1-d int32 numpy.ndarray.
+        """
+        if self._bpe:
+            list_of_words = [self._bpe.encode(words) for words in list_of_words]
+        list_of_words = [words if isinstance(words, list) else words.split()
+                         for words in list_of_words]
+        num_samples = len(list_of_words)
+        # the number of tokens of each sentence, without EOS
+        num_tokens = numpy.array([len(words) for words in list_of_words], dtype=numpy.int32)
+        lengths = num_tokens + 1
+        if num_samples == 0:
+            return numpy.zeros([0, 0], dtype=numpy.int32), lengths
+        ids = numpy.full([num_samples, numpy.max(lengths)], self.pad_id, dtype=numpy.int32)
+        # look up all tokens in one pass
+        get_id = self.vocab_dict.get
+        unk_id = self.unk_id
+        flat_ids = numpy.fromiter(
+            (get_id(w, unk_id) for words in list_of_words for w in words),
+            dtype=numpy.int32, count=int(numpy.sum(num_tokens)))
+        if n_words > 0:
+            flat_ids[flat_ids >= n_words] = unk_id
+        # scatter the tokens into the padded matrix
+        rows = numpy.repeat(numpy.arange(num_samples), num_tokens)
+        starts = numpy.cumsum(num_tokens) - num_tokens
+        cols = numpy.arange(len(flat_ids)) - numpy.repeat(starts, num_tokens)
+        if self._reverse_seq:
+            cols = numpy.repeat(num_tokens, num_tokens) - 1 - cols
+        ids[rows, cols] = flat_ids
+        ids[numpy.arange(num_samples), num_tokens] = self.eos_id
+        return ids, lengths
+
     def decorate_with_unk(self, words, unk_symbol=Constants.UNKOWN):
         """ Append (UNK) to the words that are not in the vocabulary.
 
@@ -217,6 +287,76 @@ class Vocab(object):
             return pred_tokens[::-1]
         return pred_tokens
 
+    def _join_bpe_pieces(self, words):
+        """ Joins BPE pieces, the same as `BPE.decode()`.
+
+        Args:
+            words: A list of word tokens.
+
+        Returns: A list of word tokens.
+        """
+        if not self._fast_bpe_join:
+            return self._bpe.decode(words)
+        if len(words) == 0:
+            return words
+        separator = self._bpe.separator
+        sentence = " ".join(words).replace(separator + " ", "")
+        if sentence.endswith(separator):
+            sentence = sentence[:-2]
+        return sentence.split(" ")
+
+    def decode_batch(self, pred_ids, bpe_decoding=True, reverse_seq=True):
+        """ Converts a batch of token id sequences to lists of word tokens,
+        the same as calling `convert_to_wordlist()` on each of them.
+
+        Args:
+            pred_ids: A 2-d numpy array of token ids with shape
+              [n_samples, timesteps], or a list of lists of token ids.
+            bpe_decoding: Whether to recover from BPE. Set to
+              false only when using this for displaying attention.
+            reverse_seq: Whether to reverse the sequence after transformation.
+              Set to false only when using this for displaying attention.
+
+        Returns: A list of lists of word tokens.
+        """
+        if len(pred_ids) == 0:
+            return []
+        if not isinstance(pred_ids, numpy.ndarray):
+            if len(set([len(ids) for ids in pred_ids])) > 1:
+                # sequences of different lengths
+                return [self.convert_to_wordlist(ids, bpe_decoding, reverse_seq)
+                        for ids in pred_ids]
+            pred_ids = numpy.array(pred_ids, dtype=numpy.int64).reshape([len(pred_ids), -1])
+        n_samples, timesteps = pred_ids.shape
+        tokens = self._id_to_token[pred_ids]
+        is_eos = self._is_eos[pred_ids]
+        has_eos = is_eos.any(axis=1)
+        # the position of the first EOS in each sequence
+        lengths = numpy.where(has_eos, is_eos.argmax(axis=1), timesteps) \
+            if timesteps > 0 else numpy.zeros([n_samples], dtype=numpy.int64)
+        bpe_decoding = bool(bpe_decoding and self._bpe)
+        glued = numpy.zeros([n_samples], dtype=bool)
+        if bpe_decoding and timesteps > 0:
+            # `convert_to_wordlist()` does not stop at an EOS joined to
+            #   the preceding BPE piece, so leave these rare ones to it
+            glued = has_eos & (lengths > 0) & self._is_bpe_piece[
+                pred_ids[numpy.arange(n_samples), numpy.maximum(lengths - 1, 0)]]
+        reverse_seq = reverse_seq and self._reverse_seq
+        results = []
+        for idx in range(n_samples):
+            if glued[idx]:
+                results.append(self.convert_to_wordlist(
+                    pred_ids[idx], bpe_decoding, reverse_seq))
+                continue
+            if has_eos[idx] and timesteps == 1:
+                results.append([''])
+                continue
+            words = tokens[idx, :lengths[idx]].tolist()
+            if bpe_decoding:
+                words = self._join_bpe_pieces(words)
+            results.append(words[::-1] if reverse_seq else words)
+        return results
+
     def __getitem__(self, item):
         """ Function for operator [].
 
@@ -232,7 +372,7 @@ class Vocab(object):
                 raise ValueError("id {} exceeded the size of vocabulary (size={})".format(item, self.vocab_size))
             return self.vocab_r_dict[item]
         elif isinstance(item, six.string_types):
-            return self.vocab_dict[item] if item in self.vocab_dict else self.unk_id
+            return self.vocab_dict.get(item, self.unk_id)
         else:
             raise ValueError("Unrecognized type of item: %s" % str(type(item)))
 
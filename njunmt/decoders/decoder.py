@@ -24,8 +24,13 @@ from njunmt.utils.constants import ModeKeys
 from njunmt.utils.configurable import Configurable
 from njunmt.utils.beam_search import stack_beam_size
 from njunmt.utils.beam_search import gather_states
+from njunmt.utils.beam_search import scatter_states
+from njunmt.utils.beam_search import select_live_rows
+from njunmt.utils.beam_search import live_rows_shape_invariants
 from njunmt.utils.beam_search import BeamSearchStateSpec
+from njunmt.utils.beam_search import greedy_decoding_result
 from njunmt.utils.expert_utils import DecoderOutputRemover
+from njunmt.utils.feedback import GreedyFeedback
 
 
 class Decoder(Configurable):
@@ -57,7 +62,7 @@ class Decoder(Configurable):
         raise NotImplementedError
 
     @abstractmethod
-    def prepare(self, encoder_output, bridge, helper):
+    def prepare(self, encoder_output, bridge, helper, **kwargs):
         """ Prepares for `step()` function.
         For example,
             1. initialize decoder hidden states (for RNN decoders);
@@ -72,6 +77,8 @@ class Decoder(Configurable):
               decoder states.
             helper: An instance of `Feedback` that samples next
               symbols from logits.
+            kwargs: The decoding options passed to `decode()`, e.g.
+              beam_size for mode=INFER.
         Returns: A dict containing decoding states, pre-projected attention
           keys, attention values and attention length, and will be passed
           to `step()` function.
@@ -120,6 +127,52 @@ class Decoder(Configurable):
         """
         return None
 
+    @property
+    def untiled_cache_fields(self):
+        """ Returns a list/tuple of strings. During inference, these
+        fields of the cache from `prepare()` are kept with batch_size
+        rows instead of being stacked `beam_size` times, and `step()`
+        must broadcast them over the beams.
+        """
+        return None
+
+    def stack_beam_size(self, cache, beam_size):
+        """ Stacks the cache from `prepare()` `beam_size` times for beam
+        search, except the fields in `untiled_cache_fields`.
+
+        Args:
+            cache: A dict returned by `prepare()`.
+            beam_size: A python integer, the beam width.
+
+        Returns: A dict with the same structure as `cache`.
+        """
+        untiled_fields = self.untiled_cache_fields or []
+        stacked_cache = stack_beam_size(
+            {k: v for k, v in cache.items() if k not in untiled_fields}, beam_size)
+        stacked_cache.update({k: v for k, v in cache.items() if k in untiled_fields})
+        return stacked_cache
+
+    def gather_live_cache(self, cache, live_ids, beam_size):
+        """ Gathers the cache rows of the sentences kept by early exit.
+
+        Args:
+            cache: A dict with the same structure as `prepare()` returns.
+            live_ids: An int32 Tensor, the indices of the rows to keep, with
+              the beams of each sentence kept contiguous.
+            beam_size: A python integer, the beam width.
+
+        Returns: A dict with the same structure as `cache`.
+        """
+        untiled_fields = self.untiled_cache_fields or []
+        live_cache = gather_states(
+            {k: v for k, v in cache.items() if k not in untiled_fields}, live_ids)
+        if untiled_fields:
+            # the sentence of the first beam
+            sentence_ids = tf.reshape(live_ids, [-1, beam_size])[:, 0] // beam_size
+            live_cache.update(gather_states(
+                {k: v for k, v in cache.items() if k in untiled_fields}, sentence_ids))
+        return live_cache
+
     def decode(self, encoder_output, bridge, helper,
                target_to_embedding_fn,
                outputs_to_logits_fn,
@@ -218,7 +271,12 @@ def dynamic_decode(decoder,
           to logits.
         parallel_iterations: Argument passed to `tf.while_loop`.
         swap_memory: Argument passed to `tf.while_loop`.
-        kwargs:
+        kwargs: Passed to `decoder.prepare()`. For decoder.mode=INFER,
+          "beam_size" is required. If
+          "early_exit" is True, the sentences whose beams are all finished
+          are dropped from the decoder steps, and their outputs are
+          filled with zeros. If `helper` is a `GreedyFeedback`, the symbols
+          are sampled by argmax without reordering the decoding states.
 
     Returns: A tuple `(decoder_output, decoder_status)` for
       decoder.mode=INFER.
@@ -243,11 +301,13 @@ def dynamic_decode(decoder,
     initial_inputs = target_to_embedding_fn(initial_input_symbols, initial_time)
 
     with tf.variable_scope(decoder.name):
-        initial_cache = decoder.prepare(encoder_output, bridge, helper)  # prepare decoder
+        initial_cache = decoder.prepare(encoder_output, bridge, helper, **kwargs)  # prepare decoder
         if decoder.mode == ModeKeys.INFER:
             assert "beam_size" in kwargs
             beam_size = kwargs["beam_size"]
-            initial_cache = stack_beam_size(initial_cache, beam_size)
+            initial_cache = decoder.stack_beam_size(initial_cache, beam_size)
+    early_exit = decoder.mode == ModeKeys.INFER and kwargs.get("early_exit", False)
+    greedy = decoder.mode == ModeKeys.INFER and isinstance(helper, GreedyFeedback)
 
     initial_outputs_ta = nest.map_structure(
         _create_ta, decoder_output_remover.apply(decoder.output_dtype))
@@ -269,23 +329,64 @@ def dynamic_decode(decoder,
         """
         with tf.variable_scope(decoder.name):
             outputs, next_cache = decoder.step(inputs, cache)
+        step_outputs = decoder_output_remover.apply(outputs)
+        if early_exit:
+            # `inputs` and `cache` only hold the rows of `live_rows`
+            live_rows = args[-1]
+            num_rows = tf.shape(finished)[0]
+            step_outputs = scatter_states(step_outputs, live_rows, num_rows)
         outputs_ta = nest.map_structure(lambda ta, out: ta.write(time, out),
-                                        outputs_ta, decoder_output_remover.apply(outputs))
+                                        outputs_ta, step_outputs)
         inner_loop_vars = [time + 1, None, None, outputs_ta, None]
         sample_ids = None
-        if decoder.mode == ModeKeys.INFER:
+        if greedy:
+            log_probs, lengths, ids_ta = args[0], args[1], args[2]
+            with tf.variable_scope(decoder.name):
+                decoder_top_features = decoder.merge_top_features(outputs)
+            logits = outputs_to_logits_fn(decoder_top_features)
+            if early_exit:
+                sample_ids, next_log_probs, next_lengths = helper.sample_symbols(
+                    logits, gather_states(log_probs, live_rows),
+                    gather_states(finished, live_rows),
+                    gather_states(lengths, live_rows), time=time)
+                sample_ids, next_log_probs, next_lengths = scatter_states(
+                    [sample_ids, next_log_probs, next_lengths], live_rows, num_rows,
+                    [tf.fill([num_rows], helper.vocab.eos_id), log_probs, lengths])
+            else:
+                sample_ids, next_log_probs, next_lengths = helper.sample_symbols(
+                    logits, log_probs, finished, lengths, time=time)
+            ids_ta = ids_ta.write(time, sample_ids)
+            inner_loop_vars.extend([next_log_probs, next_lengths, ids_ta])
+        elif decoder.mode == ModeKeys.INFER:
             log_probs, lengths = args[0], args[1]
             bs_stat_ta = args[2]
             predicted_ids = args[3]
             with tf.variable_scope(decoder.name):
                 decoder_top_features = decoder.merge_top_features(outputs)
             logits = outputs_to_logits_fn(decoder_top_features)
-            # sample next symbols
-            sample_ids, beam_ids, next_log_probs, next_lengths \
-                = helper.sample_symbols(logits, log_probs, finished, lengths, time=time)
-            predicted_ids = gather_states(tf.reshape(predicted_ids, [-1, time + 1]), beam_ids)
-
-            next_cache["decoding_states"] = gather_states(next_cache["decoding_states"], beam_ids)
+            # [_batch*_beam, time + 1]
+            predicted_ids = tf.reshape(predicted_ids, [-1, time + 1])
+            if early_exit:
+                # sample next symbols of the live rows, and fill the finished
+                # rows as if they kept generating EOS
+                sample_ids, live_beam_ids, next_log_probs, next_lengths \
+                    = helper.sample_symbols(
+                        logits, gather_states(log_probs, live_rows),
+                        gather_states(finished, live_rows),
+                        gather_states(lengths, live_rows), time=time,
+                        batch_size=tf.shape(live_rows)[0] // beam_size)
+                sample_ids, beam_ids, next_log_probs, next_lengths = scatter_states(
+                    [sample_ids, tf.gather(live_rows, live_beam_ids), next_log_probs, next_lengths],
+                    live_rows, num_rows,
+                    [predicted_ids[:, -1], tf.range(num_rows), log_probs, lengths])
+            else:
+                # sample next symbols
+                sample_ids, beam_ids, next_log_probs, next_lengths \
+                    = helper.sample_symbols(logits, log_probs, finished, lengths, time=time)
+            predicted_ids = gather_states(predicted_ids, beam_ids)
+
+            if not early_exit:
+                next_cache["decoding_states"] = gather_states(next_cache["decoding_states"], beam_ids)
             bs_stat = BeamSearchStateSpec(
                 log_probs=next_log_probs,
                 beam_ids=beam_ids)
@@ -297,9 +398,19 @@ def dynamic_decode(decoder,
             inner_loop_vars.extend([next_log_probs, next_lengths, bs_stat_ta, next_predicted_ids])
 
         next_finished, next_input_symbols = helper.next_symbols(time=time, sample_ids=sample_ids)
-        next_inputs = target_to_embedding_fn(next_input_symbols, time + 1)
 
         next_finished = tf.logical_or(next_finished, finished)
+        if early_exit:
+            # drop the sentences finished at this step
+            keep_ids = select_live_rows(next_finished, live_rows, beam_size)
+            decoding_states = next_cache.pop("decoding_states")
+            next_cache = decoder.gather_live_cache(next_cache, keep_ids, beam_size)
+            next_cache["decoding_states"] = gather_states(
+                decoding_states, keep_ids if greedy else tf.gather(live_beam_ids, keep_ids))
+            next_live_rows = tf.gather(live_rows, keep_ids)
+            next_input_symbols = tf.gather(next_input_symbols, next_live_rows)
+            inner_loop_vars.append(next_live_rows)
+        next_inputs = target_to_embedding_fn(next_input_symbols, time + 1)
         inner_loop_vars[1] = next_inputs
         inner_loop_vars[2] = next_cache
         inner_loop_vars[4] = next_finished
@@ -308,7 +419,11 @@ def dynamic_decode(decoder,
     loop_vars = [initial_time, initial_inputs, initial_cache,
                  initial_outputs_ta, initial_finished]
 
-    if decoder.mode == ModeKeys.INFER:  # add inference-specific parameters
+    if greedy:
+        loop_vars.extend([tf.zeros_like(initial_input_symbols, dtype=tf.float32),
+                          tf.zeros_like(initial_input_symbols, dtype=tf.int32),
+                          _create_ta(tf.int32)])
+    elif decoder.mode == ModeKeys.INFER:  # add inference-specific parameters
         initial_log_probs = tf.zeros_like(initial_input_symbols, dtype=tf.float32)
         initial_lengths = tf.zeros_like(initial_input_symbols, dtype=tf.int32)
         initial_bs_stat_ta = nest.map_structure(_create_ta, BeamSearchStateSpec.dtypes())
@@ -316,17 +431,28 @@ def dynamic_decode(decoder,
         initial_input_symbols.set_shape([None])
         loop_vars.extend([initial_log_probs, initial_lengths, initial_bs_stat_ta,
                           initial_input_symbols])
+    shape_invariants = None
+    if early_exit:
+        loop_vars.append(tf.range(tf.shape(initial_input_symbols)[0]))
+        shape_invariants = live_rows_shape_invariants(loop_vars)
 
     res = tf.while_loop(
         lambda *args: tf.logical_not(tf.reduce_all(args[4])),
         body_traininfer,
         loop_vars=loop_vars,
+        shape_invariants=shape_invariants,
         parallel_iterations=parallel_iterations,
         swap_memory=swap_memory)
+    if early_exit:
+        res = res[:-1]
 
     final_outputs_ta = res[3]
     final_outputs = nest.map_structure(lambda ta: ta.stack(), final_outputs_ta)
 
+    if greedy:
+        log_probs, length, ids_ta = res[-3:]
+        return final_outputs, greedy_decoding_result(res[0], log_probs, length, ids_ta)
+
     if decoder.mode == ModeKeys.INFER:
         timesteps = res[0] + 1
         log_probs, length, bs_stat, predicted_ids = res[-4:]
@@ -113,7 +113,7 @@ class CondAttentionDecoder(Decoder):
             "logits_dimension": 512
         }
 
-    def prepare(self, encoder_output, bridge, helper):
+    def prepare(self, encoder_output, bridge, helper, **kwargs):
         """ Prepares for `step()` function.
         Do:
             1. initialize decoder RNN states using `bridge`;
@@ -127,6 +127,7 @@ class CondAttentionDecoder(Decoder):
               decoder states.
             helper: An instance of `Feedback` that samples next
               symbols from logits.
+            kwargs: The decoding options passed to `decode()`, not used.
         Returns: A dict containing decoder RNN states, pre-projected attention
           keys, attention values and attention length, and will be passed
           to `step()` function.
@@ -295,7 +296,7 @@ class AttentionDecoder(Decoder):
             "logits_dimension": 512,
         }
 
-    def prepare(self, encoder_output, bridge, helper):
+    def prepare(self, encoder_output, bridge, helper, **kwargs):
         """ Prepares for `step()` function.
         Do,
             1. initialize decoder RNN states using `bridge`;
@@ -309,6 +310,7 @@ class AttentionDecoder(Decoder):
               decoder states.
             helper: An instance of `Feedback` that samples next
               symbols from logits.
+            kwargs: The decoding options passed to `decode()`, not used.
         Returns: A dict containing decoder RNN states, pre-projected attention
           keys, attention values and attention length, and will be passed
           to `step()` function.
@@ -460,7 +462,7 @@ class SimpleDecoder(Decoder):
             "logits_dimension": 512,
         }
 
-    def prepare(self, encoder_output, bridge, helper):
+    def prepare(self, encoder_output, bridge, helper, **kwargs):
         """ Prepares for `step()` function.
         Do:
             1. initialize decoder RNN states using `bridge`;
@@ -472,6 +474,7 @@ class SimpleDecoder(Decoder):
               decoder states.
             helper: An instance of `Feedback` that samples next
               symbols from logits.
+            kwargs: The decoding options passed to `decode()`, not used.
         Returns: A dict containing decoder RNN states and will be
           passed to `step()` function.
         """
@@ -30,6 +30,7 @@ from njunmt.layers.common_layers import layer_postprocessing
 from njunmt.layers.common_layers import transformer_ffn_layer
 from njunmt.layers.common_attention import MultiHeadAttention
 from njunmt.layers.common_attention import attention_bias_lower_triangle
+from njunmt.layers.common_attention import FLOAT_MIN
 
 
 class TransformerDecoder(Decoder):
@@ -101,6 +102,14 @@ class TransformerDecoder(Decoder):
                 decoder_hidden=tf.float32,
                 encoder_decoder_attention=[tf.float32] * self.params["num_layers"])
 
+    @property
+    def untiled_cache_fields(self):
+        """ Returns a list/tuple of strings. The encoder-side tensors
+        are stored once for each sentence and broadcast over the
+        beams in the encoder-decoder attention.
+        """
+        return "memory", "memory_bias", "encdec_attention"
+
     def merge_top_features(self, decoder_output):
         """ Merges features of decoder top layers, as the input
         of softmax layer.
@@ -188,7 +197,7 @@ class TransformerDecoder(Decoder):
             **kwargs)
         return outputs, infer_status
 
-    def prepare(self, encoder_output, bridge, helper):
+    def prepare(self, encoder_output, bridge, helper, **kwargs):
         """ Prepares for `step()` function.
         Do
             1. acquire attention information from `encoder_output`;
@@ -199,6 +208,10 @@ class TransformerDecoder(Decoder):
             bridge: None.
             helper: An instance of `Feedback` that samples next
               symbols from logits.
+            kwargs: The decoding options passed to `decode()`. If
+              "preallocate_cache" is True, the self-attention keys/values
+              are allocated to the maximum decoding length at once instead
+              of growing with each step.
 
         Returns: A dict containing decoder RNN states, pre-projected attention
           keys, attention values and attention length, and will be passed
@@ -214,17 +227,24 @@ class TransformerDecoder(Decoder):
                 tf.shape(attention_values)[1], attention_length)
 
         # initialize cache
+        encdec_attention = None
         if self.mode == ModeKeys.INFER:
             decoding_states = {}
+            encdec_attention = {}
             batch_size = tf.shape(attention_values)[0]
             depth = self._self_attention_layers[0].attention_value_depth
             if depth < 0:
                 # TODO please check when code goes into this condition
                 depth = tf.shape(attention_values)[2]
+            cache_length = 0
+            if kwargs.get("preallocate_cache", False):
+                cache_length = helper.maximum_labels_length
+                # the position to write at each step
+                decoding_states["time"] = tf.zeros([batch_size], dtype=tf.int32)
             # initialize decoder self attention keys/values
             for l in range(self.params["num_layers"]):
-                keys = tf.zeros([batch_size, 0, depth])
-                values = tf.zeros([batch_size, 0, depth])
+                keys = tf.zeros([batch_size, cache_length, depth])
+                values = tf.zeros([batch_size, cache_length, depth])
                 # Ensure shape invariance for tf.while_loop.
                 keys.set_shape([None, None, depth])
                 values.set_shape([None, None, depth])
@@ -234,9 +254,11 @@ class TransformerDecoder(Decoder):
                             preproj_keys, preproj_values = self._encdec_attention_layers[l] \
                                 .compute_kv(attention_values)
                 decoding_states["layer_{}".format(l)] = {
-                    "self_attention": {"keys": keys, "values": values},
-                    "encdec_attention": {"attention_keys": preproj_keys,
-                                         "attention_values": preproj_values}}
+                    "self_attention": {"keys": keys, "values": values}}
+                # not influenced by beam search
+                encdec_attention["layer_{}".format(l)] = {
+                    "attention_keys": preproj_keys,
+                    "attention_values": preproj_values}
         else:
             decoding_states = None
 
@@ -244,6 +266,8 @@ class TransformerDecoder(Decoder):
             decoding_states=decoding_states,
             memory=attention_values,
             memory_bias=attention_bias)
+        if encdec_attention is not None:
+            init_cache["encdec_attention"] = encdec_attention
         return init_cache
 
     def step(self, decoder_input, cache):
@@ -291,13 +315,32 @@ class TransformerDecoder(Decoder):
         encdec_attention_values = cache["memory"]
         # [batch_size, 1, 1, max_len_src]
         encdec_attention_bias = cache["memory_bias"]
+        # when mode==INFER, the encoder-side tensors are not stacked over
+        #   the beams, while `decoder_inputs` is [batch_size * beam_size, 1, dmodel]
+        broadcast_beams = "encdec_attention" in cache
 
         decoder_self_attention_scores = []
         encdec_attention_scores = []
 
-        # decoder_self_attention_bias: [1, 1, max_len_trg, max_len_trg]
-        decoder_self_attention_bias = attention_bias_lower_triangle(
-            tf.shape(decoder_inputs)[1])
+        write_mask = None
+        if cache["decoding_states"] is not None and "time" in cache["decoding_states"]:
+            # preallocated self-attention keys/values: [batch_size, cache_length, depth]
+            time = cache["decoding_states"]["time"]
+            cache_length = tf.shape(cache["decoding_states"]["layer_0"]["self_attention"]["keys"])[1]
+            # [batch_size, cache_length]
+            write_mask = tf.one_hot(time, cache_length)
+            # the positions written so far, including the current one
+            filled_length = tf.reduce_max(time) + 1
+            # only attend to the written positions: [batch_size, 1, 1, filled_length]
+            decoder_self_attention_bias = FLOAT_MIN * tf.to_float(
+                tf.expand_dims(tf.range(filled_length), 0) > tf.expand_dims(time, 1))
+            decoder_self_attention_bias = tf.reshape(
+                decoder_self_attention_bias, [-1, 1, 1, filled_length])
+            cache["decoding_states"]["time"] = time + 1
+        else:
+            # decoder_self_attention_bias: [1, 1, max_len_trg, max_len_trg]
+            decoder_self_attention_bias = attention_bias_lower_triangle(
+                tf.shape(decoder_inputs)[1])
         x = dropout_wrapper(decoder_inputs, self.params["layer_prepostprocess_dropout_keep_prob"])
         for layer in range(self.params["num_layers"]):
             layer_name = "layer_{}".format(layer)
@@ -305,8 +348,11 @@ class TransformerDecoder(Decoder):
                 else cache["decoding_states"][layer_name]
             selfatt_cache = None if layer_cache is None \
                 else layer_cache["self_attention"]
-            encdecatt_cache = None if layer_cache is None \
-                else layer_cache["encdec_attention"]
+            encdecatt_cache = cache["encdec_attention"][layer_name] \
+                if broadcast_beams else None
+            if write_mask is not None:
+                selfatt_cache["write_mask"] = write_mask
+                selfatt_cache["filled_length"] = filled_length
             with tf.variable_scope("layer_%d" % layer):
                 with tf.variable_scope("self_attention"):
                     # self attention layer
@@ -317,6 +363,9 @@ class TransformerDecoder(Decoder):
                             dropout_keep_prob=self.params["layer_prepostprocess_dropout_keep_prob"]),
                         memory_bias=decoder_self_attention_bias,
                         cache=selfatt_cache)
+                    if write_mask is not None:
+                        selfatt_cache.pop("write_mask")
+                        selfatt_cache.pop("filled_length")
                     # [batch_size, num_heads, length_q, length_k]
                     decoder_self_attention_scores.append(w_y)
                     # apply dropout, layer norm, residual
@@ -325,14 +374,27 @@ class TransformerDecoder(Decoder):
                         process_sequence=self.params["layer_postprocess_sequence"],
                         dropout_keep_prob=self.params["layer_prepostprocess_dropout_keep_prob"])
                 with tf.variable_scope("encdec_attention"):
+                    query = layer_preprocess(
+                        x=x, process_sequence=self.params["layer_preprocess_sequence"],
+                        dropout_keep_prob=self.params["layer_prepostprocess_dropout_keep_prob"])
+                    if broadcast_beams:
+                        # take the beams as query positions: [batch_size, beam_size, dmodel]
+                        query = tf.reshape(
+                            query, [tf.shape(encdec_attention_values)[0], -1,
+                                    query.get_shape().as_list()[-1]])
                     # encoder-decoder attention
                     w_y, y = self._encdec_attention_layers[layer].build(
-                        query=layer_preprocess(
-                            x=x, process_sequence=self.params["layer_preprocess_sequence"],
-                            dropout_keep_prob=self.params["layer_prepostprocess_dropout_keep_prob"]),
+                        query=query,
                         memory=encdec_attention_values,
                         memory_bias=encdec_attention_bias,
                         cache=encdecatt_cache)
+                    if broadcast_beams:
+                        # [batch_size * beam_size, 1, dmodel]
+                        y = tf.reshape(y, [-1, 1, y.get_shape().as_list()[-1]])
+                        # [batch_size * beam_size, num_heads, 1, max_len_src]
+                        w_y = tf.expand_dims(tf.reshape(
+                            tf.transpose(w_y, [0, 2, 1, 3]),
+                            [-1, tf.shape(w_y)[1], tf.shape(w_y)[3]]), axis=2)
                     # [batch_size, num_heads, length_q, length_k]
                     encdec_attention_scores.append(w_y)
                     # apply dropout, layer norm, residual
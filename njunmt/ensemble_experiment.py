@@ -20,6 +20,9 @@ from njunmt.data.text_inputter import TextLineInputter
 from njunmt.data.data_reader import LineReader
 from njunmt.data.vocab import Vocab
 from njunmt.inference.decode import infer
+from njunmt.inference.decode import count_finished_lines
+from njunmt.inference.decode import truncate_n_best_file
+from njunmt.inference.shortlist import create_shortlist
 from njunmt.models.model_builder import model_fn_ensemble
 from njunmt.nmt_experiment import Experiment
 from njunmt.nmt_experiment import InferExperiment
@@ -88,20 +91,35 @@ class EnsembleExperiment(Experiment):
             inference_options=self._model_configs["infer"])
         predict_op = estimator_spec.predictions
         sess = self._build_default_session()
+        shortlist = create_shortlist(self._model_configs["infer"], vocab_source, vocab_target)
         text_inputter = TextLineInputter(
             line_readers=[LineReader(
                 data=p["features_file"],
                 preprocessing_fn=lambda x: vocab_source.convert_to_idlist(x)) for p in
                           self._model_configs["infer_data"]],
             padding_id=vocab_source.pad_id,
-            batch_size=self._model_configs["infer"]["batch_size"])
+            batch_size=self._model_configs["infer"]["batch_size"],
+            batch_tokens_size=self._model_configs["infer"]["batch_tokens_size"],
+            bucketing=self._model_configs["infer"]["bucketing"])
         sess.run(tf.global_variables_initializer())
         tf.logging.info("Start inference.")
         overall_start_time = time.time()
 
-        for feeding_data, param in zip(text_inputter.make_feeding_data(estimator_spec.input_fields),
-                                       self._model_configs["infer_data"]):
+        skip_lines = [count_finished_lines(p["output_file"])
+                      if self._model_configs["infer"]["resume"] else 0
+                      for p in self._model_configs["infer_data"]]
+        for feeding_data, param, skip in zip(text_inputter.make_feeding_data(
+                estimator_spec.input_fields, in_memory=False, skip_lines=skip_lines),
+                self._model_configs["infer_data"], skip_lines):
             tf.logging.info("Infer Source Features File: {}.".format(param["features_file"]))
+            if skip > 0:
+                tf.logging.info("Resume from line {} of {}.".format(skip, param["output_file"]))
+            n_best_output = None
+            if self._model_configs["infer"]["n_best"] > 1:
+                # the n-best lists are written next to the 1-best translations
+                n_best_output = param["output_file"] + ".nbest"
+                if skip > 0:
+                    truncate_n_best_file(n_best_output, skip)
             start_time = time.time()
             infer(sess=sess,
                   prediction_op=predict_op,
@@ -112,7 +130,14 @@ class EnsembleExperiment(Experiment):
                   delimiter=self._model_configs["infer"]["delimiter"],
                   output_attention=False,
                   tokenize_output=self._model_configs["infer"]["char_level"],
-                  verbose=True)
+                  verbose=True,
+                  append_output=skip > 0,
+                  return_results=False,
+                  shortlist=shortlist,
+                  input_fields=estimator_spec.input_fields,
+                  n_best=self._model_configs["infer"]["n_best"],
+                  n_best_output=n_best_output,
+                  first_index=skip)
             tf.logging.info("FINISHED {}. Elapsed Time: {}."
                             .format(param["features_file"], str(time.time() - start_time)))
             if param["labels_file"] is not None:
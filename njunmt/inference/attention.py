@@ -116,7 +116,8 @@ def pack_batch_attention_dict(
         base_index,
         source_tokens,
         candidate_tokens,
-        attentions):
+        attentions,
+        indices=None):
     """ Packs the attention information into a dictionary for visualization.
 
     Args:
@@ -124,6 +125,8 @@ def pack_batch_attention_dict(
         source_tokens: A list of samples. Each sample is a list of string tokens.
         candidate_tokens: A list of sample candidate. Each sample candidate is a list of string tokens.
         attentions: A list of attentions.
+        indices: A list of integers, the sample indices used as keys. If not
+          provided, `base_index` + the position in the batch is used.
 
     Returns: A packed dictionary of attention information for visualization.
     """
@@ -168,7 +171,7 @@ def pack_batch_attention_dict(
                         "type": "multihead"})
             else:
                 raise NotImplementedError
-        ret_attentions[base_index + idx] = att
+        ret_attentions[base_index + idx if indices is None else indices[idx]] = att
     return ret_attentions
 
 
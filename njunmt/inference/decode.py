@@ -16,7 +16,13 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import sys
+import threading
+import time
+
 import numpy
+import six
+from six.moves import queue
 import tensorflow as tf
 from tensorflow import gfile
 
@@ -26,6 +32,7 @@ from njunmt.inference.attention import pack_batch_attention_dict
 from njunmt.inference.attention import dump_attentions
 from njunmt.tools.tokenizeChinese import to_chinese_char
 from njunmt.utils.expert_utils import repeat_n_times
+from njunmt.utils.misc import open_file
 
 
 def _evaluate(
@@ -141,9 +148,9 @@ def _infer(
           returned.
         output_attention: Whether to output attention.
 
-    Returns: A tuple `(predicted_sequences, attention_scores)`.
-      The `predicted_sequences` is a list of hypothesis with
-      approx [`top_k` * `batch_sze`, sequence_length].
+    Returns: A tuple `(predicted_sequences, scores, attention_scores)`.
+      The `predicted_sequences` is a list of numpy arrays, one for each
+      model replica, with shape [`top_k` * n_samples, sequence_length].
       The `attention_scores` is None if there is no attention
       related information in `prediction_op`.
     """
@@ -167,22 +174,21 @@ def _infer(
                        lambda p: p.shape[0],
                        predict_out["sorted_hypothesis"]))
     beam_size = total_samples // batch_size
+    top_k = min(top_k, beam_size)
 
     def _post_process_hypo(pred, score, **kwargs):
         _num_samples = pred.shape[0]
         _batch_size = _num_samples // beam_size
-        batch_beam_pos = numpy.tile(numpy.arange(_batch_size) * beam_size, [beam_size, 1]).transpose()
-        batch_beam_topk_add = numpy.tile(numpy.arange(top_k), [batch_beam_pos.shape[0], 1])
-        batch_beam_pos = numpy.reshape(
-            batch_beam_pos[:, :top_k] + batch_beam_topk_add, -1)
+        batch_beam_pos = (numpy.arange(_batch_size)[:, None] * beam_size
+                          + numpy.arange(top_k)[None, :]).reshape(-1)
         if output_attention:
             atts = postprocess_attention(
                 beam_ids=kwargs["beam_ids"],
                 attention_dict=kwargs["attentions"],
                 gather_idx=kwargs["sorted_argidx"][batch_beam_pos])
-            return pred[batch_beam_pos, :].tolist(), score[batch_beam_pos], atts
+            return pred[batch_beam_pos, :], score[batch_beam_pos], atts
         # [_batch * _beam, timesteps] => [_batch * top_k, timesteps]
-        return pred[batch_beam_pos, :].tolist(), score[batch_beam_pos], []
+        return pred[batch_beam_pos, :], score[batch_beam_pos], []
 
     hypothesises, scores, attentions = repeat_n_times(
         avail,
@@ -192,10 +198,122 @@ def _infer(
         beam_ids=predict_out.get("beam_ids", None),
         attentions=predict_out.get("attentions", None),
         sorted_argidx=predict_out.get("sorted_argidx", None))
-    hypothesis = sum(hypothesises, [])
     score = numpy.concatenate(scores, axis=0)
     attention = sum(attentions, [])
-    return hypothesis, score, attention
+    return hypothesises, score, attention
+
+
+# marks the end of the items passed between pipeline threads
+_END_OF_DATA = object()
+
+
+def _prefetch(iterable, queue_size):
+    """ Iterates over `iterable` in a background thread, at most
+    `queue_size` elements ahead of the caller.
+
+    Args:
+        iterable: An iterable instance.
+        queue_size: The maximum number of prefetched elements. If <= 0,
+          `iterable` is iterated in the calling thread.
+
+    Returns: A generator over the elements of `iterable`. Exceptions
+      raised by `iterable` are re-raised by the generator.
+    """
+    if queue_size <= 0:
+        for item in iterable:
+            yield item
+        return
+    buf = queue.Queue(maxsize=queue_size)
+    stopped = threading.Event()
+
+    def _put(item):
+        while not stopped.is_set():
+            try:
+                buf.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce():
+        try:
+            for item in iterable:
+                if not _put((item, None)):
+                    return
+            _put((_END_OF_DATA, None))
+        except Exception:
+            _put((None, sys.exc_info()))
+
+    thread = threading.Thread(target=_produce, name="InferPrefetch")
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, exc_info = buf.get()
+            if exc_info is not None:
+                six.reraise(*exc_info)
+            if item is _END_OF_DATA:
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+class _BackgroundWorker(object):
+    """ Calls a function on each item in a background thread, in the
+    order the items are put. """
+
+    def __init__(self, fn, queue_size):
+        """ Initializes and starts the worker.
+
+        Args:
+            fn: A callable taking one item.
+            queue_size: The maximum number of waiting items. If <= 0,
+              `fn` is called in the thread putting the item.
+        """
+        self._fn = fn
+        self._exc_info = None
+        self._thread = None
+        if queue_size > 0:
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._thread = threading.Thread(target=self._loop, name="InferPostprocess")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is _END_OF_DATA:
+                return
+            if self._exc_info is None:  # keeps draining after an error
+                try:
+                    self._fn(item)
+                except Exception:
+                    self._exc_info = sys.exc_info()
+
+    def _raise_error(self):
+        if self._exc_info is not None:
+            six.reraise(*self._exc_info)
+
+    def put(self, item):
+        """ Processes `item`, raising the error of a previous item if any. """
+        self._raise_error()
+        if self._thread is None:
+            self._fn(item)
+        else:
+            self._queue.put(item)
+
+    def close(self, raise_error=True):
+        """ Waits for all items to be processed.
+
+        Args:
+            raise_error: Whether to raise the error of any item.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_END_OF_DATA)
+            self._thread.join()
+        if raise_error:
+            self._raise_error()
 
 
 def infer(
@@ -208,66 +326,272 @@ def infer(
         delimiter=" ",
         output_attention=False,
         tokenize_output=False,
-        verbose=True):
+        verbose=True,
+        append_output=False,
+        return_results=True,
+        prefetch_size=2,
+        profile=None,
+        shortlist=None,
+        input_fields=None,
+        n_best=1,
+        n_best_output=None,
+        first_index=0,
+        n_best_results=None):
     """ Infers data and save the prediction results.
 
+    The translations are appended to `output` batch by batch, as soon as
+    all samples before them are translated. Preparing the next batches
+    (reading `infer_data`) and post-processing the finished ones (word
+    mapping, BPE decoding, writing) run in background threads, so that
+    the session does not wait for python code.
+
     Args:
         sess: `tf.Session`.
         prediction_op: Tensorflow operation for inference.
         infer_data: An iterable instance that each element
-          is a packed feeding dictionary for `sess`.
+          is a packed feeding dictionary for `sess`. If an element
+          has the key "indices", the results are restored to the order
+          given by these sample indices.
         output: Output file name, `str`.
         vocab_source: A `Vocab` instance for source side feature map.
         vocab_target: A `Vocab` instance for target side feature map.
-        alpha: A scalar number, length penalty rate. If not provided
-          or < 0, simply average each beam by length of predicted
-          sequence.
         delimiter: The delimiter of output token sequence.
         output_attention: Whether to output attention information.
         tokenize_output: Whether to split words into characters
           (only for Chinese).
         verbose: Print inference information if set True.
+        append_output: Whether to append to `output` instead of
+          overwriting it, e.g. when resuming an interrupted run.
+        return_results: Whether to collect and return all results. If
+          False, the memory usage does not grow with the size of
+          `infer_data` and empty results are returned.
+        prefetch_size: The maximum number of batches queued before and
+          after the session. If 0, everything runs in the calling thread.
+        profile: A dict to accumulate timing information into, if provided.
+          The keys "preprocess", "session" and "postprocess" hold the
+          seconds spent in each stage. "detokenize" is a sub-interval of
+          "postprocess": the seconds spent splitting the output into
+          characters (`tokenize_output`). "batch_latency" is a list of
+          seconds from the session run of each batch to its output, and
+          "num_source_tokens" and "num_target_tokens" are the token counts.
+        shortlist: A `Shortlist` instance. If provided, the target vocabulary
+          shortlist of each batch is fed to `input_fields`.
+        input_fields: A list of input fields dict of `prediction_op`, only
+          needed with `shortlist`.
+        n_best: The number of hypotheses kept for each sample, taken from
+          the finished beams, so no more than the beam size.
+        n_best_output: The n-best list file name, each line of which is
+          "id ||| hypothesis ||| score", if provided.
+        first_index: The id of the first sample in the n-best list, e.g.
+          the number of lines skipped when resuming.
+        n_best_results: A list to extend with the n-best list of each
+          sample, a list of `(hypothesis, score)` tuples, if provided.
+
+    Returns: A tuple `(sources, hypothesis, scores)`, two lists of
+      strings and a numpy array.
 
-    Returns: A tuple `(sources, hypothesis)`, two lists of
-      strings.
+    Raises:
+        ValueError: if `n_best` > 1 with `output_attention`.
     """
+    if n_best > 1 and output_attention:
+        raise ValueError("`output_attention` only accepts `n_best`=1.")
     attentions = dict()
     hypothesis = []
     scores = []
     sources = []
-    cnt = 0
-    for data in infer_data:
-        source_tokens = [vocab_source.convert_to_wordlist(
-            x, bpe_decoding=False, reverse_seq=False)
-                         for x in data["feature_ids"]]
-        x_str = [delimiter.join(x) for x in source_tokens]
-        prediction, score, att = _infer(
-            sess=sess,
-            feed_dict=data["feed_dict"],
-            prediction_op=prediction_op,
-            batch_size=len(x_str),
-            top_k=1,
-            output_attention=output_attention)
-
-        sources.extend(x_str)
-        scores.append(score)
-        hypothesis.extend([delimiter.join(vocab_target.convert_to_wordlist(prediction[sample_idx]))
-                           for sample_idx in range(len(prediction))])
+    # translated samples waiting for the samples before them
+    pending = dict()
+    next_index = [0]
+    num_finished = [0]
+    if profile is not None:
+        for key in ["preprocess", "session", "postprocess", "detokenize",
+                    "num_source_tokens", "num_target_tokens"]:
+            profile.setdefault(key, 0)
+        profile.setdefault("batch_latency", [])
+    fw = None
+    fw_n_best = None
+    if output:
+        fw = open_file(output, encoding="utf-8", mode="a" if append_output else "w")
+    if n_best_output:
+        fw_n_best = open_file(n_best_output, encoding="utf-8", mode="a" if append_output else "w")
+
+    def _collect(results):
+        if len(results) == 0:
+            return
+        hypos = [hypo for _, _, hypo, _, _ in results]
+        n_bests = [cands for _, _, _, _, cands in results]
+        if tokenize_output:
+            start_time = time.time()
+            hypos = to_chinese_char(hypos)
+            if n_best > 1:
+                n_bests = [list(zip(to_chinese_char([hypo for hypo, _ in cands]),
+                                    [score for _, score in cands]))
+                           for cands in n_bests]
+            if profile is not None:
+                profile["detokenize"] += time.time() - start_time
+        if n_best > 1:
+            # written before the 1-best translations, so that resuming
+            #   from the output file never misses any n-best list
+            if fw_n_best is not None:
+                fw_n_best.write("".join([
+                    "{} ||| {} ||| {:.6f}\n".format(first_index + index, hypo, score)
+                    for (index, _, _, _, _), cands in zip(results, n_bests)
+                    for hypo, score in cands]))
+                fw_n_best.flush()
+            if n_best_results is not None:
+                n_best_results.extend(n_bests)
+        if fw is not None:
+            fw.write("".join([hypo + "\n" for hypo in hypos]))
+            fw.flush()
+        if return_results:
+            sources.extend([src for _, src, _, _, _ in results])
+            hypothesis.extend(hypos)
+            scores.extend([score for _, _, _, score, _ in results])
+
+    def _pop_ready():
+        results = []
+        while next_index[0] in pending:
+            results.append(pending.pop(next_index[0]))
+            next_index[0] += 1
+        return results
+
+    def _preprocess():
+        cnt = 0
+        data_iter = iter(infer_data)
+        while True:
+            start_time = time.time()
+            try:
+                data = next(data_iter)
+            except StopIteration:
+                return
+            source_tokens = [vocab_source.convert_to_wordlist(
+                x, bpe_decoding=False, reverse_seq=False)
+                             for x in data["feature_ids"]]
+            x_str = [delimiter.join(x) for x in source_tokens]
+            batch_indices = data.get("indices", list(range(cnt, cnt + len(x_str))))
+            cnt += len(x_str)
+            if shortlist is not None:
+                shortlist.add_to_feed_dict(data["feed_dict"], data["feature_ids"], input_fields)
+            if profile is not None:
+                profile["preprocess"] += time.time() - start_time
+                profile["num_source_tokens"] += sum([len(x) for x in data["feature_ids"]])
+            yield data["feed_dict"], source_tokens, x_str, batch_indices
+
+    def _postprocess(item):
+        batch_indices, source_tokens, x_str, prediction, score, att, session_start_time = item
+        start_time = time.time()
+        num_target_tokens = 0
+        # the hypotheses of each sample are consecutive, sorted by scores
+        hypos_tokens = sum([vocab_target.decode_batch(pred) for pred in prediction], [])
+        top_k = len(hypos_tokens) // len(batch_indices)
+        for sample_idx, index in enumerate(batch_indices):
+            hypo_tokens = hypos_tokens[sample_idx * top_k]
+            num_target_tokens += len(hypo_tokens)
+            candidates = None
+            if n_best > 1:
+                candidates = [(delimiter.join(hypos_tokens[sample_idx * top_k + k]),
+                               score[sample_idx * top_k + k]) for k in range(top_k)]
+            pending[index] = (
+                index,
+                x_str[sample_idx],
+                delimiter.join(hypo_tokens),
+                score[sample_idx * top_k],
+                candidates)
+        _collect(_pop_ready())
         if output_attention and att is not None:
-            candidate_tokens = [vocab_target.convert_to_wordlist(
-                prediction[idx], bpe_decoding=False, reverse_seq=False)
-                                for idx in range(len(x_str))]
+            candidate_tokens = sum([vocab_target.decode_batch(
+                pred, bpe_decoding=False, reverse_seq=False) for pred in prediction], [])
 
             attentions.update(pack_batch_attention_dict(
-                cnt, source_tokens, candidate_tokens, att))
-        cnt += len(x_str)
+                None, source_tokens, candidate_tokens, att,
+                indices=batch_indices))
+        num_finished[0] += len(x_str)
+        if profile is not None:
+            end_time = time.time()
+            profile["postprocess"] += end_time - start_time
+            profile["batch_latency"].append(end_time - session_start_time)
+            profile["num_target_tokens"] += num_target_tokens
         if verbose:
-            tf.logging.info(cnt)
-    if tokenize_output:
-        hypothesis = to_chinese_char(hypothesis)
-    if output:
-        with gfile.GFile(output, "w") as fw:
-            fw.write("\n".join(hypothesis) + "\n")
+            tf.logging.info(num_finished[0])
+
+    postprocessor = _BackgroundWorker(_postprocess, prefetch_size)
+    try:
+        for feed_dict, source_tokens, x_str, batch_indices in _prefetch(
+                _preprocess(), prefetch_size):
+            session_start_time = time.time()
+            prediction, score, att = _infer(
+                sess=sess,
+                feed_dict=feed_dict,
+                prediction_op=prediction_op,
+                batch_size=len(x_str),
+                top_k=n_best,
+                output_attention=output_attention)
+            if profile is not None:
+                profile["session"] += time.time() - session_start_time
+            postprocessor.put((batch_indices, source_tokens, x_str, prediction,
+                               score, att, session_start_time))
+        postprocessor.close()
+        # in case of gaps in the sample indices
+        _collect([pending.pop(index) for index in sorted(pending.keys())])
+    except:
+        postprocessor.close(raise_error=False)
+        raise
+    finally:
+        if fw is not None:
+            fw.close()
+        if fw_n_best is not None:
+            fw_n_best.close()
     if output_attention:
         dump_attentions(output, attentions)
-    return sources, hypothesis, numpy.concatenate(scores, axis=0)
+    return sources, hypothesis, numpy.array(scores, dtype=numpy.float32)
+
+
+def count_finished_lines(output):
+    """ Counts the complete lines of a partially written output file,
+    removing the trailing incomplete line if any.
+
+    Args:
+        output: Output file name, `str`.
+
+    Returns: The number of complete lines, 0 if `output` does not exist.
+    """
+    if not output or not gfile.Exists(output):
+        return 0
+    num_lines = 0
+    size = 0
+    complete_size = 0
+    with open(output, "rb") as fp:
+        while True:
+            chunk = fp.read(1024 * 1024)
+            if not chunk:
+                break
+            num_lines += chunk.count(b"\n")
+            pos = chunk.rfind(b"\n")
+            if pos >= 0:
+                complete_size = size + pos + 1
+            size += len(chunk)
+    if complete_size < size:
+        with open(output, "rb+") as fp:
+            fp.truncate(complete_size)
+    return num_lines
+
+
+def truncate_n_best_file(n_best_output, num_samples):
+    """ Truncates a partially written n-best list file to the lists of
+    the first `num_samples` samples, when resuming from an output file
+    of `num_samples` complete lines.
+
+    Args:
+        n_best_output: The n-best list file name, `str`.
+        num_samples: The number of samples to keep.
+    """
+    if not n_best_output or not gfile.Exists(n_best_output):
+        return
+    size = 0
+    with open(n_best_output, "rb") as fp:
+        for line in fp:
+            if not line.endswith(b"\n") or int(line.split(b" ||| ", 1)[0]) >= num_samples:
+                break
+            size += len(line)
+    with open(n_best_output, "rb+") as fp:
+        fp.truncate(size)
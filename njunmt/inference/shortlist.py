@@ -0,0 +1,116 @@
+# Copyright 2017 Natural Language Processing Group, Nanjing University, zhaocq.nlp@gmail.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Define the target vocabulary shortlist for inference. """
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy
+import tensorflow as tf
+
+from njunmt.utils.constants import Constants
+from njunmt.utils.misc import open_file
+
+
+class Shortlist(object):
+    """ Selects the target words that may appear in the translations
+    of a batch: the lexical translation candidates of the source words
+    plus the most frequent target words. """
+
+    def __init__(self, filename, vocab_source, vocab_target,
+                 topk=50, num_frequent=1000):
+        """ Loads the lexical translation table.
+
+        Args:
+            filename: Path to the lexical translation table, each line of
+              which is "source_word target_word probability", e.g. from a
+              word alignment. The words are the (BPE) tokens of the
+              vocabularies.
+            vocab_source: A `Vocab` instance for source side.
+            vocab_target: A `Vocab` instance for target side.
+            topk: The maximum number of candidates of each source word.
+            num_frequent: The number of the most frequent target words
+              always in the shortlist, i.e. the first ones of the
+              vocabulary file.
+
+        Raises:
+            ValueError: if `filename` does not exist.
+        """
+        if not tf.gfile.Exists(filename):
+            raise ValueError("File does not exist: {}".format(filename))
+        candidates = dict()
+        with open_file(filename, encoding="utf-8") as fp:
+            for line in fp:
+                fields = line.strip().split()
+                if len(fields) != 3:
+                    continue
+                src, trg, prob = fields
+                if src not in vocab_source.vocab_dict or trg not in vocab_target.vocab_dict:
+                    continue
+                candidates.setdefault(vocab_source.vocab_dict[src], []).append(
+                    (float(prob), vocab_target.vocab_dict[trg]))
+        self._candidates = {
+            src: numpy.array([trg for _, trg in sorted(cands, reverse=True)[:topk]],
+                             dtype=numpy.int32)
+            for src, cands in candidates.items()}
+        self._base_ids = numpy.array(
+            list(range(min(num_frequent, vocab_target.vocab_size)))
+            + [vocab_target.unk_id, vocab_target.eos_id], dtype=numpy.int32)
+        self._empty = numpy.zeros([0], dtype=numpy.int32)
+        tf.logging.info("Loaded lexical translation candidates of {} source words from {}."
+                        .format(len(self._candidates), filename))
+
+    def build(self, feature_ids):
+        """ Returns the shortlist of a batch.
+
+        Args:
+            feature_ids: A list of lists of source token ids.
+
+        Returns: A sorted numpy int32 array of target token ids.
+        """
+        source_ids = set()
+        for ids in feature_ids:
+            source_ids.update(ids)
+        return numpy.unique(numpy.concatenate(
+            [self._base_ids] + [self._candidates.get(i, self._empty) for i in source_ids]))
+
+    def add_to_feed_dict(self, feed_dict, feature_ids, input_fields):
+        """ Feeds the shortlist of a batch to each model replica.
+
+        Args:
+            feed_dict: A feeding dict of the batch, updated in place.
+            feature_ids: A list of lists of source token ids.
+            input_fields: A list of input fields dict.
+        """
+        shortlist_ids = self.build(feature_ids)
+        for inpf in input_fields:
+            feed_dict[inpf[Constants.SHORTLIST_IDS_NAME]] = shortlist_ids
+
+
+def create_shortlist(infer_options, vocab_source, vocab_target):
+    """ Creates the shortlist from inference options.
+
+    Args:
+        infer_options: A dict of inference options, containing
+          shortlist_file, shortlist_topk and shortlist_frequent.
+        vocab_source: A `Vocab` instance for source side.
+        vocab_target: A `Vocab` instance for target side.
+
+    Returns: A `Shortlist` instance, or None if "shortlist_file" is None.
+    """
+    if infer_options["shortlist_file"] is None:
+        return None
+    return Shortlist(infer_options["shortlist_file"], vocab_source, vocab_target,
+                     topk=infer_options["shortlist_topk"],
+                     num_frequent=infer_options["shortlist_frequent"])
@@ -450,13 +450,26 @@ class MultiHeadAttention(BaseAttention):
             memory: Attention values tensor with shape
               [batch_size, length_m, channels_value]
             cache: A dictionary containing pre-projected keys and values.
+              For self-attention, if it contains "write_mask", the keys and
+              values are preallocated and the current ones are written at
+              the positions of "write_mask", and only the first
+              "filled_length" positions are attended to.
 
         Returns: A tuple `(query_transformed, key_transformed, memory_transformed)`.
         """
         if query is None:
             # indicates self-attention
             q, k, v = self.compute_qkv(memory)
-            if cache is not None:
+            if cache is not None and "write_mask" in cache:
+                # [batch_size, cache_length, 1]
+                write_mask = tf.expand_dims(cache["write_mask"], axis=2)
+                k = cache["keys"] * (1. - write_mask) + k * write_mask
+                v = cache["values"] * (1. - write_mask) + v * write_mask
+                cache["keys"] = k
+                cache["values"] = v
+                k = k[:, :cache["filled_length"]]
+                v = v[:, :cache["filled_length"]]
+            elif cache is not None:
                 # for self-attention in transformer decoder when mode=INFER
                 k = tf.concat([cache["keys"], k], axis=1)
                 v = tf.concat([cache["values"], v], axis=1)
@@ -165,11 +165,13 @@ class Modality(Configurable):
         """ Returns the size of vocabulary. """
         return self._vocab_size
 
-    def top(self, top_features):
+    def top(self, top_features, shortlist_ids=None):
         """ Computes logits on the top layer.
 
         Args:
             top_features: A Tensor.
+            shortlist_ids: An int32 Tensor with shape [shortlist_size, ]. If
+              provided, only computes the logits of these target words.
 
         Returns: A logits Tensor.
         """
@@ -179,10 +181,15 @@ class Modality(Configurable):
                 "when shared_embedding_and_softmax_weights, dim_logits should be equal to input_depth"
             scope_name = "shared"
             with tf.variable_scope(scope_name, reuse=True):
-                var = tf.transpose(self._get_weight(feature_last_dim), [1, 0])
+                var = self._get_weight(feature_last_dim)
+                if shortlist_ids is not None:
+                    var = tf.gather(var, shortlist_ids)
+                var = tf.transpose(var, [1, 0])
         else:
             scope_name = "softmax"
             var = None
+        if shortlist_ids is not None:
+            return self._shortlist_top(top_features, shortlist_ids, var, scope_name)
         logits = fflayer(top_features,
                          output_size=self.top_dimension,
                          handle=var, activation=None,
@@ -191,6 +198,29 @@ class Modality(Configurable):
                          name=scope_name)
         return logits
 
+    def _shortlist_top(self, top_features, shortlist_ids, var, scope_name):
+        """ Computes logits of the shortlist words with the same
+        variables as `top()`.
+
+        Args:
+            top_features: A 2-d Tensor, [batch_size, dim].
+            shortlist_ids: An int32 Tensor with shape [shortlist_size, ].
+            var: The sliced shared weight [dim, shortlist_size], or None.
+            scope_name: The variable scope of the softmax variables.
+
+        Returns: A logits Tensor with shape [batch_size, shortlist_size].
+        """
+        feature_last_dim = top_features.get_shape().as_list()[-1]
+        with tf.variable_scope(scope_name):
+            if var is None:
+                # [dim, vocab_size] => [dim, shortlist_size]
+                var = tf.gather(tf.get_variable(
+                    "W", [feature_last_dim, self.top_dimension]), shortlist_ids, axis=1)
+            bias = tf.gather(tf.get_variable(
+                "b", [self.top_dimension],
+                initializer=tf.constant_initializer(0.0)), shortlist_ids)
+        return tf.nn.bias_add(tf.matmul(top_features, var), bias)
+
     def bottom_simple(self, x, name, reuse, time=None):
         """ Embeds the symbols.
 
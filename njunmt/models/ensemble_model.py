@@ -20,13 +20,18 @@ import os
 import tensorflow as tf
 from tensorflow.python.util import nest
 
-from njunmt.utils.beam_search import stack_beam_size
 from njunmt.utils.beam_search import BeamSearchStateSpec
+from njunmt.utils.beam_search import compute_labels_length_limit
 from njunmt.utils.beam_search import gather_states
+from njunmt.utils.beam_search import greedy_decoding_result
+from njunmt.utils.beam_search import scatter_states
+from njunmt.utils.beam_search import select_live_rows
+from njunmt.utils.beam_search import live_rows_shape_invariants
 from njunmt.utils.beam_search import process_beam_predictions
 from njunmt.utils.expert_utils import DecoderOutputRemover
 from njunmt.utils.expert_utils import repeat_n_times
 from njunmt.utils.feedback import BeamFeedback
+from njunmt.utils.feedback import GreedyFeedback
 from njunmt.utils.constants import Constants
 
 
@@ -57,7 +62,11 @@ def dynamic_ensemble_decode(
           to logits.
         parallel_iterations: Argument passed to `tf.while_loop`.
         swap_memory: Argument passed to `tf.while_loop`.
-        kwargs:
+        kwargs: Passed to `Decoder.prepare()`. "beam_size" is required. If
+          "early_exit" is True, the sentences whose beams are all finished
+          are dropped from the decoder steps. If `helper` is a
+          `GreedyFeedback`, the symbols are sampled by argmax without
+          reordering the decoding states.
 
     Returns: The results of inference, an instance of `collections.namedtuple`
       whose element types are defined by `BeamSearchStateSpec`, indicating
@@ -87,11 +96,13 @@ def dynamic_ensemble_decode(
 
     assert "beam_size" in kwargs
     beam_size = kwargs["beam_size"]
+    early_exit = kwargs.get("early_exit", False)
+    greedy = isinstance(helper, GreedyFeedback)
 
     def _create_cache(_decoder, _encoder_output, _bridge):
         with tf.variable_scope(_decoder.name):
-            _init_cache = _decoder.prepare(_encoder_output, _bridge, helper)
-            _init_cache = stack_beam_size(_init_cache, beam_size)
+            _init_cache = _decoder.prepare(_encoder_output, _bridge, helper, **kwargs)
+            _init_cache = _decoder.stack_beam_size(_init_cache, beam_size)
         return _init_cache
 
     initial_caches = repeat_n_times(
@@ -103,7 +114,7 @@ def dynamic_ensemble_decode(
                            for _decoder_output_remover, _decoder in zip(decoder_output_removers, decoders)]
 
     def body_infer(time, inputs, caches, outputs_tas, finished,
-                   log_probs, lengths, bs_stat_ta, predicted_ids):
+                   log_probs, lengths, *args):
         """Internal while_loop body.
 
         Args:
@@ -114,22 +125,31 @@ def dynamic_ensemble_decode(
           finished: A bool tensor (keeping track of what's finished).
           log_probs: The log probability Tensor.
           lengths: The decoding length Tensor.
-          bs_stat_ta: structure of TensorArray.
-          predicted_ids: A Tensor.
+          args: The structure of TensorArray and the predicted ids for
+            beam search, or the TensorArray of sampled ids for greedy
+            search, followed by the live rows for early exit.
 
         Returns:
           `(time + 1, next_inputs, next_caches, next_outputs_tas,
-          next_finished, next_log_probs, next_lengths, next_infer_status_ta)`.
+          next_finished, next_log_probs, next_lengths, *search_vars)`.
         """
 
+        if early_exit:
+            # `inputs` and `caches` only hold the rows of `live_rows`
+            live_rows = args[-1]
+            num_rows = tf.shape(finished)[0]
+
         # step decoder
         def _decoding(_decoder, _input, _cache, _decoder_output_remover,
                       _outputs_ta, _outputs_to_logits_fn):
             with tf.variable_scope(_decoder.name):
                 _output, _next_cache = _decoder.step(_input, _cache)
                 _decoder_top_features = _decoder.merge_top_features(_output)
+            _step_output = _decoder_output_remover.apply(_output)
+            if early_exit:
+                _step_output = scatter_states(_step_output, live_rows, num_rows)
             _ta = nest.map_structure(lambda _ta_ms, _output_ms: _ta_ms.write(time, _output_ms),
-                                     _outputs_ta, _decoder_output_remover.apply(_output))
+                                     _outputs_ta, _step_output)
             _logit = _outputs_to_logits_fn(_decoder_top_features)
             return _output, _next_cache, _ta, _logit
 
@@ -138,47 +158,105 @@ def dynamic_ensemble_decode(
             decoders, inputs, caches, decoder_output_removers,
             outputs_tas, outputs_to_logits_fns)
 
-        # sample next symbols
-        sample_ids, beam_ids, next_log_probs, next_lengths \
-            = helper.sample_symbols(logits, log_probs, finished, lengths, time=time)
-
-        for c in next_caches:
-            c["decoding_states"] = gather_states(c["decoding_states"], beam_ids)
-
-        infer_status = BeamSearchStateSpec(
-            log_probs=next_log_probs,
-            beam_ids=beam_ids)
-        bs_stat_ta = nest.map_structure(lambda ta, out: ta.write(time, out),
-                                        bs_stat_ta, infer_status)
-        predicted_ids = gather_states(tf.reshape(predicted_ids, [-1, time + 1]), beam_ids)
-        next_predicted_ids = tf.concat([predicted_ids, tf.expand_dims(sample_ids, axis=1)], axis=1)
-        next_predicted_ids = tf.reshape(next_predicted_ids, [-1])
-        next_predicted_ids.set_shape([None])
+        if greedy:
+            ids_ta = args[0]
+            if early_exit:
+                sample_ids, next_log_probs, next_lengths = helper.sample_symbols(
+                    logits, gather_states(log_probs, live_rows),
+                    gather_states(finished, live_rows),
+                    gather_states(lengths, live_rows), time=time)
+                sample_ids, next_log_probs, next_lengths = scatter_states(
+                    [sample_ids, next_log_probs, next_lengths], live_rows, num_rows,
+                    [tf.fill([num_rows], helper.vocab.eos_id), log_probs, lengths])
+            else:
+                sample_ids, next_log_probs, next_lengths = helper.sample_symbols(
+                    logits, log_probs, finished, lengths, time=time)
+            search_vars = [ids_ta.write(time, sample_ids)]
+        else:
+            bs_stat_ta, predicted_ids = args[0], args[1]
+            # [_batch*_beam, time + 1]
+            predicted_ids = tf.reshape(predicted_ids, [-1, time + 1])
+            if early_exit:
+                # sample next symbols of the live rows, and fill the finished
+                # rows as if they kept generating EOS
+                sample_ids, live_beam_ids, next_log_probs, next_lengths \
+                    = helper.sample_symbols(
+                        logits, gather_states(log_probs, live_rows),
+                        gather_states(finished, live_rows),
+                        gather_states(lengths, live_rows), time=time,
+                        batch_size=tf.shape(live_rows)[0] // beam_size)
+                sample_ids, beam_ids, next_log_probs, next_lengths = scatter_states(
+                    [sample_ids, tf.gather(live_rows, live_beam_ids), next_log_probs, next_lengths],
+                    live_rows, num_rows,
+                    [predicted_ids[:, -1], tf.range(num_rows), log_probs, lengths])
+            else:
+                # sample next symbols
+                sample_ids, beam_ids, next_log_probs, next_lengths \
+                    = helper.sample_symbols(logits, log_probs, finished, lengths, time=time)
+
+                for c in next_caches:
+                    c["decoding_states"] = gather_states(c["decoding_states"], beam_ids)
+
+            infer_status = BeamSearchStateSpec(
+                log_probs=next_log_probs,
+                beam_ids=beam_ids)
+            bs_stat_ta = nest.map_structure(lambda ta, out: ta.write(time, out),
+                                            bs_stat_ta, infer_status)
+            predicted_ids = gather_states(predicted_ids, beam_ids)
+            next_predicted_ids = tf.concat([predicted_ids, tf.expand_dims(sample_ids, axis=1)], axis=1)
+            next_predicted_ids = tf.reshape(next_predicted_ids, [-1])
+            next_predicted_ids.set_shape([None])
+            search_vars = [bs_stat_ta, next_predicted_ids]
         next_finished, next_input_symbols = helper.next_symbols(time=time, sample_ids=sample_ids)
+        next_finished = tf.logical_or(next_finished, finished)
+        next_live_rows = []
+        if early_exit:
+            # drop the sentences finished at this step
+            keep_ids = select_live_rows(next_finished, live_rows, beam_size)
+            decoding_states = [c.pop("decoding_states") for c in next_caches]
+            next_caches = [_decoder.gather_live_cache(c, keep_ids, beam_size)
+                           for _decoder, c in zip(decoders, next_caches)]
+            for c, states in zip(next_caches, decoding_states):
+                c["decoding_states"] = gather_states(
+                    states, keep_ids if greedy else tf.gather(live_beam_ids, keep_ids))
+            next_live_rows.append(tf.gather(live_rows, keep_ids))
+            next_input_symbols = tf.gather(next_input_symbols, next_live_rows[0])
         next_inputs = repeat_n_times(num_models, target_to_embedding_fns,
                                      next_input_symbols, time + 1)
-        next_finished = tf.logical_or(next_finished, finished)
 
-        return time + 1, next_inputs, next_caches, next_outputs_tas, \
-               next_finished, next_log_probs, next_lengths, bs_stat_ta, \
-               next_predicted_ids
+        return [time + 1, next_inputs, next_caches, next_outputs_tas,
+                next_finished, next_log_probs, next_lengths] + search_vars + next_live_rows
 
     initial_log_probs = tf.zeros_like(initial_input_symbols, dtype=tf.float32)
     initial_lengths = tf.zeros_like(initial_input_symbols, dtype=tf.int32)
-    initial_bs_stat_ta = nest.map_structure(_create_ta, BeamSearchStateSpec.dtypes())
-    initial_input_symbols.set_shape([None])
     loop_vars = [initial_time, initial_inputs, initial_caches,
                  initial_outputs_tas, initial_finished,
                  # infer vars
-                 initial_log_probs, initial_lengths, initial_bs_stat_ta,
-                 initial_input_symbols]
+                 initial_log_probs, initial_lengths]
+    if greedy:
+        loop_vars.append(_create_ta(tf.int32))
+    else:
+        initial_bs_stat_ta = nest.map_structure(_create_ta, BeamSearchStateSpec.dtypes())
+        initial_input_symbols.set_shape([None])
+        loop_vars.extend([initial_bs_stat_ta, initial_input_symbols])
+    shape_invariants = None
+    if early_exit:
+        loop_vars.append(tf.range(tf.shape(initial_input_symbols)[0]))
+        shape_invariants = live_rows_shape_invariants(loop_vars)
 
     res = tf.while_loop(
         lambda *args: tf.logical_not(tf.reduce_all(args[4])),
         body_infer,
         loop_vars=loop_vars,
+        shape_invariants=shape_invariants,
         parallel_iterations=parallel_iterations,
         swap_memory=swap_memory)
+    if early_exit:
+        res = res[:-1]
+
+    if greedy:
+        log_probs, length, ids_ta = res[-3:]
+        return greedy_decoding_result(res[0], log_probs, length, ids_ta)
 
     timesteps = res[0] + 1
     log_probs, length, bs_stat, predicted_ids = res[-4:]
@@ -204,8 +282,9 @@ class EnsembleModel(object):
             base_models: A list of `SequenceToSequence` instances.
             weight_scheme: A string, the ensemble weights. See
               `get_ensemble_weights()` for more details.
-            inference_options: Contains beam_size, length_penalty
-              and maximum_labels_length.
+            inference_options: Contains beam_size, length_penalty,
+              maximum_labels_length, max_length_ratio, max_length_offset,
+              early_exit, preallocate_cache and shortlist_file.
         """
         self._vocab_target = vocab_target
         self._base_models = base_models
@@ -213,6 +292,11 @@ class EnsembleModel(object):
         self._beam_size = inference_options["beam_size"]
         self._length_penalty = inference_options["length_penalty"]
         self._maximum_labels_length = inference_options["maximum_labels_length"]
+        self._max_length_ratio = inference_options["max_length_ratio"]
+        self._max_length_offset = inference_options["max_length_offset"]
+        self._early_exit = inference_options["early_exit"]
+        self._preallocate_cache = inference_options["preallocate_cache"]
+        self._use_shortlist = inference_options["shortlist_file"] is not None
         # update model components' names
         for model in self._base_models:
             model._decoder.name = os.path.join(model.name, model._decoder.name)
@@ -254,13 +338,36 @@ class EnsembleModel(object):
             encoder_output = model._encode(input_fields=input_fields)
             encoder_outputs.append(encoder_output)
 
-        helper = BeamFeedback(
-            vocab=self._vocab_target,
-            batch_size=tf.shape(input_fields[Constants.FEATURE_IDS_NAME])[0],
-            maximum_labels_length=self._maximum_labels_length,
-            beam_size=self._beam_size,
-            alpha=self._length_penalty,
-            ensemble_weight=self.get_ensemble_weights(len(self._base_models)))
+        shortlist_ids = None
+        if self._use_shortlist:
+            shortlist_ids = input_fields[Constants.SHORTLIST_IDS_NAME]
+            for model in self._base_models:
+                model.shortlist_ids = shortlist_ids
+        labels_length_limit = compute_labels_length_limit(
+            input_fields[Constants.FEATURE_LENGTH_NAME],
+            self._maximum_labels_length,
+            ratio=self._max_length_ratio,
+            offset=self._max_length_offset,
+            override=input_fields.get(Constants.LABEL_LENGTH_LIMIT_NAME, None))
+        if self._beam_size == 1:
+            helper = GreedyFeedback(
+                vocab=self._vocab_target,
+                batch_size=tf.shape(input_fields[Constants.FEATURE_IDS_NAME])[0],
+                maximum_labels_length=self._maximum_labels_length,
+                alpha=self._length_penalty,
+                ensemble_weight=self.get_ensemble_weights(len(self._base_models)),
+                shortlist_ids=shortlist_ids,
+                labels_length_limit=labels_length_limit)
+        else:
+            helper = BeamFeedback(
+                vocab=self._vocab_target,
+                batch_size=tf.shape(input_fields[Constants.FEATURE_IDS_NAME])[0],
+                maximum_labels_length=self._maximum_labels_length,
+                beam_size=self._beam_size,
+                alpha=self._length_penalty,
+                ensemble_weight=self.get_ensemble_weights(len(self._base_models)),
+                shortlist_ids=shortlist_ids,
+                labels_length_limit=labels_length_limit)
 
         decoders, bridges, target_to_emb_fns, outputs_to_logits_fns = \
             repeat_n_times(
@@ -275,7 +382,9 @@ class EnsembleModel(object):
             helper=helper,
             target_to_embedding_fns=target_to_emb_fns,
             outputs_to_logits_fns=outputs_to_logits_fns,
-            beam_size=self._beam_size)
+            beam_size=self._beam_size,
+            early_exit=self._early_exit,
+            preallocate_cache=self._preallocate_cache)
         predict_out = process_beam_predictions(
             decoding_result=decoding_result,
             beam_size=self._beam_size,
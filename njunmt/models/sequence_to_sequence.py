@@ -30,6 +30,7 @@ from njunmt.utils.configurable import Configurable
 from njunmt.utils.configurable import deep_merge_dict
 from njunmt.utils.constants import Constants
 from njunmt.utils.constants import ModeKeys
+from njunmt.utils.beam_search import compute_labels_length_limit
 from njunmt.utils.beam_search import process_beam_predictions
 from njunmt.utils.misc import set_fflayers_layer_norm
 from njunmt.utils.misc import label_smoothing
@@ -72,6 +73,8 @@ class SequenceToSequence(Configurable):
         self._vocab_source = vocab_source
         self._vocab_target = vocab_target
         self._verbose = verbose
+        # the target vocabulary shortlist for inference
+        self._shortlist_ids = None
         set_fflayers_layer_norm(self.params["fflayers.layer_norm"])
         # create Network components
         self._input_modality, self._target_modality = self._create_modalities()
@@ -79,6 +82,17 @@ class SequenceToSequence(Configurable):
         self._decoder = self._create_decoder()
         self._encoder_decoder_bridge = self._create_bridge()
 
+    @property
+    def shortlist_ids(self):
+        """ Returns the target vocabulary shortlist for inference. """
+        return self._shortlist_ids
+
+    @shortlist_ids.setter
+    def shortlist_ids(self, val):
+        """ Set the target vocabulary shortlist, an int32 Tensor
+        with shape [shortlist_size, ] or None. """
+        self._shortlist_ids = val
+
     def _check_parameters(self):
         """ Forces some parameters. """
         if self.mode != ModeKeys.TRAIN:
@@ -102,6 +116,17 @@ class SequenceToSequence(Configurable):
         inp[Constants.FEATURE_IDS_NAME] = feature_ids
         inp[Constants.FEATURE_LENGTH_NAME] = feature_length
         if mode == ModeKeys.INFER:
+            # only fed when "inference.use_shortlist" is True
+            shortlist_ids = tf.placeholder(
+                tf.int32, shape=(None,),
+                name="{}_{}".format(Constants.SHORTLIST_IDS_NAME, SequenceToSequence.__MODEL_COUNTER - 1))
+            inp[Constants.SHORTLIST_IDS_NAME] = shortlist_ids
+            # fed to override the maximum decoding length of each sentence
+            #   with a positive value
+            labels_length_limit = tf.placeholder_with_default(
+                tf.zeros_like(feature_length), shape=(None,),
+                name="{}_{}".format(Constants.LABEL_LENGTH_LIMIT_NAME, SequenceToSequence.__MODEL_COUNTER - 1))
+            inp[Constants.LABEL_LENGTH_LIMIT_NAME] = labels_length_limit
             return inp
 
         label_ids = tf.placeholder(
@@ -157,7 +182,12 @@ class SequenceToSequence(Configurable):
             "modality.params": {},  # Arbitrary parameters for the modality
             "inference.beam_size": 10,
             "inference.maximum_labels_length": 150,
+            "inference.max_length_ratio": None,
+            "inference.max_length_offset": 10,
             "inference.length_penalty": -1.0,
+            "inference.early_exit": False,
+            "inference.preallocate_cache": False,
+            "inference.use_shortlist": False,
             "label_smoothing": 0.0,
             "initializer": "random_uniform"}
 
@@ -251,17 +281,39 @@ class SequenceToSequence(Configurable):
                 vocab=self._vocab_target, label_ids=label_ids, label_length=label_length)
 
         else:  # self.mode == tf.contrib.learn.ModeKeys.INFER
-            helper = feedback.BeamFeedback(
-                vocab=self._vocab_target,
-                batch_size=tf.shape(input_fields[Constants.FEATURE_IDS_NAME])[0],
-                maximum_labels_length=self.params["inference.maximum_labels_length"],
-                beam_size=self.params["inference.beam_size"],
-                alpha=self.params["inference.length_penalty"])
+            if self.params["inference.use_shortlist"]:
+                self._shortlist_ids = input_fields[Constants.SHORTLIST_IDS_NAME]
+            labels_length_limit = compute_labels_length_limit(
+                input_fields[Constants.FEATURE_LENGTH_NAME],
+                self.params["inference.maximum_labels_length"],
+                ratio=self.params["inference.max_length_ratio"],
+                offset=self.params["inference.max_length_offset"],
+                override=input_fields.get(Constants.LABEL_LENGTH_LIMIT_NAME, None))
+            if self.params["inference.beam_size"] == 1:
+                # greedy search, without the bookkeeping of beams
+                helper = feedback.GreedyFeedback(
+                    vocab=self._vocab_target,
+                    batch_size=tf.shape(input_fields[Constants.FEATURE_IDS_NAME])[0],
+                    maximum_labels_length=self.params["inference.maximum_labels_length"],
+                    alpha=self.params["inference.length_penalty"],
+                    shortlist_ids=self._shortlist_ids,
+                    labels_length_limit=labels_length_limit)
+            else:
+                helper = feedback.BeamFeedback(
+                    vocab=self._vocab_target,
+                    batch_size=tf.shape(input_fields[Constants.FEATURE_IDS_NAME])[0],
+                    maximum_labels_length=self.params["inference.maximum_labels_length"],
+                    beam_size=self.params["inference.beam_size"],
+                    alpha=self.params["inference.length_penalty"],
+                    shortlist_ids=self._shortlist_ids,
+                    labels_length_limit=labels_length_limit)
         decoder_output, decoding_res = self._decoder.decode(
             encoder_output, self._encoder_decoder_bridge, helper,
             self._target_to_embedding_fn,
             self._outputs_to_logits_fn,
-            beam_size=self.params["inference.beam_size"])
+            beam_size=self.params["inference.beam_size"],
+            early_exit=self.params["inference.early_exit"],
+            preallocate_cache=self.params["inference.preallocate_cache"])
         return decoder_output, decoding_res
 
     def _input_to_embedding_fn(self, x, time=None):
@@ -298,10 +350,11 @@ class SequenceToSequence(Configurable):
         Args:
             outputs: A Tensor with shape [..., dim]
 
-        Returns: A Tensor with shape [..., vocab_size]
+        Returns: A Tensor with shape [..., vocab_size], or [..., shortlist_size]
+          if the target vocabulary shortlist is used.
         """
         with tf.variable_scope(self._target_modality.name):
-            logits = self._target_modality.top(outputs)
+            logits = self._target_modality.top(outputs, shortlist_ids=self._shortlist_ids)
         return logits
 
     def _encode(self, input_fields):
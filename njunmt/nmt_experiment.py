@@ -18,12 +18,16 @@ from abc import ABCMeta, abstractmethod
 import six
 import tensorflow as tf
 
+from njunmt.data.data_reader import BinaryLineReader
 from njunmt.data.data_reader import LineReader
 from njunmt.data.text_inputter import ParallelTextInputter
 from njunmt.data.text_inputter import TextLineInputter
 from njunmt.data.vocab import Vocab
 from njunmt.inference.decode import evaluate_with_attention
 from njunmt.inference.decode import infer
+from njunmt.inference.decode import count_finished_lines
+from njunmt.inference.decode import truncate_n_best_file
+from njunmt.inference.shortlist import create_shortlist
 from njunmt.models.model_builder import model_fn
 from njunmt.training.text_metrics_spec import build_eval_metrics
 from njunmt.utils.configurable import ModelConfigs
@@ -89,6 +93,9 @@ class TrainingExperiment(Experiment):
         return {
             "train_features_file": None,
             "train_labels_file": None,
+            # whether the training files are the prefixes of corpora
+            #   written by bin/binarize_corpus.py
+            "binarized_train_data": False,
             "eval_features_file": None,
             "eval_labels_file": None,
             "source_words_vocabulary": None,
@@ -155,13 +162,27 @@ class TrainingExperiment(Experiment):
                                        (self._model_configs, eval_dataset,
                                         model_name=estimator_spec.name)))
 
+        if self._model_configs["data"]["binarized_train_data"]:
+            features_reader = BinaryLineReader(
+                data=self._model_configs["data"]["train_features_file"],
+                maximum_length=self._model_configs["train"]["maximum_features_length"],
+                vocab=vocab_source)
+            labels_reader = BinaryLineReader(
+                data=self._model_configs["data"]["train_labels_file"],
+                maximum_length=self._model_configs["train"]["maximum_labels_length"],
+                vocab=vocab_target)
+        else:
+            features_reader = LineReader(
+                data=self._model_configs["data"]["train_features_file"],
+                maximum_length=self._model_configs["train"]["maximum_features_length"],
+                preprocessing_fn=lambda x: vocab_source.convert_to_idlist(x))
+            labels_reader = LineReader(
+                data=self._model_configs["data"]["train_labels_file"],
+                maximum_length=self._model_configs["train"]["maximum_labels_length"],
+                preprocessing_fn=lambda x: vocab_target.convert_to_idlist(x))
         train_text_inputter = ParallelTextInputter(
-            LineReader(data=self._model_configs["data"]["train_features_file"],
-                       maximum_length=self._model_configs["train"]["maximum_features_length"],
-                       preprocessing_fn=lambda x: vocab_source.convert_to_idlist(x)),
-            LineReader(data=self._model_configs["data"]["train_labels_file"],
-                       maximum_length=self._model_configs["train"]["maximum_labels_length"],
-                       preprocessing_fn=lambda x: vocab_target.convert_to_idlist(x)),
+            features_reader,
+            labels_reader,
             vocab_source.pad_id,
             vocab_target.pad_id,
             batch_size=self._model_configs["train"]["batch_size"],
@@ -229,11 +250,27 @@ class InferExperiment(Experiment):
             "source_bpecodes": {},
             "target_bpecodes": {},
             "batch_size": 32,
+            "batch_tokens_size": None,
+            "bucketing": True,
             "beam_size": 10,
             "length_penalty": -1.0,
             "maximum_labels_length": 150,
+            # if provided, the maximum length of each translation is
+            #   min(maximum_labels_length, max_length_ratio * source_length + max_length_offset)
+            "max_length_ratio": None,
+            "max_length_offset": 10,
+            "early_exit": False,
+            "preallocate_cache": False,
+            # the number of translations of each sentence, written to
+            #   "<output_file>.nbest" as "id ||| hypothesis ||| score" if > 1
+            "n_best": 1,
+            # the lexical translation table for the target vocabulary shortlist
+            "shortlist_file": None,
+            "shortlist_topk": 50,
+            "shortlist_frequent": 1000,
             "delimiter": " ",
-            "char_level": False}
+            "char_level": False,
+            "resume": False}
 
     @staticmethod
     def default_inferdata_params():
@@ -260,13 +297,19 @@ class InferExperiment(Experiment):
             self._model_configs,
             beam_size=self._model_configs["infer"]["beam_size"],
             maximum_labels_length=self._model_configs["infer"]["maximum_labels_length"],
-            length_penalty=self._model_configs["infer"]["length_penalty"])
+            max_length_ratio=self._model_configs["infer"]["max_length_ratio"],
+            max_length_offset=self._model_configs["infer"]["max_length_offset"],
+            length_penalty=self._model_configs["infer"]["length_penalty"],
+            early_exit=self._model_configs["infer"]["early_exit"],
+            preallocate_cache=self._model_configs["infer"]["preallocate_cache"],
+            use_shortlist=self._model_configs["infer"]["shortlist_file"] is not None)
         # build model
         estimator_spec = model_fn(model_configs=self._model_configs, mode=ModeKeys.INFER, vocab_source=vocab_source,
                                   vocab_target=vocab_target, name=self._model_configs["problem_name"])
         predict_op = estimator_spec.predictions
 
         sess = self._build_default_session()
+        shortlist = create_shortlist(self._model_configs["infer"], vocab_source, vocab_target)
 
         text_inputter = TextLineInputter(
             line_readers=[LineReader(
@@ -274,7 +317,9 @@ class InferExperiment(Experiment):
                 preprocessing_fn=lambda x: vocab_source.convert_to_idlist(x)) for p in
                           self._model_configs["infer_data"]],
             padding_id=vocab_source.pad_id,
-            batch_size=self._model_configs["infer"]["batch_size"])
+            batch_size=self._model_configs["infer"]["batch_size"],
+            batch_tokens_size=self._model_configs["infer"]["batch_tokens_size"],
+            bucketing=self._model_configs["infer"]["bucketing"])
         # reload
         checkpoint_path = tf.train.latest_checkpoint(self._model_configs["model_dir"])
         if checkpoint_path:
@@ -288,10 +333,22 @@ class InferExperiment(Experiment):
         tf.logging.info("Start inference.")
         overall_start_time = time.time()
 
-        for infer_data, param in zip(text_inputter.make_feeding_data(
-                input_fields=estimator_spec.input_fields),
-                self._model_configs["infer_data"]):
+        skip_lines = [count_finished_lines(p["output_file"])
+                      if self._model_configs["infer"]["resume"] else 0
+                      for p in self._model_configs["infer_data"]]
+        for infer_data, param, skip in zip(text_inputter.make_feeding_data(
+                input_fields=estimator_spec.input_fields,
+                in_memory=False, skip_lines=skip_lines),
+                self._model_configs["infer_data"], skip_lines):
             tf.logging.info("Infer Source File: {}.".format(param["features_file"]))
+            if skip > 0:
+                tf.logging.info("Resume from line {} of {}.".format(skip, param["output_file"]))
+            n_best_output = None
+            if self._model_configs["infer"]["n_best"] > 1:
+                # the n-best lists are written next to the 1-best translations
+                n_best_output = param["output_file"] + ".nbest"
+                if skip > 0:
+                    truncate_n_best_file(n_best_output, skip)
             start_time = time.time()
             infer(sess=sess,
                   prediction_op=predict_op,
@@ -302,7 +359,14 @@ class InferExperiment(Experiment):
                   delimiter=self._model_configs["infer"]["delimiter"],
                   output_attention=param["output_attention"],
                   tokenize_output=self._model_configs["infer"]["char_level"],
-                  verbose=True)
+                  verbose=True,
+                  append_output=skip > 0,
+                  return_results=False,
+                  shortlist=shortlist,
+                  input_fields=estimator_spec.input_fields,
+                  n_best=self._model_configs["infer"]["n_best"],
+                  n_best_output=n_best_output,
+                  first_index=skip)
             tf.logging.info("FINISHED {}. Elapsed Time: {}."
                             .format(param["features_file"], str(time.time() - start_time)))
             if param["labels_file"] is not None:
@@ -0,0 +1,123 @@
+import os
+import threading
+
+import tensorflow as tf
+
+from bin.translate_server import BatchScheduler
+from bin.translate_server import InferenceReplica
+from bin.translate_server import split_cores
+
+
+class _FakeServer(object):
+    experiment_spec = {
+        "model_configs": {"infer": {"beam_size": 2, "length_penalty": -1.0}},
+        "model_info": {"model_dir": "models"}}
+
+
+class _RecordingScheduler(BatchScheduler):
+    """ Replaces the beam search with a fake one that records the batches
+    and "translates" a sentence into its token ids. """
+
+    def __init__(self, *args, **kwargs):
+        self.batches = []
+        self.fail_with = None
+        super(_RecordingScheduler, self).__init__(*args, **kwargs)
+
+    def decode(self, experiment_spec, id_lists, length_limits=None, n_best=1):
+        self.batches.append([list(ids) for ids in id_lists])
+        if self.fail_with is not None:
+            raise self.fail_with
+        translations = [" ".join([str(i) for i in ids]) for ids in id_lists]
+        n_best_lists = [[(translation + " #{}".format(k), -float(k)) for k in range(n_best)]
+                        for translation in translations]
+        return list(translations), translations, n_best_lists
+
+
+class BatchSchedulerTest(tf.test.TestCase):
+    def _scheduler(self, batch_size=4, max_wait_ms=1000, cache_size=10):
+        server = _FakeServer()
+        replica = InferenceReplica(0)
+        replica.experiment_spec = server.experiment_spec
+        return _RecordingScheduler(server, [replica], batch_size,
+                                   max_wait_ms=max_wait_ms, cache_size=cache_size)
+
+    def testBatching(self):
+        scheduler = self._scheduler(batch_size=4, max_wait_ms=200)
+        id_lists = [[k, k + 1] for k in range(6)]
+        sources, translations, n_best_lists = scheduler.translate(id_lists)
+        self.assertEqual(translations, ["{} {}".format(k, k + 1) for k in range(6)])
+        self.assertEqual(n_best_lists, [[(t + " #0", 0.)] for t in translations])
+        # a full batch, then the rest once the deadline passes
+        self.assertEqual(scheduler.batches, [id_lists[:4], id_lists[4:]])
+
+    def testConcurrentRequests(self):
+        scheduler = self._scheduler(batch_size=4, max_wait_ms=2000)
+        results = [None, None]
+
+        def _translate(k):
+            results[k] = scheduler.translate([[k, 1], [k, 2]])
+
+        threads = [threading.Thread(target=_translate, args=(k,)) for k in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results[0][1], ["0 1", "0 2"])
+        self.assertEqual(results[1][1], ["1 1", "1 2"])
+        # the sentences of both requests are decoded in one batch
+        self.assertEqual(len(scheduler.batches), 1)
+        self.assertEqual(sorted(scheduler.batches[0]), [[0, 1], [0, 2], [1, 1], [1, 2]])
+
+    def testCache(self):
+        scheduler = self._scheduler(batch_size=2, max_wait_ms=10)
+        scheduler.translate([[1, 2], [3]])
+        self.assertEqual(len(scheduler.batches), 1)
+        _, translations, _ = scheduler.translate([[3], [1, 2]])
+        self.assertEqual(translations, ["3", "1 2"])
+        self.assertEqual(len(scheduler.batches), 1)
+        self.assertEqual(scheduler.cache.stats()["hits"], 2)
+        # another length limit or a longer n-best list is decoded again
+        scheduler.translate([[3]], length_limits=[5])
+        _, _, n_best_lists = scheduler.translate([[1, 2]], n_best=2)
+        self.assertEqual(scheduler.batches[1:], [[[3]], [[1, 2]]])
+        self.assertEqual(n_best_lists, [[("1 2 #0", 0.), ("1 2 #1", -1.)]])
+        # n_best is no more than the beam size
+        _, _, n_best_lists = scheduler.translate([[1, 2]], n_best=5)
+        self.assertEqual(len(n_best_lists[0]), 2)
+        self.assertEqual(len(scheduler.batches), 3)
+        scheduler.cache.clear()
+        scheduler.translate([[3]])
+        self.assertEqual(len(scheduler.batches), 4)
+
+    def testFailure(self):
+        scheduler = self._scheduler(batch_size=2, max_wait_ms=10)
+        scheduler.fail_with = ValueError("broken model")
+        with self.assertRaises(ValueError):
+            scheduler.translate([[1], [2]])
+        self.assertEqual(len(scheduler.cache), 0)
+        scheduler.fail_with = None
+        self.assertEqual(scheduler.translate([[1]])[1], ["1"])
+
+
+class SplitCoresTest(tf.test.TestCase):
+    def _split_cores(self, num_cores, num_replicas):
+        sched_getaffinity = getattr(os, "sched_getaffinity", None)
+        os.sched_getaffinity = lambda pid: set(range(num_cores))
+        try:
+            return split_cores(num_replicas)
+        finally:
+            if sched_getaffinity is None:
+                del os.sched_getaffinity
+            else:
+                os.sched_getaffinity = sched_getaffinity
+
+    def testSplitCores(self):
+        self.assertEqual(self._split_cores(8, 1), [None])
+        self.assertEqual(self._split_cores(8, 4), [[0, 1], [2, 3], [4, 5], [6, 7]])
+        # the remainder goes to the first replicas
+        self.assertEqual(self._split_cores(7, 3), [[0, 1, 2], [3, 4], [5, 6]])
+        self.assertEqual(self._split_cores(2, 3), [None, None, None])
+
+
+if __name__ == "__main__":
+    tf.test.main()
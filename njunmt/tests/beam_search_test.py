@@ -0,0 +1,47 @@
+import numpy
+import tensorflow as tf
+
+from njunmt.utils.beam_search import compute_labels_length_limit
+from njunmt.utils.beam_search import gather_states
+from njunmt.utils.beam_search import scatter_states
+from njunmt.utils.beam_search import select_live_rows
+
+
+class BeamSearchTest(tf.test.TestCase):
+    def testScatterStates(self):
+        full = numpy.arange(12, dtype=numpy.float32).reshape([6, 2])
+        rows = tf.constant([1, 4, 5], dtype=tf.int32)
+        live = gather_states(tf.constant(full), rows)
+        zeros_filled = scatter_states(live, rows, 6)
+        default_filled = scatter_states(live, rows, 6, -tf.ones_like(full))
+        with self.test_session() as sess:
+            zeros_filled, default_filled = sess.run([zeros_filled, default_filled])
+        self.assertAllEqual(zeros_filled[[1, 4, 5]], full[[1, 4, 5]])
+        self.assertAllEqual(zeros_filled[[0, 2, 3]], numpy.zeros([3, 2]))
+        self.assertAllEqual(default_filled[[0, 2, 3]], -numpy.ones([3, 2]))
+
+    def testSelectLiveRows(self):
+        # batch_size=3, beam_size=2, the second sentence has been dropped
+        finished = tf.constant([True, True, True, True, False, True])
+        live_rows = tf.constant([0, 1, 4, 5], dtype=tf.int32)
+        keep_ids = select_live_rows(finished, live_rows, beam_size=2)
+        with self.test_session() as sess:
+            self.assertAllEqual(sess.run(keep_ids), [2, 3])
+
+    def testComputeLabelsLengthLimit(self):
+        feature_length = tf.constant([2, 10, 100], dtype=tf.int32)
+        global_limit = compute_labels_length_limit(feature_length, 50)
+        ratio_limit = compute_labels_length_limit(feature_length, 50, ratio=1.5, offset=3)
+        overridden_limit = compute_labels_length_limit(
+            feature_length, 50, ratio=1.5, offset=3,
+            override=tf.constant([0, 4, 80], dtype=tf.int32))
+        with self.test_session() as sess:
+            global_limit, ratio_limit, overridden_limit = sess.run(
+                [global_limit, ratio_limit, overridden_limit])
+        self.assertAllEqual(global_limit, [50, 50, 50])
+        self.assertAllEqual(ratio_limit, [6, 18, 50])
+        self.assertAllEqual(overridden_limit, [6, 4, 50])
+
+
+if __name__ == "__main__":
+    tf.test.main()
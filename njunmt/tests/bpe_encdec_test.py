@@ -0,0 +1,42 @@
+import os
+import tempfile
+
+import tensorflow as tf
+
+from njunmt.data.bpe_encdec import BPE
+
+
+class BPETest(tf.test.TestCase):
+    def _make_codes_file(self):
+        fd, filename = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as fw:
+            fw.write("#version: 0.2\nl o\nlo w</w>\ne r</w>\n")
+        return filename
+
+    def testCache(self):
+        codes_file = self._make_codes_file()
+        bpe = BPE(codes=codes_file, cache_size=2)
+        self.assertEqual(bpe.encode("low lower newer"), "low lo@@ w@@ er n@@ e@@ w@@ er")
+        stats = bpe.cache_stats()
+        self.assertEqual(stats["size"], 2)
+        self.assertEqual(stats["misses"], 3)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(bpe.encode("newer"), "n@@ e@@ w@@ er")
+        self.assertEqual(bpe.cache_stats()["hits"], 1)
+
+        fd, cache_file = tempfile.mkstemp()
+        os.close(fd)
+        self.assertEqual(bpe.save_cache(cache_file), 2)
+        warm_bpe = BPE(codes=codes_file, cache_file=cache_file)
+        self.assertEqual(warm_bpe.cache_stats()["size"], 2)
+        self.assertEqual(warm_bpe.encode("lower newer"), "lo@@ w@@ er n@@ e@@ w@@ er")
+        self.assertEqual(warm_bpe.cache_stats()["hits"], 2)
+        # refuses a table saved with different settings
+        with self.assertRaises(ValueError):
+            BPE(codes=codes_file, separator="##", cache_file=cache_file)
+        os.remove(codes_file)
+        os.remove(cache_file)
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+
+import tensorflow as tf
+
+from njunmt.data.data_reader import BinaryLineReader
+from njunmt.data.data_reader import LineReader
+from njunmt.data.data_reader import binarize_lines
+from njunmt.data.vocab import Vocab
+
+
+class DataReaderTest(tf.test.TestCase):
+    def testBinaryLineReader(self):
+        vocab = Vocab("testdata/vocab.en", reverse_seq=True)
+        output_dir = tempfile.mkdtemp()
+        output_prefix = os.path.join(output_dir, "toy.en0")
+        meta = binarize_lines(
+            LineReader(data="testdata/toy.en0",
+                       preprocessing_fn=lambda x: vocab.convert_to_idlist(x)),
+            vocab, output_prefix, chunk_size=7)
+        self.assertEqual(meta["dtype"], "uint16")
+
+        def _read_all(reader):
+            lines = []
+            while True:
+                line = reader.next()
+                if line == "":
+                    return lines
+                lines.append(line)
+
+        text_reader = LineReader(data="testdata/toy.en0", maximum_length=20,
+                                 preprocessing_fn=lambda x: vocab.convert_to_idlist(x))
+        binary_reader = BinaryLineReader(output_prefix, maximum_length=20, vocab=vocab)
+        expected = _read_all(text_reader)
+        self.assertEqual(meta["num_lines"], len(expected))
+        self.assertIn(None, expected)
+        self.assertEqual(_read_all(binary_reader), expected)
+
+        # shuffled twice with the same indices as the text reader
+        shuffled_file = output_prefix + ".shuf"
+        for _ in range(2):
+            argsort_index = text_reader.reset(do_shuffle=True, shuffle_to_file=shuffled_file)
+            binary_reader.reset(do_shuffle=True, argsort_index=argsort_index)
+            self.assertEqual(_read_all(binary_reader), _read_all(text_reader))
+        text_reader.close()
+        binary_reader.close()
+
+        with self.assertRaises(ValueError):
+            BinaryLineReader(output_prefix, vocab=Vocab("testdata/vocab.en"))
+        shutil.rmtree(output_dir)
+
+
+if __name__ == "__main__":
+    tf.test.main()
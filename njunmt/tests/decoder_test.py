@@ -0,0 +1,90 @@
+from collections import namedtuple
+
+import numpy
+import tensorflow as tf
+
+from njunmt.data.vocab import Vocab
+from njunmt.decoders.transformer_decoder import TransformerDecoder
+from njunmt.utils.constants import ModeKeys
+from njunmt.utils.feedback import BeamFeedback
+from njunmt.utils.feedback import GreedyFeedback
+
+EncoderOutput = namedtuple("EncoderOutput", "outputs attention_values attention_length")
+
+
+class DecoderTest(tf.test.TestCase):
+    batch_size = 3
+    max_len_src = 5
+    dim = 8
+    maximum_labels_length = 6
+
+    little_params = {
+        "num_layers": 2,
+        "num_filter_units": dim,
+        "num_hidden_units": dim,
+        "attention.params": {"num_heads": 2, "num_units": dim,
+                             "dropout_attention_keep_prob": 1.0},
+        "selfattention.params": {"num_heads": 2, "num_units": dim,
+                                 "dropout_attention_keep_prob": 1.0},
+        "dropout_relu_keep_prob": 1.0,
+        "layer_prepostprocess_dropout_keep_prob": 1.0
+    }
+
+    def _decode(self, vocab, beam_size, reuse=None, **kwargs):
+        """ Builds a tiny transformer decoding graph and returns
+        the predicted ids and the log probabilities. """
+        rng = numpy.random.RandomState(1234)
+        memory = tf.constant(rng.randn(self.batch_size, self.max_len_src, self.dim),
+                             dtype=tf.float32)
+        encoder_output = EncoderOutput(outputs=memory, attention_values=memory,
+                                       attention_length=tf.constant([5, 2, 4]))
+        # different length limits, so that the sentences finish at different steps
+        labels_length_limit = tf.constant([2, 6, 4])
+        if beam_size == 1:
+            helper = GreedyFeedback(vocab, self.maximum_labels_length, self.batch_size,
+                                    labels_length_limit=labels_length_limit)
+        else:
+            helper = BeamFeedback(vocab, self.maximum_labels_length, self.batch_size,
+                                  beam_size=beam_size, alpha=0.6,
+                                  labels_length_limit=labels_length_limit)
+        embeddings = tf.constant(rng.randn(vocab.vocab_size, self.dim), dtype=tf.float32)
+        softmax_weights = tf.constant(rng.randn(self.dim, vocab.vocab_size), dtype=tf.float32)
+        # favor EOS, so that some hypotheses finish before the length limits
+        eos_bias = 2. * tf.one_hot(vocab.eos_id, vocab.vocab_size)
+        decoder = TransformerDecoder(self.little_params, ModeKeys.INFER, verbose=False)
+        with tf.variable_scope("decoder_test", reuse=reuse,
+                               initializer=tf.random_normal_initializer(seed=1234)):
+            _, infer_status = decoder.decode(
+                encoder_output, None, helper,
+                target_to_embedding_fn=lambda ids, _: tf.gather(embeddings, ids),
+                outputs_to_logits_fn=lambda x: tf.matmul(x, softmax_weights) + eos_bias,
+                beam_size=beam_size, **kwargs)
+        return infer_status["hypothesis"], infer_status["log_probs"][-1]
+
+    def _assertSameDecoding(self, vocab, beam_size, options, other_options):
+        with tf.Graph().as_default():
+            results = [self._decode(vocab, beam_size, **options),
+                       self._decode(vocab, beam_size, reuse=True, **other_options)]
+            with self.test_session() as sess:
+                sess.run(tf.global_variables_initializer())
+                (ids, scores), (other_ids, other_scores) = sess.run(results)
+        self.assertAllEqual(ids, other_ids)
+        self.assertAllClose(scores, other_scores, atol=1e-5)
+
+    def testEarlyExitDecoding(self):
+        vocab = Vocab("testdata/vocab.en")
+        for beam_size in [1, 4]:
+            self._assertSameDecoding(vocab, beam_size,
+                                     {"early_exit": False}, {"early_exit": True})
+
+    def testPreallocatedCache(self):
+        vocab = Vocab("testdata/vocab.en")
+        for beam_size in [1, 4]:
+            for early_exit in [False, True]:
+                self._assertSameDecoding(
+                    vocab, beam_size,
+                    {"early_exit": early_exit, "preallocate_cache": False},
+                    {"early_exit": early_exit, "preallocate_cache": True})
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,35 @@
+import numpy
+import tensorflow as tf
+
+from njunmt.data.vocab import Vocab
+from njunmt.utils.feedback import BeamFeedback
+from njunmt.utils.feedback import GreedyFeedback
+
+
+class FeedbackTest(tf.test.TestCase):
+    def testGreedyMatchesBeamSizeOne(self):
+        vocab = Vocab("testdata/vocab.en")
+        batch_size = 3
+        rng = numpy.random.RandomState(1234)
+        logits = tf.constant(rng.randn(batch_size, vocab.vocab_size), dtype=tf.float32)
+        log_probs = tf.constant([-1., -2., -3.])
+        finished = tf.constant([False, True, False])
+        lengths = tf.constant([2, 1, 2])
+        beam = BeamFeedback(vocab, 10, batch_size, beam_size=1)
+        greedy = GreedyFeedback(vocab, 10, batch_size)
+        beam_ids, _, beam_log_probs, beam_lengths = beam.sample_symbols(
+            logits, log_probs, finished, lengths, time=2)
+        greedy_ids, greedy_log_probs, greedy_lengths = greedy.sample_symbols(
+            logits, log_probs, finished, lengths, time=2)
+        with self.test_session() as sess:
+            beam_res, greedy_res = sess.run(
+                [[beam_ids, beam_log_probs, beam_lengths],
+                 [greedy_ids, greedy_log_probs, greedy_lengths]])
+        self.assertAllEqual(greedy_res[0], beam_res[0])
+        self.assertEqual(greedy_res[0][1], vocab.eos_id)
+        self.assertAllClose(greedy_res[1], beam_res[1], atol=1e-4)
+        self.assertAllEqual(greedy_res[2], beam_res[2])
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import socket
+
+import tensorflow as tf
+
+from bin.framing import FrameError
+from bin.framing import HEADER
+from bin.framing import read_frame
+from bin.framing import write_frame
+
+
+class FramingTest(tf.test.TestCase):
+    def setUp(self):
+        self.sender, self.receiver = socket.socketpair()
+
+    def tearDown(self):
+        self.sender.close()
+        self.receiver.close()
+
+    def testRoundTrip(self):
+        write_frame(self.sender, command="translate", content=[u"你好 ,", u"world ."])
+        write_frame(self.sender, command="control", content="stats")
+        self.assertEqual(read_frame(self.receiver),
+                         {"command": "translate", "content": [u"你好 ,", u"world ."]})
+        self.assertEqual(read_frame(self.receiver),
+                         {"command": "control", "content": "stats"})
+        self.sender.close()
+        self.assertIsNone(read_frame(self.receiver))
+
+    def testOversizedFrame(self):
+        write_frame(self.sender, content="x" * 100)
+        with self.assertRaises(FrameError):
+            read_frame(self.receiver, max_frame_size=50)
+
+    def testEOFInHeader(self):
+        self.sender.sendall(HEADER.pack(10)[:2])
+        self.sender.close()
+        with self.assertRaises(FrameError):
+            read_frame(self.receiver)
+
+    def testEOFInBody(self):
+        self.sender.sendall(HEADER.pack(10) + b"{}")
+        self.sender.close()
+        with self.assertRaises(FrameError):
+            read_frame(self.receiver)
+
+    def testMalformedBody(self):
+        self.sender.sendall(HEADER.pack(3) + b"{x}")
+        self.assertEqual(read_frame(self.receiver),
+                         {"command": "control", "content": "error"})
+
+
+if __name__ == "__main__":
+    tf.test.main()
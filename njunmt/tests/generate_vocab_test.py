@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+import tensorflow as tf
+
+
+class GenerateVocabTest(tf.test.TestCase):
+    def _generate_vocab(self, infile, *args):
+        fd, filename = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as fp:
+            subprocess.check_call([sys.executable, "-m", "bin.generate_vocab", infile]
+                                  + list(args), stdout=fp)
+        with open(filename) as fp:
+            vocab = fp.read()
+        os.remove(filename)
+        return vocab
+
+    def testParallelCounting(self):
+        for options in [[], ["--min_frequency", "3"], ["--max_vocab_size", "50"],
+                        ["--max_vocab_size", "7", "--min_frequency", "2"]]:
+            vocab = self._generate_vocab("testdata/toy.en0", *options)
+            self.assertGreater(len(vocab), 0)
+            for num_workers in ["2", "3"]:
+                self.assertEqual(
+                    vocab, self._generate_vocab("testdata/toy.en0", "--num-workers",
+                                                num_workers, *options))
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,37 @@
+import tensorflow as tf
+
+from njunmt.utils.lru_cache import LRUCache
+
+
+class LRUCacheTest(tf.test.TestCase):
+    def testEviction(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)  # "b" becomes the oldest
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        stats = cache.stats()
+        self.assertEqual(stats["size"], 2)
+        self.assertEqual(stats["hits"], 3)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["evictions"], 1)
+
+    def testDisabled(self):
+        cache = LRUCache(0)
+        cache.put("a", 1)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.get("a", -1), -1)
+
+    def testClear(self):
+        cache = LRUCache(3)
+        cache.put("a", 1)
+        cache.clear()
+        self.assertNotIn("a", cache)
+        self.assertEqual(cache.stats()["size"], 0)
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+
+import tensorflow as tf
+
+from njunmt.data.vocab import Vocab
+from njunmt.inference.shortlist import Shortlist
+
+
+class ShortlistTest(tf.test.TestCase):
+    def testBuild(self):
+        vocab_source = Vocab("testdata/vocab.zh")
+        vocab_target = Vocab("testdata/vocab.en")
+        fd, filename = tempfile.mkstemp()
+        with os.fdopen(fd, "wb") as fw:
+            fw.write(u"的 of 0.6\n的 the 0.3\n的 in 0.1\n和 and 0.9\n"
+                     u"和 NOT_A_WORD 0.1\n".encode("utf-8"))
+        shortlist = Shortlist(filename, vocab_source, vocab_target,
+                              topk=2, num_frequent=1)
+        os.remove(filename)
+        ids = shortlist.build([[vocab_source.vocab_dict[u"的"]],
+                               [vocab_source.vocab_dict[u"和"]]])
+        expected = sorted({0, vocab_target.unk_id, vocab_target.eos_id,
+                           vocab_target.vocab_dict["of"],
+                           vocab_target.vocab_dict["the"],
+                           vocab_target.vocab_dict["and"]})
+        self.assertAllEqual(ids, expected)
+        self.assertNotIn(vocab_target.vocab_dict["in"], ids)
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,67 @@
+import os
+import tempfile
+
+import numpy
+import tensorflow as tf
+
+from njunmt.data.vocab import Vocab
+
+
+class VocabTest(tf.test.TestCase):
+    def _make_vocab_file(self):
+        fd, filename = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as fw:
+            fw.write("a\t5\nb@@\t4\nc\t3\nd@@\t2\n@@\t1\n")
+        return filename
+
+    def _make_codes_file(self):
+        fd, filename = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as fw:
+            fw.write("#version: 0.2\n")
+        return filename
+
+    def testDecodeBatch(self):
+        vocab_file = self._make_vocab_file()
+        codes_file = self._make_codes_file()
+        rng = numpy.random.RandomState(1234)
+        for bpe_codes in [None, {"codes": codes_file}]:
+            for reverse_seq in [False, True]:
+                vocab = Vocab(vocab_file, bpe_codes=bpe_codes, reverse_seq=reverse_seq)
+                for timesteps in [1, 2, 7]:
+                    pred_ids = rng.randint(0, vocab.vocab_size, size=[50, timesteps])
+                    for bpe_decoding in [True, False]:
+                        expected = [vocab.convert_to_wordlist(ids, bpe_decoding=bpe_decoding)
+                                    for ids in pred_ids.tolist()]
+                        self.assertEqual(vocab.decode_batch(pred_ids, bpe_decoding=bpe_decoding),
+                                         expected)
+        ragged_ids = [[0, 2, vocab.eos_id], [1], []]
+        self.assertEqual(vocab.decode_batch(ragged_ids),
+                         [vocab.convert_to_wordlist(ids) for ids in ragged_ids])
+        os.remove(vocab_file)
+        os.remove(codes_file)
+
+    def testEncodeBatch(self):
+        vocab_file = self._make_vocab_file()
+        vocab = Vocab(vocab_file, reverse_seq=True)
+        os.remove(vocab_file)
+        sentences = [["a", "c", "NOT_A_WORD"], [], ["c"]]
+        ids, lengths = vocab.encode_batch(sentences)
+        self.assertEqual(ids.dtype, numpy.int32)
+        self.assertAllEqual(lengths, [4, 1, 2])
+        for row, length, words in zip(ids, lengths, sentences):
+            self.assertAllEqual(row[:length], vocab.convert_to_idlist(words))
+            self.assertTrue(numpy.all(row[length:] == vocab.pad_id))
+        self.assertEqual(vocab.decode_batch(ids), [["a", "c", "UNK"], [], ["c"]])
+        # ids no less than `n_words` are mapped to UNK
+        ids, _ = vocab.encode_batch(sentences, n_words=4)
+        for row, words in zip(ids, sentences):
+            self.assertAllEqual(row[:len(words) + 1], vocab.convert_to_idlist(words, n_words=4))
+
+        ids, lengths = vocab.encode_batch([])
+        self.assertEqual(ids.shape, (0, 0))
+        self.assertEqual(ids.dtype, numpy.int32)
+        self.assertEqual(lengths.shape, (0,))
+
+
+if __name__ == "__main__":
+    tf.test.main()
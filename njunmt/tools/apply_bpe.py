@@ -13,20 +13,30 @@ Proceedings of the 54th Annual Meeting of the Association for Computational Ling
 
 from __future__ import unicode_literals, division
 
+import os
 import sys
 import codecs
 import argparse
 import json
 import re
+import itertools
+import multiprocessing
 from collections import defaultdict
+from collections import deque
 
 # hack for python2/3 compatibility
 from io import open
 argparse.open = open
 
+# import njunmt from the source tree when run as a script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from njunmt.data.bpe_encdec import cache_signature
+from njunmt.data.bpe_encdec import merge_symbols
+from njunmt.utils.lru_cache import LRUCache
+
 class BPE(object):
 
-    def __init__(self, codes, separator='@@', vocab=None, glossaries=None):
+    def __init__(self, codes, separator='@@', vocab=None, glossaries=None, cache_size=100000):
 
         # check version information
         firstline = codes.readline()
@@ -49,6 +59,13 @@ class BPE(object):
 
         self.glossaries = glossaries if glossaries else []
 
+        self.cache = LRUCache(cache_size)
+
+    def signature(self):
+        """hash of the settings that decide the segmentations, see `BPE.preload_cache()`
+        in njunmt/data/bpe_encdec.py"""
+        return cache_signature(self.bpe_codes, self.separator, self.vocab, self.version, self.glossaries)
+
     def segment(self, sentence):
         """segment single sentence (whitespace-tokenized string) with BPE encoding"""
         output = []
@@ -60,7 +77,8 @@ class BPE(object):
                                           self.vocab,
                                           self.separator,
                                           self.version,
-                                          self.glossaries)]
+                                          self.glossaries,
+                                          self.cache)]
 
             for item in new_word[:-1]:
                 output.append(item + self.separator)
@@ -75,6 +93,24 @@ class BPE(object):
                                  for out_segments in isolate_glossary(segment, gloss)]
         return word_segments
 
+class RecordingCache(LRUCache):
+    """A cache of segmentations remembering the words added since the last `pop_new_items()`,
+    so that the workers only send their new cache entries to the main process"""
+
+    def __init__(self, capacity):
+        super(RecordingCache, self).__init__(capacity)
+        self.new_items = []
+
+    def put(self, word, segments):
+        if word not in self:
+            self.new_items.append((word, segments))
+        super(RecordingCache, self).put(word, segments)
+
+    def pop_new_items(self):
+        items = self.new_items
+        self.new_items = []
+        return items
+
 def create_parser():
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -108,30 +144,42 @@ def create_parser():
         metavar="STR",
         help="Glossaries. The strings provided in glossaries will not be affected"+
              "by the BPE (i.e. they will neither be broken into subwords, nor concatenated with other subwords")
+    parser.add_argument(
+        '--num-workers', '--num_workers', type=int, default=1,
+        metavar="INT",
+        help="Number of processes segmenting the input in chunks, the output keeps the input order (default: %(default)s)")
+    parser.add_argument(
+        '--chunk-size', type=int, default=10000,
+        metavar="INT",
+        help="Number of lines of each chunk sent to a worker (default: %(default)s)")
+    parser.add_argument(
+        '--save-cache', type=str, default=None,
+        metavar="PATH",
+        help="Save the segmentations of the most recently used words, merged from the workers, as "+
+             "\"word segment1 segment2 ...\" lines. It can be loaded with the `cache_file` BPE option of NJUNMT "+
+             "to start with a warm cache, if the codes, separator and vocabulary are the same.")
+    parser.add_argument(
+        '--cache-size', type=int, default=100000,
+        metavar="INT",
+        help="Maximum number of words whose segmentations are cached, in each worker and "+
+             "in the saved cache (default: %(default)s)")
 
     return parser
 
-def get_pairs(word):
-    """Return set of symbol pairs in a word.
-
-    word is represented as tuple of symbols (symbols being variable-length strings)
-    """
-    pairs = set()
-    prev_char = word[0]
-    for char in word[1:]:
-        pairs.add((prev_char, char))
-        prev_char = char
-    return pairs
-
-def encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, glossaries=None, cache={}):
+def encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, glossaries=None, cache=None):
     """Encode word based on list of BPE merge operations, which are applied consecutively
+
+    cache is an `LRUCache` of the segmentations, or None
     """
 
-    if orig in cache:
-        return cache[orig]
+    if cache is not None:
+        word = cache.get(orig)
+        if word is not None:
+            return word
 
     if orig in glossaries:
-        cache[orig] = (orig,)
+        if cache is not None:
+            cache.put(orig, (orig,))
         return (orig,)
 
     if version == (0, 1):
@@ -141,39 +189,10 @@ def encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, glossa
     else:
         raise NotImplementedError
 
-    pairs = get_pairs(word)
-
-    if not pairs:
+    if len(word) < 2:
         return orig
 
-    while True:
-        bigram = min(pairs, key = lambda pair: bpe_codes.get(pair, float('inf')))
-        if bigram not in bpe_codes:
-            break
-        first, second = bigram
-        new_word = []
-        i = 0
-        while i < len(word):
-            try:
-                j = word.index(first, i)
-                new_word.extend(word[i:j])
-                i = j
-            except:
-                new_word.extend(word[i:])
-                break
-
-            if word[i] == first and i < len(word)-1 and word[i+1] == second:
-                new_word.append(first+second)
-                i += 2
-            else:
-                new_word.append(word[i])
-                i += 1
-        new_word = tuple(new_word)
-        word = new_word
-        if len(word) == 1:
-            break
-        else:
-            pairs = get_pairs(word)
+    word = merge_symbols(word, bpe_codes)
 
     # don't print end-of-word symbols
     if word[-1] == '</w>':
@@ -184,7 +203,8 @@ def encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, glossa
     if vocab:
         word = check_vocab_and_split(word, bpe_codes_reverse, vocab, separator)
 
-    cache[orig] = word
+    if cache is not None:
+        cache.put(orig, word)
     return word
 
 def recursive_split(segment, bpe_codes, vocab, separator, final=False):
@@ -269,6 +289,74 @@ def isolate_glossary(word, glossary):
         segments = [segment.strip() for split in splits[:-1] for segment in [split, glossary] if segment != '']
         return segments + [splits[-1].strip()] if splits[-1] != '' else segments
 
+def read_chunks(lines, chunk_size):
+    """Yield lists of at most chunk_size lines, without reading the whole input"""
+    lines = iter(lines)
+    while True:
+        chunk = list(itertools.islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+# the BPE object of each worker process, loaded once by `init_worker()`
+_worker_bpe = None
+
+def init_worker(codes, separator, vocab, glossaries, cache_size, record_cache):
+    global _worker_bpe
+    _worker_bpe = BPE(codecs.open(codes, encoding='utf-8'), separator, vocab, glossaries, cache_size)
+    if record_cache:
+        _worker_bpe.cache = RecordingCache(cache_size)
+
+def segment_chunk(lines):
+    """Segment a chunk of lines in a worker, returns the segmented lines and the
+    cache entries added by this chunk (empty if the cache is not recorded)"""
+    output = [_worker_bpe.segment(line).strip() for line in lines]
+    if isinstance(_worker_bpe.cache, RecordingCache):
+        return output, _worker_bpe.cache.pop_new_items()
+    return output, []
+
+def segment_parallel(lines, output, codes, separator, vocab, glossaries, num_workers, chunk_size,
+                     cache_size=100000, cache=None):
+    """Segment the lines in a pool of num_workers processes and write them in the input order.
+    At most 2 * num_workers chunks are in flight, so the memory does not grow with the input.
+    Each worker caches at most cache_size words. If cache is an `LRUCache`, the cache entries
+    of all workers are merged into it."""
+    pool = multiprocessing.Pool(num_workers, initializer=init_worker,
+                                initargs=(codes, separator, vocab, glossaries, cache_size,
+                                          cache is not None))
+    pending = deque()
+
+    def write_chunk(result):
+        lines, new_items = result.get()
+        for line in lines:
+            output.write(line)
+            output.write('\n')
+        if cache is not None:
+            for word, segments in new_items:
+                cache.put(word, segments)
+
+    try:
+        for chunk in read_chunks(lines, chunk_size):
+            pending.append(pool.apply_async(segment_chunk, (chunk,)))
+            if len(pending) >= 2 * num_workers:
+                write_chunk(pending.popleft())
+        while pending:
+            write_chunk(pending.popleft())
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def save_cache(cache, filename, signature):
+    """Save the segmentations as \"word segment1 segment2 ...\" lines after a
+    \"#signature: <hash>\" line, the format of `BPE.preload_cache()` in njunmt/data/bpe_encdec.py"""
+    with codecs.open(filename, 'w', encoding='utf-8') as fw:
+        fw.write('#signature: ' + signature + '\n')
+        for word, segments in cache.items():
+            fw.write(word + ' ' + ' '.join(segments) + '\n')
+
 if __name__ == '__main__':
 
     # python 2/3 compatibility
@@ -298,8 +386,16 @@ if __name__ == '__main__':
     else:
         vocabulary = None
 
-    bpe = BPE(args.codes, args.separator, vocabulary, args.glossaries)
+    bpe = BPE(args.codes, args.separator, vocabulary, args.glossaries, args.cache_size)
+    if args.num_workers > 1:
+        cache = LRUCache(args.cache_size) if args.save_cache else None
+        segment_parallel(args.input, args.output, args.codes.name, args.separator, vocabulary, args.glossaries,
+                         args.num_workers, args.chunk_size, args.cache_size, cache)
+    else:
+        for line in args.input:
+            args.output.write(bpe.segment(line).strip())
+            args.output.write('\n')
+        cache = bpe.cache
 
-    for line in args.input:
-        args.output.write(bpe.segment(line).strip())
-        args.output.write('\n')
+    if args.save_cache:
+        save_cache(cache, args.save_cache, bpe.signature())
@@ -16,8 +16,9 @@ from __future__ import unicode_literals
 import sys
 import codecs
 import re
-import copy
+import heapq
 import argparse
+import multiprocessing
 from collections import defaultdict, Counter
 
 # hack for python2/3 compatibility
@@ -46,6 +47,9 @@ def create_parser():
         help='Stop if no symbol pair has frequency >= FREQ (default: %(default)s))')
     parser.add_argument('--dict-input', action="store_true",
         help="If set, input file is interpreted as a dictionary where each line contains a word-count pair")
+    parser.add_argument(
+        '--num-workers', '--num_workers', type=int, default=1, metavar='INT',
+        help="Number of processes counting the words of the input file in shards (default: %(default)s))")
     parser.add_argument(
         '--verbose', '-v', action="store_true",
         help="verbose mode.")
@@ -65,6 +69,93 @@ def get_vocabulary(fobj, is_dict=False):
                 vocab[word] += 1
     return vocab
 
+def count_shard(filename, start, end):
+    """Count the words of the lines between the byte offsets start and end of a file"""
+    vocab = Counter()
+    with open(filename, 'rb') as fobj:
+        fobj.seek(start)
+        while fobj.tell() < end:
+            line = fobj.readline()
+            if not line:
+                break
+            for word in line.decode('utf-8').split():
+                vocab[word] += 1
+    return vocab
+
+def get_vocabulary_parallel(filename, num_workers):
+    """Count the words of a text file in num_workers shards split at line boundaries,
+    the same as get_vocabulary(), including the order of first occurrences
+    """
+    with open(filename, 'rb') as fobj:
+        fobj.seek(0, 2)
+        size = fobj.tell()
+        offsets = [0]
+        for k in range(1, num_workers):
+            fobj.seek(max(size * k // num_workers, offsets[-1]))
+            if fobj.tell() > 0:
+                # move to the start of the next line
+                fobj.seek(fobj.tell() - 1)
+                fobj.readline()
+            offsets.append(fobj.tell())
+        offsets.append(size)
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        shards = [pool.apply_async(count_shard, (filename, start, end))
+                  for start, end in zip(offsets[:-1], offsets[1:]) if start < end]
+        vocab = Counter()
+        # merge in the file order
+        for shard in shards:
+            vocab.update(shard.get())
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return vocab
+
+class _ReversedPair(object):
+    """Wraps a pair so that the larger pair is the smaller heap entry"""
+    __slots__ = ['pair']
+
+    def __init__(self, pair):
+        self.pair = pair
+
+    def __lt__(self, other):
+        return self.pair > other.pair
+
+class PairStats(defaultdict):
+    """Frequencies of symbol pairs with a heap of (frequency, pair) entries for max_pair().
+
+    Every assignment pushes a new entry, and the entries whose pairs have been
+    changed or deleted since are discarded lazily, so updating a frequency is
+    O(log n) instead of a max() over all pairs at every merge.
+    """
+
+    def __init__(self, *args):
+        super(PairStats, self).__init__(int, *args)
+        self._rebuild()
+
+    def _rebuild(self):
+        self._heap = [(-freq, _ReversedPair(pair)) for pair, freq in self.items()]
+        heapq.heapify(self._heap)
+
+    def __setitem__(self, pair, freq):
+        super(PairStats, self).__setitem__(pair, freq)
+        heapq.heappush(self._heap, (-freq, _ReversedPair(pair)))
+
+    def max_pair(self):
+        """Return the same pair as max(stats, key=lambda x: (stats[x], x))"""
+        if len(self._heap) > 4 * len(self) + 1000:
+            self._rebuild()
+        heap = self._heap
+        while True:
+            neg_freq, entry = heap[0]
+            pair = entry.pair
+            if pair in self and self[pair] == -neg_freq:
+                return pair
+            heapq.heappop(heap)
+
 def update_pair_statistics(pair, changed, stats, indices):
     """Minimally update the indices and frequency of symbol pairs
 
@@ -140,7 +231,7 @@ def get_pair_statistics(vocab):
             indices[prev_char, char][i] += 1
             prev_char = char
 
-    return stats, indices
+    return PairStats(stats), indices
 
 
 def replace_pair(pair, vocab, indices):
@@ -183,7 +274,7 @@ def prune_stats(stats, big_stats, threshold):
                 big_stats[item] = freq
 
 
-def main(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_dict=False):
+def main(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_dict=False, num_workers=1):
     """Learn num_symbols BPE operations from vocabulary, and write to outfile.
     """
 
@@ -191,23 +282,26 @@ def main(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_dict=F
     # version numbering allows bckward compatibility
     outfile.write('#version: 0.2\n')
 
-    vocab = get_vocabulary(infile, is_dict)
+    if num_workers > 1 and not is_dict and infile.name != '<stdin>':
+        vocab = get_vocabulary_parallel(infile.name, num_workers)
+    else:
+        vocab = get_vocabulary(infile, is_dict)
     vocab = dict([(tuple(x[:-1])+(x[-1]+'</w>',) ,y) for (x,y) in vocab.items()])
     sorted_vocab = sorted(vocab.items(), key=lambda x: x[1], reverse=True)
 
     stats, indices = get_pair_statistics(sorted_vocab)
-    big_stats = copy.deepcopy(stats)
+    big_stats = defaultdict(int, stats)
     # threshold is inspired by Zipfian assumption, but should only affect speed
     threshold = max(stats.values()) / 10
     for i in range(num_symbols):
         if stats:
-            most_frequent = max(stats, key=lambda x: (stats[x], x))
+            most_frequent = stats.max_pair()
 
         # we probably missed the best pair because of pruning; go back to full statistics
         if not stats or (i and stats[most_frequent] < threshold):
             prune_stats(stats, big_stats, threshold)
-            stats = copy.deepcopy(big_stats)
-            most_frequent = max(stats, key=lambda x: (stats[x], x))
+            stats = PairStats(big_stats)
+            most_frequent = stats.max_pair()
             # threshold is inspired by Zipfian assumption, but should only affect speed
             threshold = stats[most_frequent] * i/(i+10000.0)
             prune_stats(stats, big_stats, threshold)
@@ -247,4 +341,5 @@ if __name__ == '__main__':
     if args.output.name != '<stdout>':
         args.output = codecs.open(args.output.name, 'w', encoding='utf-8')
 
-    main(args.input, args.output, args.symbols, args.min_frequency, args.verbose, is_dict=args.dict_input)
+    main(args.input, args.output, args.symbols, args.min_frequency, args.verbose, is_dict=args.dict_input,
+         num_workers=args.num_workers)
@@ -103,6 +103,86 @@ def gather_states(states, beam_ids):
             _gather, nest.flatten(states)))
 
 
+def scatter_states(states, rows, num_rows, default_states=None):
+    """ Scatters states of the live rows back to their positions in
+    the full batch, the inverse of `gather_states(full_states, rows)`.
+
+    Args:
+        states: A Tensor of a list/tuple/dict of Tensors, whose first
+          dimension is the number of live rows.
+        rows: An int32 Tensor with shape [num_live_rows, ], the positions
+          of the live rows in the full batch.
+        num_rows: An int32 scalar, the size of the full batch.
+        default_states: A Tensor or a structure of Tensors with the same
+          structure as `states` and first dimension `num_rows`, filling
+          the positions not in `rows`. If not provided, they are zeros.
+
+    Returns: A Tensor or a list/tuple of Tensors with the same structure
+      as `states`.
+    """
+    indices = tf.expand_dims(rows, axis=1)
+
+    def _scatter(x, default=None):
+        assert isinstance(x, tf.Tensor)
+        shape = tf.concat([[num_rows], tf.shape(x)[1:]], axis=0)
+        scattered = tf.scatter_nd(indices, x, shape)
+        if default is None:
+            return scattered
+        mask = tf.scatter_nd(indices, tf.ones_like(rows), [num_rows]) > 0
+        return tf.where(mask, scattered, default)
+
+    if default_states is None:
+        scattered_states = nest.map_structure(_scatter, nest.flatten(states))
+    else:
+        scattered_states = nest.map_structure(
+            _scatter, nest.flatten(states), nest.flatten(default_states))
+    return nest.pack_sequence_as(states, scattered_states)
+
+
+def select_live_rows(finished, live_rows, beam_size):
+    """ Selects the live rows belonging to sentences that still have
+    unfinished beams.
+
+    Args:
+        finished: A bool Tensor with shape [batch_size * beam_size, ], the
+          finished flags of the full batch.
+        live_rows: An int32 Tensor with shape [num_live * beam_size, ],
+          the positions of the rows of live sentences in the full batch,
+          with the beams of each sentence kept contiguous.
+        beam_size: A python integer, the beam width.
+
+    Returns: An int32 Tensor, the indices into `live_rows` of the rows
+      to keep, with the beams of each sentence kept contiguous.
+    """
+    # [num_live, beam_size]
+    live_finished = tf.reshape(tf.gather(finished, live_rows), [-1, beam_size])
+    sentence_alive = tf.logical_not(tf.reduce_all(live_finished, axis=1))
+    row_alive = tf.reshape(expand_to_beam_size(sentence_alive, beam_size, axis=1), [-1])
+    return tf.to_int32(tf.reshape(tf.where(row_alive), [-1]))
+
+
+def live_rows_shape_invariants(loop_vars):
+    """ Returns the shape invariants of `loop_vars` for the early-exit
+    decoding, where the number of rows of the inputs and the cache shrinks.
+
+    Args:
+        loop_vars: A list of loop variables of `tf.while_loop`.
+
+    Returns: A structure of `tf.TensorShape` with the same structure as
+      `loop_vars`, whose first dimensions are unknown.
+    """
+
+    def _invariant(x):
+        if isinstance(x, tf.TensorArray):
+            return tf.TensorShape(None)
+        shape = x.get_shape()
+        if shape.ndims is None or shape.ndims == 0:
+            return shape
+        return tf.TensorShape([None]).concatenate(shape[1:])
+
+    return nest.map_structure(_invariant, loop_vars)
+
+
 def finished_beam_one_entry_bias(on_entry, num_entries):
     """ Builds a bias vector to be added to log_probs of a finished beam.
 
@@ -183,6 +263,53 @@ def compute_length_penalty(lengths, alpha):
     return ((5.0 + tf.to_float(lengths)) / 6.0) ** (-alpha)
 
 
+def greedy_decoding_result(timesteps, log_probs, lengths, ids_ta):
+    """ Packs the results of greedy search as the results of beam search
+    with beam_size=1.
+
+    Args:
+        timesteps: An int32 scalar, the number of decoding steps.
+        log_probs: The accumulated log probabilities, with shape [batch_size, ].
+        lengths: The decoding lengths, with shape [batch_size, ].
+        ids_ta: A TensorArray of the sampled ids of each step.
+
+    Returns: A dict containing hypothesis, log probabilities, beam ids and
+      decoding length, like the one returned by beam search.
+    """
+    batch_size = tf.shape(log_probs)[0]
+    return {"beam_ids": tf.tile(tf.expand_dims(tf.range(batch_size), 0), [timesteps, 1]),
+            "log_probs": tf.expand_dims(log_probs, 0),
+            "decoding_length": lengths,
+            "hypothesis": tf.transpose(ids_ta.stack())}
+
+
+def compute_labels_length_limit(feature_length, maximum_labels_length,
+                                ratio=None, offset=0, override=None):
+    """ Computes the maximum decoding length of each sentence, given by
+    min(`maximum_labels_length`, `ratio` * source_length + `offset`).
+
+    Args:
+        feature_length: The source length tensor, with shape [batch_size, ].
+        maximum_labels_length: A python integer, the maximum decoding length
+          of any sentence.
+        ratio: A python float. If None, the limit of each sentence is
+          `maximum_labels_length`.
+        offset: A python integer.
+        override: An int32 tensor with shape [batch_size, ]. The positive
+          values replace the computed limits, no more than
+          `maximum_labels_length` either.
+
+    Returns: An int32 tensor with shape [batch_size, ].
+    """
+    limit = tf.fill(tf.shape(feature_length), maximum_labels_length)
+    if ratio is not None:
+        limit = tf.minimum(
+            limit, tf.to_int32(ratio * tf.to_float(feature_length)) + offset)
+    if override is not None:
+        limit = tf.where(override > 0, tf.minimum(override, maximum_labels_length), limit)
+    return tf.maximum(limit, 1)
+
+
 def process_beam_predictions(decoding_result, beam_size, alpha):
     """ Processes beam search results.
 
@@ -260,7 +260,12 @@ def update_infer_params(
         model_configs,
         beam_size=None,
         maximum_labels_length=None,
-        length_penalty=None):
+        max_length_ratio=None,
+        max_length_offset=None,
+        length_penalty=None,
+        early_exit=None,
+        preallocate_cache=None,
+        use_shortlist=None):
     """ Resets inference-specific parameters.
 
     Args:
@@ -269,8 +274,18 @@ def update_infer_params(
            "model_params".
         maximum_labels_length: The maximum length of sequence that model generates,
           if provided, pass it to `model_configs`'s "model_params".
+        max_length_ratio: The ratio of the maximum length of each sequence to
+          its source length, if provided, pass it to `model_configs`'s "model_params".
+        max_length_offset: The offset added to `max_length_ratio` * source length,
+          if provided, pass it to `model_configs`'s "model_params".
         length_penalty: The length penalty, if provided, pass it to
           `model_configs`'s "model_params".
+        early_exit: Whether to drop finished sentences from beam search, if
+          provided, pass it to `model_configs`'s "model_params".
+        preallocate_cache: Whether to preallocate the decoder self-attention
+          cache, if provided, pass it to `model_configs`'s "model_params".
+        use_shortlist: Whether to feed the target vocabulary shortlist, if
+          provided, pass it to `model_configs`'s "model_params".
 
     Returns: An updated dict.
     """
@@ -278,8 +293,18 @@ def update_infer_params(
         model_configs["model_params"]["inference.beam_size"] = beam_size
     if maximum_labels_length is not None:
         model_configs["model_params"]["inference.maximum_labels_length"] = maximum_labels_length
+    if max_length_ratio is not None:
+        model_configs["model_params"]["inference.max_length_ratio"] = max_length_ratio
+    if max_length_offset is not None:
+        model_configs["model_params"]["inference.max_length_offset"] = max_length_offset
     if length_penalty is not None:
         model_configs["model_params"]["inference.length_penalty"] = length_penalty
+    if early_exit is not None:
+        model_configs["model_params"]["inference.early_exit"] = early_exit
+    if preallocate_cache is not None:
+        model_configs["model_params"]["inference.preallocate_cache"] = preallocate_cache
+    if use_shortlist is not None:
+        model_configs["model_params"]["inference.use_shortlist"] = use_shortlist
     return model_configs
 
 
@@ -82,6 +82,8 @@ class Constants:
     FEATURE_LENGTH_NAME = concat_name(FEATURE_NAME_PREFIX, LENGTH_NAME)
     LABEL_IDS_NAME = concat_name(LABEL_NAME_PREFIX, IDS_NAME)
     LABEL_LENGTH_NAME = concat_name(LABEL_NAME_PREFIX, LENGTH_NAME)
+    SHORTLIST_IDS_NAME = concat_name("shortlist", IDS_NAME)
+    LABEL_LENGTH_LIMIT_NAME = concat_name(LABEL_LENGTH_NAME, "limit")
 
     # verbose prefix for training hooks
     HOOK_VERBOSE_PREFIX = " ---hook order: "
@@ -27,6 +27,7 @@ from njunmt.utils.beam_search import finished_beam_one_entry_bias
 from njunmt.utils.beam_search import expand_to_beam_size
 from njunmt.utils.beam_search import compute_batch_indices
 from njunmt.utils.beam_search import gather_states
+from njunmt.utils.beam_search import stack_beam_size
 from njunmt.utils.beam_search import compute_length_penalty
 
 
@@ -87,6 +88,11 @@ class Feedback:
         """Returns the vocabulary. """
         return self._vocab
 
+    @property
+    def maximum_labels_length(self):
+        """ Returns the maximum sequence length that decoder generates. """
+        return self._maximum_labels_length
+
     @abstractmethod
     def init_symbols(self, *args, **kwargs):
         """ Returns the first input symbols of the decoder. """
@@ -187,7 +193,8 @@ class BeamFeedback(Feedback):
 
     def __init__(self, vocab, maximum_labels_length,
                  batch_size, beam_size, alpha=None,
-                 ensemble_weight=None):
+                 ensemble_weight=None, shortlist_ids=None,
+                 labels_length_limit=None):
         """ Initializes the feedback for beam search.
 
         Args:
@@ -201,12 +208,31 @@ class BeamFeedback(Feedback):
               Refer to https://arxiv.org/abs/1609.08144.
             ensemble_weight: None or a list of floats to average the log
               probabilities from many models..
+            shortlist_ids: An int32 Tensor with shape [shortlist_size, ]
+              including the EOS id. If provided, the logits only cover
+              these target words, and the sampled ids are mapped back to
+              the target vocabulary.
+            labels_length_limit: An int32 Tensor with shape [batch_size, ],
+              the maximum sequence length of each sentence, no more than
+              `maximum_labels_length`. If not provided, it is
+              `maximum_labels_length` for all sentences.
         """
         super(BeamFeedback, self).__init__(vocab, maximum_labels_length)
         self._batch_size = batch_size
         self._beam_size = beam_size
         self._alpha = alpha
         self._ensemble_weights = ensemble_weight
+        self._shortlist_ids = shortlist_ids
+        self._num_entries = self._vocab.vocab_size
+        self._eos_entry = self._vocab.eos_id
+        if shortlist_ids is not None:
+            self._num_entries = tf.size(shortlist_ids)
+            self._eos_entry = tf.to_int32(tf.reduce_min(
+                tf.where(tf.equal(shortlist_ids, self._vocab.eos_id))))
+        self._labels_length_limit = self._maximum_labels_length
+        if labels_length_limit is not None:
+            # [batch_size * beam_size, ]
+            self._labels_length_limit = stack_beam_size(labels_length_limit, beam_size)
 
     def init_symbols(self):
         """ Returns a tuple `(init_finished_flags, init_input_symbols)`, where
@@ -239,7 +265,7 @@ class BeamFeedback(Feedback):
         else:
             assert len(logits) == len(self._ensemble_weights), (
                 "ensemble weights must have the same length with logits")
-            dim_vocab = logits[0].get_shape().as_list()[-1]
+            dim_vocab = tf.shape(logits[0])[-1]
             # [1, batch_size * beam_size * vocab_target]
             probs = nest.map_structure(
                 lambda x: tf.expand_dims(
@@ -255,7 +281,8 @@ class BeamFeedback(Feedback):
             probs = tf.log(tf.reshape(probs, [-1, dim_vocab]))
         return probs
 
-    def sample_symbols(self, logits, log_probs, finished, lengths, time):
+    def sample_symbols(self, logits, log_probs, finished, lengths, time,
+                       batch_size=None):
         """ Samples symbols and returns it.
 
         Args:
@@ -268,6 +295,9 @@ class BeamFeedback(Feedback):
             lengths: The length of each beam in each batch, a int32 Tensor with
               shape [beam_size * batch_size, ].
             time: A int32 Scalar, the current time.
+            batch_size: The number of sentences in `logits`, if not provided,
+              the batch size of this helper is used. The early-exit decoding
+              passes the number of unfinished sentences.
 
         Returns: A tuple `(word_ids, beam_ids, next_log_probs, next_lengths)`, where
           `words_ids` is the ids of sampled word symbols; `beam_ids` indicates the index
@@ -276,6 +306,8 @@ class BeamFeedback(Feedback):
           each beam.
           All of the Tensors have shape [batch_size * beam_size, ].
         """
+        if batch_size is None:
+            batch_size = self._batch_size
         # [batch_size * beam_size,]
         prev_finished_float = tf.to_float(finished)
         # [batch_size * beam_size, ]
@@ -287,10 +319,10 @@ class BeamFeedback(Feedback):
         #   [target_vocab_size, ]: [float_min, float_min, float_min, ..., 0]
         #   this forces the beam with EOS continue to generate EOS
         finished_beam_bias = finished_beam_one_entry_bias(
-            on_entry=self._vocab.eos_id, num_entries=self._vocab.vocab_size)
+            on_entry=self._eos_entry, num_entries=self._num_entries)
         # [batch_size * beam_size, target_vocab_size]: outer product
         finished_beam_bias = expand_to_beam_size(
-            finished_beam_bias, self._beam_size * self._batch_size, axis=0)
+            finished_beam_bias, self._beam_size * batch_size, axis=0)
         finished_beam_bias *= tf.expand_dims(prev_finished_float, 1)
         # compute new probs, with finished flags & mask
         probs = probs * tf.expand_dims(1. - prev_finished_float, 1) + finished_beam_bias
@@ -307,11 +339,11 @@ class BeamFeedback(Feedback):
 
         # flatten: [batch_size, beam_size * target_vocab_size]
         scores = tf.reshape(tf.reshape(scores, [-1]),
-                            [self._batch_size, -1])
+                            [batch_size, -1])
         scores_flat = tf.cond(
             tf.convert_to_tensor(time) > 0, lambda: scores,  # time > 0: all
             lambda: tf.slice(scores, [0, 0],
-                             [-1, self._vocab.vocab_size]))  # time = 0: first logits in each batch
+                             [-1, self._num_entries]))  # time = 0: first logits in each batch
 
         # [batch_size, beam_size] will restore top live_k
         sample_scores, sample_ids = tf.nn.top_k(scores_flat, k=self._beam_size)
@@ -320,15 +352,17 @@ class BeamFeedback(Feedback):
 
         # because we do topk to scores with dim:[batch, beam * vocab]
         #   we need to cover the true word ids
-        word_ids = tf.mod(sample_ids, self._vocab.vocab_size)
+        word_ids = tf.mod(sample_ids, self._num_entries)
+        if self._shortlist_ids is not None:
+            word_ids = tf.gather(self._shortlist_ids, word_ids)
 
         # find beam_ids, indicating the current position is from which beam
         #  batch_pos, [batch_size, beam_size]: [[0, 0, ...], [1, 1,...], ..., [batch_size,...] ]
-        batch_pos = compute_batch_indices(self._batch_size, self._beam_size)
+        batch_pos = compute_batch_indices(batch_size, self._beam_size)
         #  beam_base_pos: [batch_size * beam_size,]: [0, 0, ..., beam, beam,..., 2beam, 2beam, ...]
         beam_base_pos = tf.reshape(batch_pos * self._beam_size, [-1])
         # compute new beam_ids, [batch_size * beam_size, ]
-        beam_ids = tf.div(sample_ids, self._vocab.vocab_size) + beam_base_pos
+        beam_ids = tf.div(sample_ids, self._num_entries) + beam_base_pos
 
         # gather states according to beam_ids
         next_lengths = gather_states(lengths, beam_ids)
@@ -336,7 +370,7 @@ class BeamFeedback(Feedback):
         # we need to recover log_probs according to scores's topk ids
         # [batch_size * beam_size * vocab_size, ]
         log_probs_flat = tf.reshape(log_probs, [-1])
-        log_probs_index = beam_base_pos * self._vocab.vocab_size + sample_ids
+        log_probs_index = beam_base_pos * self._num_entries + sample_ids
         next_log_probs = tf.gather(log_probs_flat, log_probs_index)
 
         return word_ids, beam_ids, next_log_probs, next_lengths
@@ -355,12 +389,87 @@ class BeamFeedback(Feedback):
           Tensor with shape [batch_size * beam_size, ]
         """
         next_time = time + 1
-        finished = tf.logical_or((next_time >= self._maximum_labels_length),
+        finished = tf.logical_or((next_time >= self._labels_length_limit),
                                  tf.equal(self._vocab.eos_id, sample_ids))
 
         return finished, sample_ids
 
 
+class GreedyFeedback(BeamFeedback):
+    """ Define a helper class for greedy inference, i.e. beam search with
+    beam_size=1, which picks the best symbol of each sentence by argmax and
+    never reorders the decoding states. """
+
+    def __init__(self, vocab, maximum_labels_length,
+                 batch_size, alpha=None, ensemble_weight=None,
+                 shortlist_ids=None, labels_length_limit=None):
+        """ Initializes the feedback for greedy search.
+
+        Args:
+            vocab: A `Vocab` object.
+            maximum_labels_length: A python integer, the maximum sequence
+              length that decoder generates.
+            batch_size: The batch size.
+            alpha: The length penalty rate, only used for scoring the
+              hypothesis.
+            ensemble_weight: None or a list of floats to average the log
+              probabilities from many models..
+            shortlist_ids: An int32 Tensor with shape [shortlist_size, ]
+              including the EOS id. If provided, the logits only cover
+              these target words, and the sampled ids are mapped back to
+              the target vocabulary.
+            labels_length_limit: An int32 Tensor with shape [batch_size, ],
+              the maximum sequence length of each sentence.
+        """
+        super(GreedyFeedback, self).__init__(
+            vocab=vocab, maximum_labels_length=maximum_labels_length,
+            batch_size=batch_size, beam_size=1, alpha=alpha,
+            ensemble_weight=ensemble_weight, shortlist_ids=shortlist_ids,
+            labels_length_limit=labels_length_limit)
+
+    def sample_symbols(self, logits, log_probs, finished, lengths, time,
+                       batch_size=None):
+        """ Samples symbols and returns it.
+
+        Args:
+            logits: The logits Tensor with shape [batch_size, vocab_size],
+              or a list of logits Tensors.
+            log_probs: Accumulated log probabilities, a float32 Tensor with shape
+              [batch_size, ].
+            finished: Finished flag of each sentence, a bool Tensor with
+              shape [batch_size, ].
+            lengths: The length of each sentence, a int32 Tensor with
+              shape [batch_size, ].
+            time: A int32 Scalar, the current time.
+            batch_size: Unused, for the same signature as `BeamFeedback`.
+
+        Returns: A tuple `(word_ids, next_log_probs, next_lengths)`, where
+          `words_ids` is the ids of sampled word symbols (EOS for finished
+          sentences); `next_log_probs` is the accumulated log probabilities;
+          `next_lengths` is the decoding lengths.
+          All of the Tensors have shape [batch_size, ].
+        """
+        _ = time, batch_size
+        logits = nest.flatten(logits)
+        if len(logits) == 1:
+            # log softmax is monotonic, only the best entry is normalized
+            word_entries = tf.to_int32(tf.argmax(logits[0], axis=1))
+            word_log_probs = tf.reduce_max(logits[0], axis=1) \
+                             - tf.reduce_logsumexp(logits[0], axis=1)
+        else:
+            probs = self._compute_log_probs(logits)
+            word_entries = tf.to_int32(tf.argmax(probs, axis=1))
+            word_log_probs = tf.reduce_max(probs, axis=1)
+        word_ids = word_entries
+        if self._shortlist_ids is not None:
+            word_ids = tf.gather(self._shortlist_ids, word_entries)
+        # the finished sentences keep generating EOS with probability 1
+        word_ids = tf.where(finished, tf.fill(tf.shape(word_ids), self._vocab.eos_id), word_ids)
+        next_log_probs = log_probs + word_log_probs * (1. - tf.to_float(finished))
+        next_lengths = lengths + 1 - tf.to_int32(finished)
+        return word_ids, next_log_probs, next_lengths
+
+
 if __name__ == "__main__":
     a = tf.convert_to_tensor([[1, 2, 3], [4, 5, 6]], dtype=tf.int32)
     a_t = _transpose_batch_time(a)
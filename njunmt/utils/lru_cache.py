@@ -0,0 +1,95 @@
+# Copyright 2017 Natural Language Processing Group, Nanjing University, zhaocq.nlp@gmail.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Define a bounded least-recently-used cache. """
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """ A thread-safe dict-like cache holding at most `capacity` entries,
+    evicting the least recently used one when full. """
+
+    def __init__(self, capacity):
+        """ Initializes the cache.
+
+        Args:
+            capacity: The maximum number of entries, 0 disables caching.
+        """
+        self._capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """ Returns the value of `key` and marks it as recently used,
+        or `default` if `key` is not cached. """
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """ Caches `value` under `key`, evicting the least recently
+        used entries if the cache is full. """
+        if self._capacity <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def items(self):
+        """ Returns a list of (key, value) pairs, from the least to the
+        most recently used. """
+        with self._lock:
+            return list(self._entries.items())
+
+    def clear(self):
+        """ Drops all entries, keeping the counters. """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """ Returns a dict of the cache size and the counters. """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self._entries),
+                    "capacity": self._capacity,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "hit_rate": (self.hits / lookups) if lookups > 0 else 0.}
@@ -11,16 +11,16 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+import sys
 import socket
 import jieba
 import re
-import json
-
-# jieba.initialize()
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from bin.framing import read_frame, write_frame
 
-def wrap_message(**args):
-    return bytes(json.dumps(args), encoding="UTF-8")
+# jieba.initialize()
 
 
 class NJUNMTClient(object):
@@ -34,8 +34,7 @@ class NJUNMTClient(object):
         self.reg_remove_space = re.compile('[ \t]') 
 
     def close(self):
-        request = wrap_message(command="control", data="close")
-        self.socket.sendall(request)
+        write_frame(self.socket, command="control", content="close")
         self.socket.close()
 
     def preprocess(self, s):
@@ -55,7 +54,6 @@ class NJUNMTClient(object):
             print("{} source: {}".format(user_ip, source))
         # 对文本进行前处理
         source = self.preprocess(source)
-        request = wrap_message(type="translate", data=source)
 
         if debug:
             print("{} source (preprocessed): {}".format(user_ip, source))
@@ -63,17 +61,15 @@ class NJUNMTClient(object):
         
         # self.socket.connect(self.addr)
         # 发送处理后的文本至服务端
-        self.socket.sendall(request)
+        write_frame(self.socket, command="translate", content=source)
         print("sent")
         # 接收服务端返回的翻译结果
-        response = str(self.socket.recv(1024*1024*8).strip(), 'UTF-8')
+        response = read_frame(self.socket)
         print("reveived")
 
         if debug:
             print("{} translation: {}".format(user_ip, response))
 
-        response = json.loads(response.strip())
-
         print(response["translation"])
         return response
 
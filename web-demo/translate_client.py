@@ -11,25 +11,17 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+import sys
 import socket
 import jieba
 import re
-import json
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from bin.framing import read_frame, write_frame
 
-# jieba.initialize()
-
-
-def wrap_message(**args):
-    # return bytes(json.dumps(args), encoding="UTF-8")
-    return json.dumps(args).encode()
 
-
-def unwrap_message(json_str):
-    try:
-        return json.loads(json_str.decode())
-    except:
-        return {"command": "control", "content": "error"}
+# jieba.initialize()
 
 
 class NJUNMTClient(object):
@@ -43,8 +35,7 @@ class NJUNMTClient(object):
         self.reg_remove_space = re.compile('[ \t]+')
 
     def close(self):
-        request = wrap_message(command="control", data="close")
-        self.socket.sendall(request)
+        write_frame(self.socket, command="control", content="close")
         self.socket.close()
 
     def preprocess(self, s):
@@ -66,16 +57,16 @@ class NJUNMTClient(object):
         if commnad == "translate":
             content = self.preprocess(content)
 
-        request = wrap_message(command=commnad, content=content)
-
         if debug:
             print("{} source (preprocessed): {}".format(user_ip, content))
 
         # 发送处理后的文本至服务端
-        self.socket.sendall(request)
+        write_frame(self.socket, command=commnad, content=content)
 
         # 接收服务端返回的翻译结果
-        response = unwrap_message(self.socket.recv(1024 * 1024 * 8).strip())
+        response = read_frame(self.socket)
+        if response is None:
+            raise socket.error("Connection closed by the server.")
 
         if debug:
             print("{} translation: {}".format(user_ip, response))